@@ -1,62 +1,163 @@
-import boto.ec2 as ec2
-import boto.ec2.autoscale as a
-import boto.ec2.elb as elb
-import boto.ec2.cloudwatch as cloudwatch
-from boto3.session import Session
 import logging
+import threading
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 
 
 class AWSConn(object):
 
+  THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException']
+
   @staticmethod
-  def aws_conn_auto(region, profile='default'):
-    try:
-      conn = a.connect_to_region(region, profile_name=profile)
-      return conn
-    except Exception as e:
-      logging.error("Unable to connect to region, please investigate: {0}".format(e))
+  def get_boto3_session(region, profile='default'):
+    from boto3.session import Session
+    return Session(region_name=region, profile_name=profile)
 
   @staticmethod
-  def aws_conn_ec2(region, profile='default'):
-    try:
-      conn = ec2.connect_to_region(region, profile_name=profile)
-      return conn
-    except Exception as e:
-      logging.error("Unable to connect to region, please investigate: {0}".format(e))
+  def get_boto3_client(client_type, region, profile='default', session=None):
+    if not session:
+      session = AWSConn.get_boto3_session(region, profile)
+    return session.client(client_type)
 
   @staticmethod
-  def aws_conn_elb(region, profile='default'):
-    try:
-      conn = elb.connect_to_region(region, profile_name=profile)
-      return conn
-    except Exception as e:
-      logging.error("Unable to connect to region, please investigate: {0}".format(e))
+  def error_code(error):
+    """ AWS error code of a botocore exception, None for any other error """
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
 
   @staticmethod
-  def aws_conn_cloudwatch(region, profile='default'):
-    try:
-      conn = cloudwatch.connect_to_region(region, profile_name=profile)
-      return conn
-    except Exception as e:
-      logging.error("Unable to connect to region, please investigate: {0}".format(e))
+  def tag_dict(tags):
+    """ {Key: Value} of a boto3 Tags list """
+    return dict((tag['Key'], tag['Value']) for tag in tags or [])
 
   @staticmethod
-  def get_boto3_client(client_type, region, profile='default', session=None):
-    if not session:
-      session = Session(region_name=region, profile_name=profile)
-    return session.client(client_type)
+  def is_throttling_error(error):
+    return AWSConn.error_code(error) in AWSConn.THROTTLING_ERROR_CODES
 
   @staticmethod
   def load_config(config):
     with open(config, 'r') as stream:
       return yaml.safe_load(stream)
 
+  @staticmethod
+  def available_regions():
+    """ Regions known to the endpoint data bundled with botocore, no network call needed """
+    from botocore.session import get_session
+    return get_session().get_available_regions('ec2')
+
   @staticmethod
   def determine_region(reg):
-    reg_list = [region.name for region in ec2.regions()]
+    reg_list = AWSConn.available_regions()
     if reg in reg_list:
       return reg
     else:
       logging.warning("Unable to get region info. Environment requested: {0}. Regions available: {1}. Returning the default region of us-west-1".format(reg, reg_list))
       return 'us-west-1' #Returning us-west-1 as a default region
+
+
+class AWSClients(object):
+  """ Registry that builds one boto3 client per service on first use, all sharing one session
+
+  Operations are called on the clients directly, or handed to submit to run on worker threads. The clients are
+  thread safe and keep a pool of MAX_WORKERS connections each, so the workers never queue up behind the pool.
+  """
+
+  MAX_WORKERS = 10
+
+  BOTO3_CLIENTS = {
+    'asg': 'autoscaling',
+    'ec2': 'ec2',
+    'elb': 'elb',
+    'elb2': 'elbv2',
+    'cloudformation_client': 'cloudformation',
+    'sqs': 'sqs',
+    'cloudwatch': 'cloudwatch',
+  }
+
+  def __init__(self, region, profile='default', session=None, metrics=None, pool=None, limiter=None):
+    self.region = region
+    self.profile = profile
+    self._session = session
+    self.metrics = metrics
+    self.pool = pool
+    if limiter is None:
+      from .rate_limiter import RateLimiter
+      limiter = RateLimiter.shared(region, profile)
+    self.limiter = limiter
+    self._clients = {}
+    self._executor = None
+    self._lock = threading.RLock()
+
+  @property
+  def session(self):
+    with self._lock:
+      if not self._session:
+        self._session = AWSConn.get_boto3_session(self.region, self.profile)
+      return self._session
+
+  def get(self, name):
+    with self._lock:
+      if name not in self._clients:
+        shared = self.pool is not None and name in self.BOTO3_CLIENTS
+        client = self.pool.clients(self.region, self.profile).get(name) if shared else self.build(name)
+        self._clients[name] = self.metrics.instrument(name, client, shared) if self.metrics else client
+      return self._clients[name]
+
+  def set(self, name, client):
+    with self._lock:
+      self._clients[name] = client
+
+  def is_built(self, name):
+    return name in self._clients
+
+  def build(self, name):
+    """ New client, rate limited by the limiter of its account and region """
+    if name in self.BOTO3_CLIENTS:
+      from botocore.config import Config
+      client = self.session.client(self.BOTO3_CLIENTS[name], config=Config(max_pool_connections=self.MAX_WORKERS))
+      return self.limiter.wrap(name, client)
+    raise Exception("Unknown AWS client: {0}".format(name))
+
+  def call(self, name, operation, **kwargs):
+    """ Run an operation of the named client, e.g. call('ec2', 'describe_images', ImageIds=[ami_id]) """
+    return getattr(self.get(name), operation)(**kwargs)
+
+  def submit(self, name, operation, **kwargs):
+    """ Run an operation on the worker threads and return its concurrent.futures Future
+
+    Threads wait on future.result(), asyncio code awaits asyncio.wrap_future(future).
+    """
+    return self.executor.submit(self.call, name, operation, **kwargs)
+
+  @property
+  def executor(self):
+    with self._lock:
+      if not self._executor:
+        self._executor = ThreadPoolExecutor(self.MAX_WORKERS)
+      return self._executor
+
+  def shutdown(self):
+    """ Stop the worker threads once the operations submitted so far are done """
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor:
+      executor.shutdown()
+
+
+class ClientPool(object):
+  """ Long lived registries, one per region and profile, whose boto3 clients (thread safe) are shared between deploys """
+
+  def __init__(self):
+    self._registries = {}
+    self._lock = threading.Lock()
+
+  def clients(self, region, profile='default'):
+    with self._lock:
+      key = (region, profile)
+      if key not in self._registries:
+        self._registries[key] = AWSClients(region, profile)
+      return self._registries[key]
+
+
+def lazy_client(name):
+  """ Class attribute that resolves to the named client of the instance's AWSClients registry """
+  return property(lambda self: self.clients.get(name), lambda self, client: self.clients.set(name, client))
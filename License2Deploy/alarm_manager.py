@@ -0,0 +1,31 @@
+import logging
+from .batching import Batcher
+
+
+class AlarmManager(object):
+  """ Lists CloudWatch alarms page by page and toggles their actions in batches """
+
+  MAX_ALARMS_PER_CALL = 100
+  PAGE_SIZE = 100
+
+  def __init__(self, cloudwatch):
+    self.cloudwatch = cloudwatch
+
+  def find_alarm_names(self, matches, name_prefix=None):
+    """ Names of the alarms accepted by matches, narrowed server side by name_prefix when given """
+    kwargs = {'AlarmNamePrefix': name_prefix} if name_prefix else {}
+    alarms = Batcher.boto3_pages(self.cloudwatch.describe_alarms, 'MetricAlarms', MaxRecords=self.PAGE_SIZE, **kwargs)
+    return [alarm['AlarmName'] for alarm in alarms if matches(alarm['AlarmName'])]
+
+  def disable_alarms(self, alarm_names):
+    for batch in self.batches(alarm_names):
+      self.cloudwatch.disable_alarm_actions(AlarmNames=batch)
+      logging.info("Disabled cloud-watch alarms. {0}".format(batch))
+
+  def enable_alarms(self, alarm_names):
+    for batch in self.batches(alarm_names):
+      self.cloudwatch.enable_alarm_actions(AlarmNames=batch)
+      logging.info("Enabled cloud-watch alarms. {0}".format(batch))
+
+  def batches(self, alarm_names):
+    return Batcher(self.MAX_ALARMS_PER_CALL).chunks(alarm_names)
@@ -0,0 +1,188 @@
+import logging
+import threading
+from .AWSConn import ClientPool
+from .batching import Batcher
+from .cancellation import DeployCancelled
+from .poller import Poller
+
+
+class AMIReadiness(object):
+  """ Waits for the AMIs of several regions at once, each one being usable as soon as it is available
+
+  AMIs are added one by one, from a {region: ami_id} map, or as copies of a source AMI to target regions, the
+  copies being made once the source is available. Every poll describes the pending AMIs of each region in one
+  describe_images call per profile, the regions being described concurrently, and polls back off from 5 seconds
+  up to max_delay. AMIs are keyed by (region, requested AMI), the requested AMI of a copy being its source AMI.
+  A region and profile failing to describe MAX_ERRORS polls in a row fails its AMIs, and cancelling token fails
+  every pending AMI right away.
+  """
+
+  TIMEOUT = 20 * 60
+  FAILED_STATES = ['invalid', 'deregistered', 'failed', 'error']
+  MAX_ERRORS = 3
+
+  def __init__(self, amis=None, profile=None, timeout=TIMEOUT, max_delay=30, client_pool=None, histogram=None,
+               token=None):
+    self.timeout = timeout
+    self.max_delay = max_delay
+    self.client_pool = client_pool or ClientPool()
+    self.histogram = histogram
+    self.token = token
+    self.batcher = Batcher(max_workers=10)
+    self.images = {}
+    self.profiles = {}
+    self.copies = {}
+    self.names = {}
+    self.errors = {}
+    self.describe_errors = {}
+    self.finished = set()
+    self.condition = threading.Condition()
+    self.sleep = None
+    self._thread = None
+    for region, ami_id in (amis or {}).items():
+      self.add(region, ami_id, profile)
+
+  def add(self, region, ami_id, profile=None):
+    """ Wait for ami_id in region, read with profile """
+    key = (region, ami_id)
+    with self.condition:
+      if key not in self.images:
+        self.images[key] = ami_id
+        self.profiles[key] = profile
+    return key
+
+  def copy(self, source_region, source_ami_id, regions, profile=None):
+    """ Copy source_ami_id to every region once it is available, and wait for the copies """
+    keys = [self.add(source_region, source_ami_id, profile)]
+    with self.condition:
+      targets = self.copies.setdefault(keys[0], [])
+      for region in regions:
+        key = (region, source_ami_id)
+        if region != source_region and region not in targets:
+          targets.append(region)
+          self.images[key] = None
+          self.profiles[key] = profile
+        if key not in keys:
+          keys.append(key)
+    return keys
+
+  def ec2(self, region, profile=None):
+    return self.client_pool.clients(region, profile).get('ec2')
+
+  def pending(self):
+    with self.condition:
+      return [key for key, ami_id in self.images.items() if ami_id and key not in self.finished]
+
+  def finish(self, key, error=None):
+    with self.condition:
+      if key in self.finished:
+        return
+      if error:
+        self.errors[key] = error
+        logging.error(str(error))
+      else:
+        logging.info("AMI {0} is ready in {1}".format(self.images[key], key[0]))
+      self.finished.add(key)
+      self.condition.notify_all()
+    if not error and key in self.copies:
+      self.start_copies(key)
+
+  def start_copies(self, source):
+    """ Copy the now available source AMI to its target regions, ClientToken making a retried copy a no-op """
+    source_region, source_ami_id = source
+    def copy_to(region):
+      try:
+        ec2 = self.ec2(region, self.profiles[(region, source_ami_id)])
+        return ec2.copy_image(SourceRegion=source_region, SourceImageId=source_ami_id, Name=self.names[source],
+                              ClientToken='license2deploy-{0}-{1}'.format(source_ami_id, region))['ImageId']
+      except Exception as e:
+        return e
+    regions = self.copies[source]
+    for region, result in zip(regions, self.batcher.each(copy_to, regions)):
+      if isinstance(result, Exception):
+        self.finish((region, source_ami_id),
+                    Exception("Unable to copy AMI {0} to {1}: {2}".format(source_ami_id, region, result)))
+      else:
+        logging.info("Copying AMI {0} to {1} as {2}".format(source_ami_id, region, result))
+        with self.condition:
+          self.images[(region, source_ami_id)] = result
+
+  def poll(self):
+    """ Describe every pending AMI, one call per region and profile, and finish the ones available or failed """
+    groups = {}
+    for key in self.pending():
+      groups.setdefault((key[0], self.profiles[key]), []).append(key)
+    def describe(group):
+      region, profile = group
+      try:
+        images = self.ec2(region, profile).describe_images(ImageIds=[self.images[key] for key in groups[group]])['Images']
+        return dict((image['ImageId'], image) for image in images)
+      except Exception as e:
+        return e
+    for group, images in zip(list(groups), self.batcher.each(describe, list(groups))):
+      region = group[0]
+      if isinstance(images, Exception):
+        self.describe_errors[group] = self.describe_errors.get(group, 0) + 1
+        if self.describe_errors[group] < self.MAX_ERRORS:
+          # A copy may not be visible right after copy_image, the region is described again on the next poll
+          logging.warning("Unable to describe the AMIs of {0}: {1}".format(region, images))
+          continue
+        for key in groups[group]:
+          self.finish(key, Exception("Unable to describe AMI {0} in {1} after {2} attempts: {3}".format(
+            self.images[key], region, self.MAX_ERRORS, images)))
+        continue
+      self.describe_errors.pop(group, None)
+      for key in groups[group]:
+        ami_id = self.images[key]
+        state = images.get(ami_id, {}).get('State')
+        if state == 'available':
+          self.names[key] = images[ami_id].get('Name')
+          self.finish(key)
+        elif state in self.FAILED_STATES:
+          self.finish(key, Exception("AMI {0} is {1} in {2}".format(ami_id, state, region)))
+        else:
+          logging.warning("AMI {0} is not ready yet in {1}, state is {2}".format(ami_id, region, state))
+    with self.condition:
+      return len(self.finished) == len(self.images)
+
+  def run(self):
+    """ Poll until every AMI is finished, failing the ones still pending once time is up or the token is cancelled """
+    poller = Poller(self.timeout, max_delay=self.max_delay, name='ami', histogram=self.histogram, token=self.token)
+    if self.sleep:
+      poller.sleep = self.sleep
+    error = None
+    try:
+      ready = poller.wait(self.poll)
+    except (Exception, DeployCancelled) as e:
+      ready, error = False, e
+    if not ready:
+      with self.condition:
+        keys = [key for key in self.images if key not in self.finished]
+      for key in keys:
+        self.finish(key, error or Exception("AMI {0} is not ready in {1} after {2} minutes, please investigate".format(
+          self.images[key] or key[1], key[0], self.timeout // 60)))
+
+  def start(self):
+    """ Poll in a background thread, wait and wait_any returning as the AMIs finish """
+    self._thread = threading.Thread(target=self.run, name='ami-readiness')
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def wait_any(self, keys, timeout=None):
+    """ Block until one of keys is finished, or timeout seconds, and return the finished keys """
+    with self.condition:
+      finished = [key for key in keys if key in self.finished]
+      if not finished:
+        self.condition.wait(timeout)
+        finished = [key for key in keys if key in self.finished]
+      return finished
+
+  def wait(self, region, ami_id):
+    """ The available AMI in region for the requested ami_id, raising if it failed """
+    key = (region, ami_id)
+    while not self.wait_any([key], 1):
+      pass
+    if key in self.errors:
+      raise self.errors[key]
+    return self.images[key]
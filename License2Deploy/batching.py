@@ -0,0 +1,45 @@
+from multiprocessing.pool import ThreadPool
+
+
+class Batcher(object):
+  """ Splits id lists into API sized chunks, describes the chunks concurrently and merges every page """
+
+  def __init__(self, chunk_size=100, max_workers=4):
+    self.chunk_size = chunk_size
+    self.max_workers = max_workers
+
+  def chunks(self, ids):
+    ids = list(ids)
+    return [ids[i:i + self.chunk_size] for i in range(0, len(ids), self.chunk_size)]
+
+  def map(self, func, ids):
+    """ Call func with every chunk of ids, in threads when there is more than one chunk """
+    return self.each(func, self.chunks(ids))
+
+  def each(self, func, items):
+    """ Call func with every item, in threads when there is more than one item, results in the order of items """
+    items = list(items)
+    if len(items) <= 1 or self.max_workers <= 1:
+      return [func(item) for item in items]
+    pool = ThreadPool(min(self.max_workers, len(items)))
+    try:
+      return pool.map(func, items)
+    finally:
+      pool.close()
+      pool.join()
+
+  def collect(self, func, ids):
+    """ Call func with every chunk of ids and concatenate the lists it returns, in the order of the chunks """
+    return [item for items in self.map(func, ids) for item in items]
+
+  @staticmethod
+  def boto3_pages(call, result_key, token_key='NextToken', request_token_key=None, **kwargs):
+    """ Follow NextToken (or Marker/NextMarker) through a boto3 operation and return the items of every page """
+    items = []
+    while True:
+      page = call(**kwargs)
+      items.extend(page.get(result_key, []))
+      next_token = page.get(token_key)
+      if not next_token:
+        return items
+      kwargs[request_token_key or token_key] = next_token
@@ -0,0 +1,110 @@
+import logging
+from datetime import datetime, timedelta
+from time import sleep
+from .batching import Batcher
+
+
+class CanaryMetric(object):
+  """ CloudWatch metric published per instance (InstanceId dimension), compared between canary and baseline """
+
+  def __init__(self, namespace, name, statistic='Average'):
+    self.namespace = namespace
+    self.name = name
+    self.statistic = statistic
+
+  @classmethod
+  def parse(cls, spec):
+    """ Metric from NAMESPACE:METRIC[:STATISTIC], e.g. AWS/EC2:CPUUtilization:Average """
+    parts = spec.split(':')
+    if len(parts) not in (2, 3) or not all(parts):
+      raise ValueError("Canary metric {0} should look like NAMESPACE:METRIC[:STATISTIC]".format(spec))
+    return cls(*parts)
+
+  def __str__(self):
+    return '{0}:{1}:{2}'.format(self.namespace, self.name, self.statistic)
+
+
+class CanaryAnalysis(object):
+  """ Compares the CloudWatch metrics of canary instances against a sample of the instances they will replace
+
+  A metric fails when the canary average is above the baseline average and more than max_ratio times it, so a
+  canary reporting errors fails against a baseline reporting none. A metric without datapoints on the canary or
+  the baseline fails too, a canary that does not publish being no evidence it is healthy, unless allow_missing_data.
+
+  Load balancer latency and 5xx metrics are published per load balancer or target group, mixing the canary with
+  the baseline, so the default is the one metric EC2 publishes per instance: CPUUtilization.
+  """
+
+  DEFAULT_METRICS = ['AWS/EC2:CPUUtilization:Average']
+  BASELINE_SIZE = 10
+  MAX_QUERIES_PER_CALL = 100
+
+  def __init__(self, cloudwatch, metrics=None, max_ratio=1.5, period=60, allow_missing_data=False):
+    self.cloudwatch = cloudwatch
+    self.metrics = [CanaryMetric.parse(spec) for spec in (metrics or self.DEFAULT_METRICS)]
+    self.max_ratio = max_ratio
+    self.period = period
+    self.allow_missing_data = allow_missing_data
+    self.batcher = Batcher(self.MAX_QUERIES_PER_CALL)
+    self.sleep = sleep
+
+  def metric_values(self, instance_ids, start, end):
+    """ Every datapoint of every metric of the instances, as {metric: {instance_id: [values]}} """
+    queries = []
+    for metric in self.metrics:
+      for instance_id in instance_ids:
+        queries.append((metric, instance_id, {
+          'Id': 'm{0}'.format(len(queries)),
+          'MetricStat': {
+            'Metric': {'Namespace': metric.namespace, 'MetricName': metric.name,
+                       'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}]},
+            'Period': self.period,
+            'Stat': metric.statistic,
+          },
+        }))
+    results = {}
+    # A query spanning several pages comes back once per page, with the next part of its values each time
+    for result in self.batcher.collect(
+        lambda chunk: Batcher.boto3_pages(self.cloudwatch.get_metric_data, 'MetricDataResults',
+                                          MetricDataQueries=[query for metric, instance_id, query in chunk],
+                                          StartTime=start, EndTime=end),
+        queries):
+      results.setdefault(result['Id'], []).extend(result['Values'])
+    values = dict((str(metric), {}) for metric in self.metrics)
+    for metric, instance_id, query in queries:
+      values[str(metric)][instance_id] = results.get(query['Id'], [])
+    return values
+
+  @staticmethod
+  def average(values_by_instance):
+    values = [value for values in values_by_instance.values() for value in values]
+    return float(sum(values)) / len(values) if values else None
+
+  def compare(self, canary_ids, baseline_ids, start, end):
+    """ Failures of the canary against the baseline over [start, end], an empty list when the canary is good """
+    baseline_ids = sorted(baseline_ids)[:self.BASELINE_SIZE]
+    values = self.metric_values(list(canary_ids) + baseline_ids, start, end)
+    failures = []
+    for metric in self.metrics:
+      by_instance = values[str(metric)]
+      canary = self.average(dict((i, by_instance[i]) for i in canary_ids))
+      baseline = self.average(dict((i, by_instance[i]) for i in baseline_ids))
+      if canary is None or baseline is None:
+        missing = ' and '.join(side for side, average in [('canary', canary), ('baseline', baseline)] if average is None)
+        if self.allow_missing_data:
+          logging.warning("No datapoints of {0} on the {1}, skipping it".format(metric, missing))
+        else:
+          failures.append("{0} has no datapoints on the {1}".format(metric, missing))
+        continue
+      logging.info("Canary {0}: {1:.2f}, baseline {2:.2f}".format(metric, canary, baseline))
+      if canary > baseline and canary > baseline * self.max_ratio:
+        failures.append("{0} is {1:.2f} on the canary against {2:.2f} on the baseline".format(metric, canary, baseline))
+    return failures
+
+  def observe(self, canary_ids, baseline_ids, window):
+    """ Let the canary take traffic for window seconds, then compare it against the baseline over that window """
+    start = datetime.utcnow()
+    logging.info("Watching canary {0} against baseline for {1} seconds".format(sorted(canary_ids), window))
+    self.sleep(window)
+    end = datetime.utcnow()
+    return self.compare(canary_ids, baseline_ids, start - timedelta(seconds=self.period), end)
@@ -0,0 +1,46 @@
+import logging
+import os
+import threading
+
+
+class DeployCancelled(BaseException):
+  """ Raised out of the waits of a cancelled deploy
+
+  Like KeyboardInterrupt it is not an Exception, so the except Exception rollbacks along the way do not catch it
+  and the deploy goes straight to the bounded cleanup of its caller.
+  """
+
+
+class CancellationToken(object):
+  """ Shared by every wait of a deploy, cancelling it wakes them all up at once instead of at the end of a sleep """
+
+  def __init__(self):
+    self.reason = None
+    self._event = threading.Event()
+
+  def cancel(self, reason='cancelled'):
+    self.reason = self.reason or reason
+    self._event.set()
+
+  def is_cancelled(self):
+    return self._event.is_set()
+
+  def check(self):
+    if self._event.is_set():
+      raise DeployCancelled(self.reason)
+
+  def sleep(self, seconds):
+    """ Sleep for seconds, raising DeployCancelled as soon as the token is cancelled """
+    self._event.wait(seconds)
+    self.check()
+
+
+def start_watchdog(timeout, code=2):
+  """ Exit the process with code after timeout seconds, whatever the cleanup is still doing """
+  def expire():
+    logging.error("Cleanup did not finish within {0} seconds, exiting".format(timeout))
+    os._exit(code)
+  watchdog = threading.Timer(timeout, expire)
+  watchdog.daemon = True
+  watchdog.start()
+  return watchdog
@@ -0,0 +1,48 @@
+import json
+import os
+import re
+from time import time
+from .instrumentation import DeployMetrics
+
+
+class DeployCheckpoint(object):
+  """ Last state a deploy completed and what it had learned by then, saved as JSON after every transition
+
+  Without a path nothing is saved and there is never anything to resume from.
+  """
+
+  DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.license2deploy', 'checkpoints')
+
+  def __init__(self, path):
+    self.path = path
+
+  @classmethod
+  def default_path(cls, directory, *names):
+    """ Checkpoint file of a deploy target in directory (DEFAULT_DIRECTORY if None), named after the parts that identify it """
+    name = '-'.join(re.sub(r'[^A-Za-z0-9_.-]+', '_', str(part)) for part in names if part)
+    return os.path.join(directory or cls.DEFAULT_DIRECTORY, '{0}.json'.format(name))
+
+  def load(self):
+    """ Saved checkpoint, None if there is none """
+    if not self.path or not os.path.exists(self.path):
+      return None
+    try:
+      with open(self.path) as stream:
+        return json.load(stream)
+    except Exception as e:
+      raise Exception("Unable to read checkpoint {0}: {1}".format(self.path, e))
+
+  def save(self, state, data):
+    checkpoint = dict(data)
+    checkpoint.update({'state': state, 'updated': time()})
+    if not self.path:
+      return checkpoint
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    DeployMetrics.write_atomically(self.path, json.dumps(checkpoint, indent=2, sort_keys=True))
+    return checkpoint
+
+  def clear(self):
+    if self.path and os.path.exists(self.path):
+      os.remove(self.path)
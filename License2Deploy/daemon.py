@@ -0,0 +1,279 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+from sys import exit
+from time import sleep, time
+from .AWSConn import ClientPool
+from .cancellation import DeployCancelled, start_watchdog
+from .orchestrator import DeployOrchestrator
+from .rolling_deploy import RollingDeploy
+from .set_logging import SetLogging
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn, UnixStreamServer
+
+
+class DeployConflict(Exception):
+  """ Another job is already deploying the same target """
+
+
+class DeployDaemon(object):
+  """ Runs deploy jobs on a bounded worker pool, one job at a time per autoscale group, reusing AWS clients between jobs
+
+  Jobs are told apart by the (region, profile, autoscale group name) their deploy resolves to. A job whose group
+  name is known when it is submitted, given or remembered from an earlier job, takes its group right away and is
+  refused on a conflict. Any other job takes its group once the deploy has found it, failing on a conflict.
+  """
+
+  def __init__(self, workers=4, deploy_class=RollingDeploy, client_pool=None,
+               shutdown_timeout=RollingDeploy.SHUTDOWN_TIMEOUT):
+    self.workers = workers
+    self.shutdown_timeout = shutdown_timeout
+    self.cancelled = threading.Event()
+    self.deploy_class = deploy_class
+    self.client_pool = client_pool or ClientPool()
+    self.pool = ThreadPool(workers)
+    self.jobs = {}
+    self.active_targets = {}
+    self.job_targets = {}
+    self.active_deploys = {}
+    self.asg_names = {}
+    self._lock = threading.Lock()
+
+  def submit(self, target):
+    """ Queue a deploy of target, refused while another job is deploying the same autoscale group """
+    if not isinstance(target, dict) or not target.get('env') or not target.get('project'):
+      raise ValueError("A deploy job needs at least env and project")
+    label = DeployOrchestrator.target_label(target)
+    settings = dict((key, value) for key, value in target.items() if key != 'wave')
+    with self._lock:
+      if not settings.get('asg_name') and label in self.asg_names:
+        settings['asg_name'] = self.asg_names[label]
+    settings['client_pool'] = self.client_pool
+    try:
+      deploy = self.deploy_class(**settings)
+    except Exception as e:
+      raise ValueError("Invalid deploy job: {0}".format(e))
+    job = {'id': uuid.uuid4().hex, 'target': label, 'status': 'queued', 'submitted': time(),
+           'started': None, 'finished': None}
+    with self._lock:
+      if deploy.asg_name:
+        self.take_target(job, deploy)
+      self.jobs[job['id']] = job
+    self.pool.apply_async(self.run_job, (job, deploy))
+    return dict(job)
+
+  def take_target(self, job, deploy):
+    """ Give the autoscale group of deploy to job, raising DeployConflict if another job has it, under _lock """
+    key = (deploy.region, deploy.profile_name, deploy.asg_name)
+    owner = self.active_targets.get(key)
+    if owner and owner != job['id']:
+      raise DeployConflict("Job {0} is already deploying {1}".format(owner, '/'.join(str(part) for part in key)))
+    self.active_targets[key] = job['id']
+    self.job_targets[job['id']] = key
+
+  def release_target(self, job):
+    """ Give back the autoscale group of job, under _lock """
+    key = self.job_targets.pop(job['id'], None)
+    if key:
+      self.active_targets.pop(key, None)
+
+  def run_job(self, job, deploy):
+    threading.current_thread().name = job['target']
+    if self.cancelled.is_set():
+      job.update({'status': 'cancelled', 'finished': time()})
+      with self._lock:
+        self.release_target(job)
+      return
+    job.update({'status': 'running', 'started': time()})
+    with self._lock:
+      self.active_deploys[job['id']] = deploy
+    try:
+      if self.cancelled.is_set():
+        deploy.cancel('cancelled')
+      with self._lock:
+        found = job['id'] in self.job_targets
+      if not found:
+        deploy.get_asg_info()
+        with self._lock:
+          self.take_target(job, deploy)
+      deploy.deploy()
+      with self._lock:
+        self.asg_names[job['target']] = deploy.asg_name
+      job['status'] = 'succeeded'
+    except DeployConflict as e:
+      logging.error("Deploy job {0} of {1} refused: {2}".format(job['id'], job['target'], e))
+      job.update({'status': 'failed', 'error': str(e)})
+    except DeployCancelled as e:
+      logging.error("Deploy job {0} of {1} cancelled by {2}, cleaning up".format(job['id'], job['target'], e))
+      with self._lock:
+        self.asg_names.pop(job['target'], None)
+      job.update({'status': 'cancelled', 'error': str(e)})
+      deploy.abort(self.shutdown_timeout)
+    except Exception as e:
+      logging.error("Deploy job {0} of {1} failed: {2}".format(job['id'], job['target'], e))
+      with self._lock:
+        self.asg_names.pop(job['target'], None)
+      job.update({'status': 'failed', 'error': str(e)})
+      self.enable_alarms(deploy)
+    finally:
+      job['finished'] = time()
+      if hasattr(deploy, 'metrics'):
+        job['report'] = deploy.metrics.report()
+      with self._lock:
+        self.active_deploys.pop(job['id'], None)
+        self.release_target(job)
+
+  def enable_alarms(self, deploy):
+    try:
+      deploy.enable_project_cloudwatch_alarms()
+    except Exception as e:
+      logging.error("Unable to re-enable alarms: {0}".format(e))
+
+  def cancel(self, reason='cancelled'):
+    """ Cancel the queued and running jobs, then wait for the running ones to clean up, used on shutdown """
+    self.cancelled.set()
+    with self._lock:
+      deploys = list(self.active_deploys.values())
+    for deploy in deploys:
+      deploy.cancel(reason)
+    deadline = time() + self.shutdown_timeout
+    while time() < deadline:
+      with self._lock:
+        if not self.active_deploys:
+          return True
+      sleep(0.1)
+    return False
+
+  def job(self, job_id):
+    with self._lock:
+      return dict(self.jobs[job_id]) if job_id in self.jobs else None
+
+  def list_jobs(self):
+    with self._lock:
+      return sorted((dict((k, v) for k, v in job.items() if k != 'report') for job in self.jobs.values()),
+                    key=lambda job: job['submitted'])
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
+
+
+class DeployRequestHandler(BaseHTTPRequestHandler):
+  """ JSON API of the daemon: POST /deploys, GET /deploys, GET /deploys/<id> and GET /health """
+
+  def do_GET(self):
+    daemon = self.server.deploy_daemon
+    parts = [part for part in self.path.split('?')[0].split('/') if part]
+    if parts == ['health']:
+      return self.respond(200, {'status': 'ok', 'workers': daemon.workers})
+    if parts == ['deploys']:
+      return self.respond(200, {'jobs': daemon.list_jobs()})
+    if len(parts) == 2 and parts[0] == 'deploys':
+      job = daemon.job(parts[1])
+      return self.respond(200, job) if job else self.respond(404, {'error': 'No such job'})
+    self.respond(404, {'error': 'Not found'})
+
+  def do_POST(self):
+    if self.path.split('?')[0].rstrip('/') != '/deploys':
+      return self.respond(404, {'error': 'Not found'})
+    try:
+      body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+      job = self.server.deploy_daemon.submit(json.loads(body.decode('utf-8') or '{}'))
+    except DeployConflict as e:
+      return self.respond(409, {'error': str(e)})
+    except ValueError as e:
+      return self.respond(400, {'error': str(e)})
+    self.respond(202, job)
+
+  def respond(self, status, payload):
+    body = json.dumps(payload, sort_keys=True).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    logging.info("{0} {1}".format(self.address_string(), format % args))
+
+  def address_string(self):
+    return self.client_address[0] if self.client_address else 'unix'
+
+
+class DaemonHTTPServer(ThreadingMixIn, HTTPServer):
+  """ The API over TCP, unauthenticated: it must only listen on a loopback address """
+
+  daemon_threads = True
+
+  def __init__(self, address, daemon):
+    HTTPServer.__init__(self, address, DeployRequestHandler)
+    self.deploy_daemon = daemon
+
+
+class DaemonUnixServer(ThreadingMixIn, UnixStreamServer):
+  """ The API over a Unix socket only the user running the daemon can connect to """
+
+  daemon_threads = True
+
+  def __init__(self, path, daemon):
+    if os.path.exists(path):
+      os.remove(path)
+    UnixStreamServer.__init__(self, path, DeployRequestHandler)
+    self.deploy_daemon = daemon
+    self.server_name = 'localhost'
+    self.server_port = 0
+
+  def server_bind(self):
+    # The socket is created with mode 0600 rather than chmod-ed after bind, leaving no window for other users
+    umask = os.umask(0o177)
+    try:
+      UnixStreamServer.server_bind(self)
+    finally:
+      os.umask(umask)
+
+
+def get_args(): # pragma: no cover
+  parser = argparse.ArgumentParser(description='Serve rolling deploys over a local HTTP API, reusing AWS clients between deploys')
+  parser.add_argument('-l', '--listen', action='store', dest='listen', help='host:port to listen on, which must be a loopback address since the API is not authenticated', type=str, default='127.0.0.1:8400')
+  parser.add_argument('-u', '--socket', action='store', dest='socket', help='Unix socket to listen on instead of host:port, created with mode 0600', type=str)
+  parser.add_argument('-w', '--workers', action='store', dest='workers', help='Maximum number of deploys running at once', type=int, default=4)
+  parser.add_argument('--shutdown-timeout', action='store', dest='shutdown_timeout', help='Seconds allowed on SIGINT/SIGTERM for the running deploys to roll back and re-enable their alarms before exiting', type=int, default=RollingDeploy.SHUTDOWN_TIMEOUT)
+  return parser.parse_args()
+
+
+def main(): # pragma: no cover
+  args = get_args()
+  SetLogging.setup_logging(thread_names=True)
+  daemon = DeployDaemon(args.workers, shutdown_timeout=args.shutdown_timeout)
+  if args.socket:
+    server = DaemonUnixServer(args.socket, daemon)
+  else:
+    host, port = args.listen.rsplit(':', 1)
+    if host not in ('127.0.0.1', 'localhost', '::1'):
+      logging.warning("Listening on {0}, the API is not authenticated and should only listen on loopback".format(host))
+    server = DaemonHTTPServer((host, int(port)), daemon)
+
+  def signal_handler(signum, frame):
+    logging.warning("Received signal {0}, cancelling the deploy jobs".format(signum))
+    start_watchdog(args.shutdown_timeout + 5)
+    daemon.cancel("signal {0}".format(signum))
+    exit(2)
+  signal.signal(signal.SIGINT, signal_handler)
+  signal.signal(signal.SIGTERM, signal_handler)
+
+  logging.info("Accepting deploy jobs on {0}".format(args.socket or args.listen))
+  server.serve_forever()
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from math import ceil
+from time import time
+
+
+class DeployHistory(object):
+  """ SQLite store of how long the waits and phases of past deploys took, per project, env and instance type
+
+  Waits are named after their poller (creation, ready, health, only_new, pipeline, ami) and phases after the
+  deploy step that ran. Every deploy appends its durations, suggest_wait turns the recent ones into wait budgets.
+  """
+
+  DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.license2deploy', 'history.sqlite')
+  SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS durations (recorded REAL NOT NULL, project TEXT NOT NULL, env TEXT NOT NULL, "
+    "instance_type TEXT, kind TEXT NOT NULL, name TEXT NOT NULL, seconds REAL NOT NULL, status TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS durations_by_wait ON durations (project, env, kind, name, recorded)",
+  ]
+  RECENT = 50
+  MIN_SAMPLES = 5
+  MARGIN = 0.25
+  MIN_DEADLINE = 30
+  MIN_DELAY = 5
+  MAX_DELAY = 60
+
+  def __init__(self, path=None):
+    self.path = path or self.DEFAULT_PATH
+
+  def connect(self):
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    connection = sqlite3.connect(self.path, timeout=30)
+    for statement in self.SCHEMA:
+      connection.execute(statement)
+    return connection
+
+  def record(self, project, env, instance_type, status, waits, phases):
+    """ Append the waits ({name: [seconds]}) and phases ([{'name', 'duration'}]) of one deploy """
+    now = time()
+    rows = [(now, project, env, instance_type, 'wait', name, seconds, status)
+            for name, durations in sorted(waits.items()) for seconds in durations]
+    rows.extend((now, project, env, instance_type, 'phase', phase['name'], phase['duration'], status)
+                for phase in phases if phase['duration'] is not None)
+    with closing(self.connect()) as connection:
+      with connection:
+        connection.executemany("INSERT INTO durations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+  def durations(self, project, env, name, kind='wait', instance_type=None, status='succeeded', limit=RECENT):
+    """ Most recent durations of a wait or phase, of any instance type unless one is given """
+    query = "SELECT seconds FROM durations WHERE project = ? AND env = ? AND kind = ? AND name = ? AND status = ?"
+    params = [project, env, kind, name, status]
+    if instance_type:
+      query += " AND instance_type = ?"
+      params.append(instance_type)
+    with closing(self.connect()) as connection:
+      rows = connection.execute(query + " ORDER BY recorded DESC LIMIT ?", params + [limit]).fetchall()
+    return [row[0] for row in rows]
+
+  @staticmethod
+  def percentile(values, percent):
+    """ Nearest rank percentile, None for no values """
+    if not values:
+      return None
+    values = sorted(values)
+    return values[max(0, int(ceil(percent / 100.0 * len(values))) - 1)]
+
+  def suggest_wait(self, project, env, name, instance_type=None, margin=MARGIN):
+    """ (# of tries, interval) wait tuple covering p95 of recent successful waits plus margin, None without history
+
+    The interval polls about four times over a typical (p50) wait. Waits of the same instance type are used when
+    there are enough of them, any instance type otherwise.
+    """
+    samples = self.durations(project, env, name, instance_type=instance_type)
+    if len(samples) < self.MIN_SAMPLES and instance_type:
+      samples = self.durations(project, env, name)
+    if len(samples) < self.MIN_SAMPLES:
+      return None
+    deadline = max(self.percentile(samples, 95) * (1 + margin), self.MIN_DEADLINE)
+    delay = int(min(max(self.percentile(samples, 50) / 4, self.MIN_DELAY), self.MAX_DELAY))
+    return [int(ceil(deadline / delay)), delay]
+
+  def trend(self, project=None, env=None, days=30, kind=None):
+    """ Count, p50, p95 and slowest duration per day, project, env, kind and name over the last days """
+    query = "SELECT recorded, project, env, kind, name, seconds FROM durations WHERE recorded >= ? AND status = 'succeeded'"
+    params = [time() - days * 86400]
+    for column, value in [('project', project), ('env', env), ('kind', kind)]:
+      if value:
+        query += " AND {0} = ?".format(column)
+        params.append(value)
+    groups = {}
+    with closing(self.connect()) as connection:
+      for recorded, project_name, env_name, kind_name, name, seconds in connection.execute(query, params):
+        day = datetime.utcfromtimestamp(recorded).strftime('%Y-%m-%d')
+        groups.setdefault((day, project_name, env_name, kind_name, name), []).append(seconds)
+    return [{'day': day, 'project': project_name, 'env': env_name, 'kind': kind_name, 'name': name,
+             'count': len(values), 'p50': self.percentile(values, 50), 'p95': self.percentile(values, 95),
+             'max': max(values)}
+            for (day, project_name, env_name, kind_name, name), values in sorted(groups.items())]
+
+  @staticmethod
+  def format_trend(rows):
+    lines = ['{0:>10} {1:>20} {2:>5} {3:>5} {4:>24} {5:>5} {6:>8} {7:>8} {8:>8}'.format(
+      'day', 'project', 'env', 'kind', 'name', 'count', 'p50', 'p95', 'max')]
+    for row in rows:
+      lines.append('{day:>10} {project:>20} {env:>5} {kind:>5} {name:>24} {count:>5} {p50:>8.1f} {p95:>8.1f} {max:>8.1f}'.format(**row))
+    return '\n'.join(lines)
+
+
+def get_args(): # pragma: no cover
+  parser = argparse.ArgumentParser(description='Report how long the waits and phases of recent deploys took')
+  parser.add_argument('-p', '--project', action='store', dest='project', help='Project name', type=str)
+  parser.add_argument('-e', '--environment', action='store', dest='env', help='Environment e.g. qa, stg, prd', type=str)
+  parser.add_argument('-k', '--kind', action='store', dest='kind', help='Only waits or only phases', choices=['wait', 'phase'])
+  parser.add_argument('-d', '--days', action='store', dest='days', help='Number of days to report on', type=int, default=30)
+  parser.add_argument('--history-file', action='store', dest='history_file', help='Deploy history database', type=str)
+  parser.add_argument('--json', action='store_true', dest='json', help='Print the report as JSON instead of a table')
+  return parser.parse_args()
+
+
+def main(): # pragma: no cover
+  args = get_args()
+  logging.basicConfig(level=logging.ERROR)
+  rows = DeployHistory(args.history_file).trend(args.project and args.project.replace('-', ''), args.env, args.days, args.kind)
+  print(json.dumps(rows, indent=2, sort_keys=True) if args.json else DeployHistory.format_trend(rows))
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
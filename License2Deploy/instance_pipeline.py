@@ -0,0 +1,86 @@
+import logging
+from time import time
+
+
+class InstancePipeline(object):
+  """ Moves each new instance through created, status ok and lb healthy independently of the others """
+
+  STAGES = ['created', 'status_ok', 'healthy']
+
+  def __init__(self, deploy, group_name, expected_count, poller, lifecycle=None):
+    self.deploy = deploy
+    self.group_name = group_name
+    self.expected_count = expected_count
+    self.poller = poller
+    self.lifecycle = lifecycle
+    self.started = None
+    self.current_stage = {}
+    self.stage_times = {}
+
+  def instances_at(self, stage):
+    return sorted(instance_id for instance_id, current in self.current_stage.items() if current == stage)
+
+  def advance(self, instance_ids, stage):
+    now = time()
+    for instance_id in sorted(instance_ids):
+      self.current_stage[instance_id] = stage
+      self.stage_times.setdefault(instance_id, {})[stage] = now
+      logging.info("{0} reached stage {1} after {2:.0f} seconds".format(instance_id, stage, now - self.started))
+
+  def tick(self):
+    """ Run one polling round over every stage, return True once all expected instances are healthy """
+    if self.lifecycle:
+      created = lambda waiting: self.deploy.launched_instance_ids(self.lifecycle)
+    else:
+      created = lambda waiting: self.deploy.find_new_instance_ids(self.group_name)
+    transitions = [
+      (None, 'created', created),
+      ('created', 'status_ok', self.deploy.get_ready_instance_ids),
+      ('status_ok', 'healthy', self.deploy.get_healthy_instance_ids),
+    ]
+    for previous, stage, check in transitions:
+      waiting = self.instances_at(previous) if previous else []
+      if previous and not waiting:
+        continue
+      try:
+        reached = set(check(waiting))
+      except Exception as e:
+        logging.warning("Unable to check instances for stage {0}: {1}".format(stage, e))
+        continue
+      self.advance(reached.intersection(waiting) if previous else reached - set(self.current_stage), stage)
+    if self.lifecycle:
+      # instances that passed their status checks may join the load balancers
+      self.lifecycle.complete(self.instances_at('status_ok') + self.instances_at('healthy'))
+    return len(self.instances_at('healthy')) >= self.expected_count
+
+  def run(self):
+    """ Poll until every expected instance is healthy, raise once the poller runs out of time """
+    self.started = time()
+    if self.lifecycle:
+      self.poller.sleep = self.wait_for_events
+    if not self.poller.wait(self.tick):
+      raise Exception("Instances did not become healthy within {0} seconds, stuck in stages: {1}".format(
+        self.poller.timeout, dict((stage, self.instances_at(stage)) for stage in self.STAGES)))
+    self.log_stage_timings()
+    return self.instances_at('healthy')
+
+  def wait_for_events(self, seconds):
+    """ Wait on the lifecycle events in place of sleeping, cancelled along with the poller """
+    self.lifecycle.wait(seconds, self.poller.token)
+
+  def stage_durations(self):
+    """ Seconds each instance spent reaching every stage, counted from the previous stage """
+    durations = {}
+    for instance_id, times in self.stage_times.items():
+      previous = self.started
+      for stage in self.STAGES:
+        if stage not in times:
+          break
+        durations.setdefault(stage, {})[instance_id] = times[stage] - previous
+        previous = times[stage]
+    return durations
+
+  def log_stage_timings(self):
+    for stage, durations in sorted(self.stage_durations().items(), key=lambda item: self.STAGES.index(item[0])):
+      logging.info("Stage {0}: slowest {1:.0f}s, average {2:.0f}s over {3} instance(s)".format(
+        stage, max(durations.values()), sum(durations.values()) / len(durations), len(durations)))
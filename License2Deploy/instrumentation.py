@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+from .AWSConn import AWSConn
+
+
+class InstrumentedConnection(object):
+  """ Wraps a connection so every method call is timed and counted as one AWS call """
+
+  def __init__(self, connection, name, metrics):
+    self._connection = connection
+    self._name = name
+    self._metrics = metrics
+    self._operations = getattr(getattr(connection, 'meta', None), 'method_to_api_mapping', {})
+
+  def __getattr__(self, attr):
+    value = getattr(self._connection, attr)
+    if attr.startswith('_') or not callable(value):
+      return value
+    operation = self._operations.get(attr, attr)
+    def call(*args, **kwargs):
+      started = time()
+      try:
+        result = value(*args, **kwargs)
+      except Exception as e:
+        self._metrics.record_call(self._name, operation, time() - started, AWSConn.error_code(e) or 'Error')
+        raise
+      self._metrics.record_call(self._name, operation, time() - started)
+      return result
+    return call
+
+
+class DeployMetrics(object):
+  """ Times the phases of a deploy and counts the AWS calls made per client, operation and phase """
+
+  METRIC_PREFIX = 'license2deploy'
+
+  def __init__(self, labels=None):
+    self.labels = labels or {}
+    self.started = time()
+    self.status = 'failed'
+    self.phases = []
+    self.current_phase = None
+    self.api_calls = {}
+    self.rate_limiter = None
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def span(self, name):
+    phase = {'name': name, 'started': time(), 'duration': None, 'api_calls': 0, 'throttled': 0}
+    previous, self.current_phase = self.current_phase, phase
+    self.phases.append(phase)
+    try:
+      yield phase
+    finally:
+      phase['duration'] = time() - phase['started']
+      self.current_phase = previous
+      logging.info("Phase {0} took {1:.1f} seconds and {2} AWS call(s)".format(name, phase['duration'], phase['api_calls']))
+
+  def operation_stats(self, client, operation):
+    return self.api_calls.setdefault(client, {}).setdefault(
+      operation, {'calls': 0, 'seconds': 0.0, 'errors': 0, 'throttled': 0})
+
+  def record_call(self, client, operation, seconds, error_code=None):
+    throttled = int(error_code in AWSConn.THROTTLING_ERROR_CODES)
+    with self._lock:
+      stats = self.operation_stats(client, operation)
+      stats['calls'] += 1
+      stats['seconds'] += seconds
+      stats['errors'] += int(error_code is not None)
+      stats['throttled'] += throttled
+      if self.current_phase:
+        self.current_phase['api_calls'] += 1
+        self.current_phase['throttled'] += throttled
+
+  def record_throttled_retry(self, client, operation):
+    """ botocore retried a throttled request on its own, the call itself is recorded once it completes """
+    with self._lock:
+      self.operation_stats(client, operation)['throttled'] += 1
+      if self.current_phase:
+        self.current_phase['throttled'] += 1
+
+  def instrument(self, name, client, shared=False):
+    """ Return the client with every AWS call it makes recorded under name
+
+    boto3 clients are instrumented through their event hooks, unless they are shared with other deploys
+    in which case they are proxied so the calls of other deploys are not recorded.
+    """
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    if events is None or shared:
+      return InstrumentedConnection(client, name, self)
+    def before_call(context, **kwargs):
+      context['license2deploy_started'] = time()
+    def after_call(parsed, model, context, **kwargs):
+      error_code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+      self.record_call(name, model.name, time() - context.get('license2deploy_started', time()), error_code)
+    def needs_retry(response, operation, attempts, **kwargs):
+      if response and isinstance(response[1], dict) and response[1].get('Error', {}).get('Code') in AWSConn.THROTTLING_ERROR_CODES:
+        self.record_throttled_retry(name, operation.name)
+    events.register('before-call', before_call, unique_id='license2deploy-before-call')
+    events.register('after-call', after_call, unique_id='license2deploy-after-call')
+    events.register('needs-retry', needs_retry, unique_id='license2deploy-needs-retry')
+    return client
+
+  def report(self, extra=None):
+    report = {
+      'labels': self.labels,
+      'status': self.status,
+      'started': self.started,
+      'duration': time() - self.started,
+      'phases': [dict(phase) for phase in self.phases],
+      'api_calls': self.api_calls,
+      'total_api_calls': sum(stats['calls'] for ops in self.api_calls.values() for stats in ops.values()),
+    }
+    if self.rate_limiter:
+      report['rate_limits'] = self.rate_limiter.stats()
+    report.update(extra or {})
+    return report
+
+  def write_json(self, path, extra=None):
+    self.write_atomically(path, json.dumps(self.report(extra), indent=2, sort_keys=True))
+
+  def prometheus_lines(self):
+    def sample(metric, value, **labels):
+      labels.update(self.labels)
+      label_text = ','.join('{0}="{1}"'.format(key, str(labels[key]).replace('"', '\\"')) for key in sorted(labels))
+      return '{0}_{1}{{{2}}} {3}'.format(self.METRIC_PREFIX, metric, label_text, value)
+    lines = ['# TYPE {0}_deploy_duration_seconds gauge'.format(self.METRIC_PREFIX),
+             sample('deploy_duration_seconds', time() - self.started, status=self.status),
+             '# TYPE {0}_phase_duration_seconds gauge'.format(self.METRIC_PREFIX)]
+    lines.extend(sample('phase_duration_seconds', phase['duration'], phase=phase['name'])
+                 for phase in self.phases if phase['duration'] is not None)
+    for metric, field in [('aws_calls_total', 'calls'), ('aws_call_seconds_total', 'seconds'),
+                          ('aws_errors_total', 'errors'), ('aws_throttled_total', 'throttled')]:
+      lines.append('# TYPE {0}_{1} counter'.format(self.METRIC_PREFIX, metric))
+      lines.extend(sample(metric, stats[field], client=client, operation=operation)
+                   for client, operations in sorted(self.api_calls.items())
+                   for operation, stats in sorted(operations.items()))
+    rate_limits = sorted(self.rate_limiter.stats().items()) if self.rate_limiter else []
+    for metric, field, kind in [('rate_limit_wait_seconds_total', 'waited_seconds', 'counter'),
+                                ('rate_limit_waits_total', 'waits', 'counter'),
+                                ('rate_limit_throttles_total', 'throttles', 'counter'),
+                                ('rate_limit_requests_per_second', 'rate', 'gauge')]:
+      if rate_limits:
+        lines.append('# TYPE {0}_{1} {2}'.format(self.METRIC_PREFIX, metric, kind))
+        lines.extend(sample(metric, stats[field], family=family) for family, stats in rate_limits)
+    return lines
+
+  def write_textfile(self, path):
+    """ Prometheus textfile collector format, replaced atomically so a scrape never sees half a file """
+    self.write_atomically(path, '\n'.join(self.prometheus_lines()) + '\n')
+
+  @staticmethod
+  def write_atomically(path, content):
+    tmp_path = '{0}.tmp'.format(path)
+    with open(tmp_path, 'w') as stream:
+      stream.write(content)
+    os.rename(tmp_path, path)
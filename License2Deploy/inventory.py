@@ -0,0 +1,50 @@
+import threading
+from .AWSConn import AWSConn
+
+
+class InstanceInventory(object):
+  """ Instance records gathered from every describe of a deploy, so tag and IP lookups are answered locally
+
+  The id, private IP, instance type and BUILD tag of an instance do not change while it runs and are kept for the whole
+  deploy once known. Terminated instances are forgotten.
+  """
+
+  def __init__(self, describe):
+    self.describe = describe
+    self.records = {}
+    self._lock = threading.Lock()
+
+  def update(self, reservations):
+    """ Merge the instances of describe_instances reservations into the inventory and return the reservations """
+    with self._lock:
+      for instance in [inst for r in reservations for inst in r['Instances']]:
+        record = self.records.setdefault(instance['InstanceId'], {'id': instance['InstanceId']})
+        record['ip'] = instance.get('PrivateIpAddress') or record.get('ip')
+        record['build'] = AWSConn.tag_dict(instance.get('Tags')).get('BUILD', record.get('build'))
+        record['type'] = instance.get('InstanceType') or record.get('type')
+    return reservations
+
+  def refresh(self, instance_ids):
+    if instance_ids:
+      self.update(self.describe(sorted(instance_ids)))
+
+  def lookup(self, instance_ids, field):
+    """ Value of field for every instance, describing only the instances it is not known for yet """
+    self.refresh(set(i for i in instance_ids if self.get(i, field) is None))
+    return dict((instance_id, self.get(instance_id, field)) for instance_id in instance_ids)
+
+  def get(self, instance_id, field):
+    with self._lock:
+      return self.records.get(instance_id, {}).get(field)
+
+  def builds(self, instance_ids):
+    return self.lookup(instance_ids, 'build')
+
+  def ip_addrs(self, instance_ids):
+    return self.lookup(instance_ids, 'ip')
+
+  def forget(self, instance_ids):
+    """ Drop instances that were terminated, they will be described again if ever looked up """
+    with self._lock:
+      for instance_id in instance_ids:
+        self.records.pop(instance_id, None)
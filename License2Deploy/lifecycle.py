@@ -0,0 +1,162 @@
+import json
+import logging
+import threading
+from math import ceil
+from time import time
+
+try:
+  from Queue import Queue, Empty
+except ImportError:
+  from queue import Queue, Empty
+
+
+class SQSLifecycleQueue(object):
+  """ SQS queue the autoscale group sends its lifecycle notifications to
+
+  The queue may be shared with other groups and hooks. Only the events a deploy accepts are deleted, the others
+  become visible again after the visibility timeout of the queue, for whoever they are meant for.
+  """
+
+  MAX_WAIT = 20
+
+  def __init__(self, sqs, queue_url):
+    self.sqs = sqs
+    self.queue_url = queue_url
+    self._arn = None
+
+  @property
+  def arn(self):
+    if not self._arn:
+      attributes = self.sqs.get_queue_attributes(QueueUrl=self.queue_url, AttributeNames=['QueueArn'])
+      self._arn = attributes['Attributes']['QueueArn']
+    return self._arn
+
+  def receive(self, seconds, accept=None):
+    """ Lifecycle events accepted within seconds, returning as soon as there are any """
+    deadline = time() + seconds
+    while True:
+      wait = int(max(0, min(self.MAX_WAIT, ceil(deadline - time()))))
+      messages = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=10,
+                                          WaitTimeSeconds=wait).get('Messages', [])
+      events = [(message, json.loads(message['Body'])) for message in messages]
+      accepted = [(message, event) for message, event in events if not accept or accept(event)]
+      if accepted:
+        self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+          {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, (message, event) in enumerate(accepted)])
+        return [event for message, event in accepted]
+      if deadline - time() < 1:
+        return []
+
+
+class LocalLifecycleQueue(object):
+  """ In process stand-in for the SQS queue, events are put in by hand """
+
+  arn = None
+
+  def __init__(self):
+    self.queue = Queue()
+
+  def put(self, event):
+    self.queue.put(event)
+
+  def receive(self, seconds, accept=None):
+    events = []
+    try:
+      events.append(self.queue.get(timeout=seconds) if seconds > 0 else self.queue.get_nowait())
+      while True:
+        events.append(self.queue.get_nowait())
+    except Empty:
+      return [event for event in events if not accept or accept(event)]
+
+
+class LifecycleEvents(object):
+  """ Launch lifecycle hook of the autoscale group, so new instances are known the moment they launch
+
+  Launched instances wait in Pending:Wait, out of the load balancers, until their lifecycle action is completed.
+  """
+
+  HOOK_NAME = 'license2deploy-launch'
+  LAUNCHING = 'autoscaling:EC2_INSTANCE_LAUNCHING'
+  CANCEL_CHECK = 5
+
+  def __init__(self, asg, group_name, queue, role_arn=None, heartbeat_timeout=900):
+    self.asg = asg
+    self.group_name = group_name
+    self.queue = queue
+    self.role_arn = role_arn
+    self.heartbeat_timeout = heartbeat_timeout
+    self.pending = {}
+    self.launched = set()
+    self._lock = threading.Lock()
+
+  def register(self):
+    hook = {'LifecycleHookName': self.HOOK_NAME, 'AutoScalingGroupName': self.group_name,
+            'LifecycleTransition': self.LAUNCHING, 'HeartbeatTimeout': self.heartbeat_timeout,
+            'DefaultResult': 'ABANDON'}
+    if self.queue.arn:
+      hook['NotificationTargetARN'] = self.queue.arn
+    if self.role_arn:
+      hook['RoleARN'] = self.role_arn
+    self.asg.put_lifecycle_hook(**hook)
+    logging.info("Registered lifecycle hook {0} on {1}".format(self.HOOK_NAME, self.group_name))
+
+  def remove(self):
+    try:
+      self.asg.delete_lifecycle_hook(LifecycleHookName=self.HOOK_NAME, AutoScalingGroupName=self.group_name)
+      logging.info("Removed lifecycle hook {0} from {1}".format(self.HOOK_NAME, self.group_name))
+    except Exception as e:
+      logging.error("Unable to remove lifecycle hook {0}, please remove it by hand: {1}".format(self.HOOK_NAME, e))
+
+  def accepts(self, event):
+    """ Whether event is a launch of this group through this hook """
+    return (event.get('LifecycleTransition') == self.LAUNCHING and event.get('AutoScalingGroupName') == self.group_name
+            and event.get('LifecycleHookName') == self.HOOK_NAME)
+
+  def wait(self, seconds, token=None):
+    """ Wait up to seconds for lifecycle events, used in place of sleeping between polls
+
+    Given a CancellationToken, the queue is read CANCEL_CHECK seconds at a time and DeployCancelled is raised between
+    reads once the token is cancelled.
+    """
+    deadline = time() + seconds
+    while True:
+      if token:
+        token.check()
+      remaining = max(0, deadline - time())
+      events = self.queue.receive(min(remaining, self.CANCEL_CHECK) if token else remaining, self.accepts)
+      for event in events:
+        with self._lock:
+          self.pending[event['EC2InstanceId']] = event['LifecycleActionToken']
+          self.launched.add(event['EC2InstanceId'])
+        logging.info("{0} launched".format(event['EC2InstanceId']))
+      if events or time() >= deadline:
+        return
+
+  def launched_instance_ids(self):
+    """ Every instance announced since the hook was registered, whether or not its action is completed """
+    self.wait(0)
+    with self._lock:
+      return sorted(self.launched)
+
+  def release(self, instance_ids):
+    """ Complete the lifecycle action of instances by id, for instances whose launch event was not received """
+    for instance_id in instance_ids:
+      self.asg.complete_lifecycle_action(LifecycleHookName=self.HOOK_NAME, AutoScalingGroupName=self.group_name,
+                                         LifecycleActionResult='CONTINUE', InstanceId=instance_id)
+      logging.info("Released {0} from lifecycle hook {1}".format(instance_id, self.HOOK_NAME))
+
+  def complete(self, instance_ids, result='CONTINUE'):
+    """ Let waiting instances carry on with their launch, instances not waiting are skipped """
+    for instance_id in sorted(instance_ids):
+      with self._lock:
+        token = self.pending.pop(instance_id, None)
+      if token is None:
+        continue
+      try:
+        self.asg.complete_lifecycle_action(LifecycleHookName=self.HOOK_NAME, AutoScalingGroupName=self.group_name,
+                                           LifecycleActionToken=token, LifecycleActionResult=result,
+                                           InstanceId=instance_id)
+      except Exception as e:
+        logging.warning("Unable to complete the lifecycle action of {0}, will try again: {1}".format(instance_id, e))
+        with self._lock:
+          self.pending[instance_id] = token
@@ -0,0 +1,221 @@
+import argparse
+import json
+import logging
+import signal
+import threading
+from multiprocessing.pool import ThreadPool
+from sys import exit
+from time import time
+from .AWSConn import AWSConn
+from .ami_readiness import AMIReadiness
+from .cancellation import CancellationToken, DeployCancelled, start_watchdog
+from .rolling_deploy import RollingDeploy
+from .set_logging import SetLogging
+
+
+class DeployOrchestrator(object):
+  """ Runs the rolling deploys of several targets wave by wave, a bounded number of them at once
+
+  The AMIs of every target are waited for together from the start, each deploy starting as soon as the AMI of its
+  region is available. A target with source_ami_id and source_region deploys a copy of that AMI to its region.
+  Cancelling the orchestrator interrupts the AMI wait and cancels the running deploys, each one then cleaning up
+  within shutdown_timeout.
+  """
+
+  ORCHESTRATOR_SETTINGS = ['wave', 'amis', 'source_ami_id', 'source_region']
+
+  def __init__(self, targets, parallelism=2, stop_on_failure=True, debug=False, deploy_class=RollingDeploy,
+               ami_timeout=AMIReadiness.TIMEOUT, shutdown_timeout=RollingDeploy.SHUTDOWN_TIMEOUT):
+    self.targets = targets
+    self.parallelism = parallelism
+    self.stop_on_failure = stop_on_failure
+    self.debug = debug
+    self.deploy_class = deploy_class
+    self.ami_timeout = ami_timeout
+    self.shutdown_timeout = shutdown_timeout
+    self.ami_readiness = None
+    self.stopped = threading.Event()
+    self.cancelled = threading.Event()
+    self.token = CancellationToken()
+    self.active_deploys = {}
+    self.results = []
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def load_targets(config):
+    """ Read targets from a yaml file, each target inheriting the settings under 'defaults' """
+    conf = AWSConn.load_config(config)
+    defaults = conf.get('defaults', {})
+    targets = []
+    for target in conf.get('targets', []):
+      settings = dict(defaults)
+      settings.update(target)
+      targets.append(settings)
+    return targets
+
+  @staticmethod
+  def target_label(target):
+    return '{0}/{1}/{2}'.format(target.get('env'), target.get('region') or 'default',
+                                target.get('stack_name') or target.get('asg_name') or target.get('project'))
+
+  def waves(self):
+    waves = {}
+    for target in self.targets:
+      waves.setdefault(target.get('wave', 0), []).append(target)
+    return [waves[wave] for wave in sorted(waves)]
+
+  @staticmethod
+  def ami_key(target):
+    """ (region, requested AMI) to wait for before deploying the target, None without a region or an AMI """
+    region = target.get('region')
+    ami_id = target.get('source_ami_id') or target.get('ami_id') or (target.get('amis') or {}).get(region)
+    return (region, ami_id) if region and ami_id else None
+
+  def start_ami_readiness(self):
+    """ Start waiting for the AMI of every target, copying the source AMIs to the regions of their targets """
+    readiness = AMIReadiness(timeout=self.ami_timeout, token=self.token)
+    for target in self.targets:
+      key = self.ami_key(target)
+      if not key:
+        continue
+      if target.get('source_ami_id'):
+        readiness.copy(target.get('source_region') or key[0], key[1], [key[0]], target.get('profile_name'))
+      else:
+        readiness.add(key[0], key[1], target.get('profile_name'))
+    if readiness.images:
+      self.ami_readiness = readiness.start()
+
+  def ready_targets(self, wave):
+    """ (index, target) of every target of the wave, each one as soon as its AMI is available """
+    pending = list(enumerate(wave))
+    while pending:
+      ready = [item for item in pending
+               if not self.ami_readiness or not self.ami_key(item[1]) or self.stopped.is_set()]
+      if not ready:
+        finished = self.ami_readiness.wait_any([self.ami_key(target) for _, target in pending], 1)
+        ready = [item for item in pending if self.ami_key(item[1]) in finished]
+      for item in ready:
+        pending.remove(item)
+        yield item
+
+  def run(self):
+    """ Deploy every target and return the aggregated report """
+    self.start_ami_readiness()
+    for wave in self.waves():
+      if self.stopped.is_set():
+        self.results.extend(self.skipped(target) for target in wave)
+        continue
+      pool = ThreadPool(min(self.parallelism, len(wave)))
+      try:
+        results = pool.imap_unordered(lambda item: (item[0], self.run_target(item[1])), self.ready_targets(wave))
+        self.results.extend(result for _, result in sorted(results, key=lambda result: result[0]))
+      finally:
+        pool.close()
+        pool.join()
+    return self.report()
+
+  def deploy_settings(self, target):
+    """ RollingDeploy arguments of the target, its ami_id being the one available in its region """
+    settings = dict((key, value) for key, value in target.items() if key not in self.ORCHESTRATOR_SETTINGS)
+    key = self.ami_key(target)
+    if key:
+      settings['ami_id'] = self.ami_readiness.wait(*key) if self.ami_readiness else key[1]
+    return settings
+
+  def run_target(self, target):
+    if self.stopped.is_set():
+      return self.skipped(target)
+    label = self.target_label(target)
+    threading.current_thread().name = label
+    started = time()
+    deploy = None
+    try:
+      deploy = self.deploy_class(**self.deploy_settings(target))
+      with self._lock:
+        self.active_deploys[label] = deploy
+      if self.cancelled.is_set():
+        deploy.cancel('cancelled')
+      deploy.deploy()
+      return {'target': label, 'status': 'succeeded', 'duration': time() - started}
+    except DeployCancelled as e:
+      logging.error("Deploy of {0} cancelled by {1}, cleaning up".format(label, e))
+      self.stopped.set()
+      if deploy:
+        deploy.abort(self.shutdown_timeout)
+      return {'target': label, 'status': 'cancelled', 'duration': time() - started}
+    except Exception as e:
+      logging.error("Deploy of {0} failed: {1}".format(label, e))
+      if self.stop_on_failure:
+        self.stopped.set()
+      if deploy and not self.debug:
+        self.enable_alarms(deploy)
+      return {'target': label, 'status': 'failed', 'duration': time() - started, 'error': str(e)}
+    finally:
+      with self._lock:
+        self.active_deploys.pop(label, None)
+
+  def skipped(self, target):
+    return {'target': self.target_label(target), 'status': 'skipped', 'duration': 0}
+
+  def enable_alarms(self, deploy):
+    try:
+      deploy.enable_project_cloudwatch_alarms()
+    except Exception as e:
+      logging.error("Unable to re-enable alarms: {0}".format(e))
+
+  def cancel(self, reason='cancelled'):
+    """ Skip the targets not started yet and cancel the running deploys, used on shutdown """
+    self.cancelled.set()
+    self.stopped.set()
+    self.token.cancel(reason)
+    with self._lock:
+      deploys = list(self.active_deploys.values())
+    for deploy in deploys:
+      deploy.cancel(reason)
+
+  def report(self):
+    counts = dict((status, len([r for r in self.results if r['status'] == status]))
+                  for status in ['succeeded', 'failed', 'cancelled', 'skipped'])
+    return {'success': counts['succeeded'] == len(self.results), 'counts': counts, 'targets': self.results}
+
+
+def get_args(): # pragma: no cover
+  parser = argparse.ArgumentParser(description='Run rolling deploys for several environments, regions or AutoScaling Groups')
+  parser.add_argument('-t', '--targets', action='store', dest='targets', help='Yaml file listing the deploy targets', type=str, required=True)
+  parser.add_argument('-n', '--parallelism', action='store', dest='parallelism', help='Maximum number of deploys running at once', type=int, default=2)
+  parser.add_argument('-k', '--keep-going', action='store_true', dest='keep_going', help='Keep deploying the remaining targets after a failure')
+  parser.add_argument('-a', '--ami-wait', action='store', dest='ami_wait', help='Minutes to wait for the AMIs, copies included', type=int, default=20)
+  parser.add_argument('-O', '--report', action='store', dest='report', help='File to write the JSON report to, printed to stdout if not set', type=str)
+  parser.add_argument('--shutdown-timeout', action='store', dest='shutdown_timeout', help='Seconds allowed on SIGINT/SIGTERM for the running deploys to roll back and re-enable their alarms before exiting', type=int, default=RollingDeploy.SHUTDOWN_TIMEOUT)
+  parser.add_argument('-D', '--debug', action='store_true', help='If set, do not re-enable alarms on failure. Useful for debugging only.')
+  return parser.parse_args()
+
+
+def main(): # pragma: no cover
+  args = get_args()
+  SetLogging.setup_logging(thread_names=True)
+  orchestrator = DeployOrchestrator(DeployOrchestrator.load_targets(args.targets), args.parallelism,
+                                    not args.keep_going, args.debug, ami_timeout=60 * args.ami_wait,
+                                    shutdown_timeout=args.shutdown_timeout)
+
+  def signal_handler(signum, frame):
+    if not orchestrator.cancelled.is_set():
+      logging.warning("Received signal {0}, cancelling the deploys".format(signum))
+      start_watchdog(args.shutdown_timeout)
+      orchestrator.cancel("signal {0}".format(signum))
+  signal.signal(signal.SIGINT, signal_handler)
+  signal.signal(signal.SIGTERM, signal_handler)
+
+  report = orchestrator.run()
+  output = json.dumps(report, indent=2, sort_keys=True)
+  if args.report:
+    with open(args.report, 'w') as stream:
+      stream.write(output)
+  else:
+    print(output)
+  if not report['success']:
+    exit(2)
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
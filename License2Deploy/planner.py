@@ -0,0 +1,142 @@
+import json
+
+
+class DeployPlanner(object):
+  """ Works out what a deploy would do from one read-only snapshot of its target, without changing anything
+
+  Only describe, get and list calls are made. The autoscale group is read first, then the AMI, the instances,
+  the health of every load balancer and target group and the alarms are read concurrently, in batches.
+  The plan and its worst case duration, from the wait tuples, are computed locally from that snapshot.
+  """
+
+  AMI_WAIT_MINUTES = 20
+
+  def __init__(self, deploy):
+    self.deploy = deploy
+    self.problems = []
+
+  def read(self, name, func, *args):
+    """ Result of one read of the snapshot, None when it failed, the failure being kept as a problem """
+    try:
+      return func(*args)
+    except Exception as e:
+      self.problems.append("Unable to read the {0}: {1}".format(name, e))
+      return None
+
+  def snapshot(self):
+    deploy = self.deploy
+    deploy.get_asg_info()
+    deploy.load_balancers = deploy.get_load_balancers(deploy.asg_name)
+    deploy.target_group_arns = deploy.get_target_groups(deploy.asg_name)
+    deploy.original_instance_ids = list(deploy.get_all_instance_ids(deploy.asg_name))
+    ids = deploy.original_instance_ids
+    reads = ([('ami', deploy.get_ami_id_state, deploy.ami_id),
+              ('instances', deploy.get_instance_info, ids),
+              ('alarms', deploy.retrieve_project_cloudwatch_alarms)] +
+             [('ELB {0}'.format(name), deploy.in_service_instance_ids, ids, name) for name in deploy.load_balancers] +
+             [('TargetGroup {0}'.format(arn), deploy.healthy_target_ids, ids, arn) for arn in deploy.target_group_arns])
+    results = deploy.batcher.each(lambda read: self.read(*read), reads)
+    return dict((read[0], result) for read, result in zip(reads, results))
+
+  @staticmethod
+  def seconds(wait):
+    return wait[0] * wait[1]
+
+  def launch_seconds(self, pipelined):
+    """ Longest the new instances of one launch may take to come up healthy """
+    deploy = self.deploy
+    if pipelined and deploy.pipeline_wait:
+      return self.seconds(deploy.pipeline_wait)
+    return sum(self.seconds(wait) for wait in [deploy.creation_wait, deploy.ready_wait, deploy.health_wait])
+
+  def plan(self):
+    """ The plan of the deploy as a dict, its problems listing everything that would stop it """
+    deploy = self.deploy
+    self.problems = []
+    snapshot = self.snapshot()
+    ids = deploy.original_instance_ids
+    builds = dict((i, deploy.inventory.get(i, 'build')) for i in ids)
+    if deploy.auto_wait:
+      deploy.tune_waits()
+
+    ami = snapshot['ami']
+    ami_state = ami['State'] if ami else None
+    if ami and ami_state != 'available':
+      self.problems.append("AMI {0} is {1}, the deploy waits up to {2} minutes for it".format(deploy.ami_id, ami_state, self.AMI_WAIT_MINUTES))
+    current_builds = {}
+    for build in builds.values():
+      if build:
+        current_builds[build] = current_builds.get(build, 0) + 1
+    if snapshot['instances'] is not None and not current_builds:
+      self.problems.append('Failed to determine current build. Ensure instances contain tag "BUILD"')
+    elif str(deploy.build_number) in current_builds and not deploy.force_redeploy:
+      self.problems.append("Build {0} is already deployed, pass the force_redeploy flag to redeploy it".format(deploy.build_number))
+    if deploy.canary_size and deploy.batch_size and deploy.canary_size > deploy.batch_size:
+      self.problems.append("The canary size {0} cannot be above the batch size {1}".format(deploy.canary_size, deploy.batch_size))
+
+    pipelined = bool(deploy.pipeline or deploy.lifecycle_queue_url)
+    batches = deploy.chunk_list(ids, deploy.batch_size) if deploy.batch_size else [ids]
+    drain = deploy.get_drain_timeout()
+    budgets = {
+      'discovered': self.AMI_WAIT_MINUTES * 60 if ami_state != 'available' else 0,
+      'canary_promoted': self.launch_seconds(True) + deploy.canary_window,
+      'new_healthy': self.launch_seconds(pipelined),
+      'old_terminated': drain,
+      'old_replaced': len(batches) * (self.launch_seconds(pipelined) + drain),
+      'verified': self.seconds(deploy.only_new_wait),
+    }
+    steps = [{'state': state, 'step': step.__name__, 'max_seconds': budgets.get(state, 0)}
+             for state, step in deploy.deploy_steps()]
+    balancers = [{'name': name, 'healthy': snapshot['ELB {0}'.format(name)]} for name in deploy.load_balancers] + \
+                [{'name': arn, 'healthy': snapshot['TargetGroup {0}'.format(arn)]} for arn in deploy.target_group_arns]
+    return {
+      'project': deploy.project,
+      'env': deploy.env,
+      'build_number': deploy.build_number,
+      'ami_id': deploy.ami_id,
+      'ami_state': ami_state,
+      'region': deploy.region,
+      'autoscaling_group': deploy.asg_name,
+      'mode': 'batch' if deploy.batch_size else 'double',
+      'pipelined': pipelined,
+      'canary_size': deploy.canary_size,
+      'instance_type': deploy.inventory.get(ids[0], 'type'),
+      'current_instances': len(ids),
+      'current_builds': current_builds,
+      'launch': len(ids),
+      'terminate': len(ids),
+      'batches': len(batches),
+      'peak_capacity': len(ids) + max([len(batch) for batch in batches] + [deploy.canary_size or 0]),
+      'alarms': snapshot['alarms'] or [],
+      'balancers': [{'name': b['name'], 'instances': len(ids),
+                     'healthy': None if b['healthy'] is None else len(b['healthy'])} for b in balancers],
+      'steps': steps,
+      'max_seconds': sum(step['max_seconds'] for step in steps),
+      'problems': list(self.problems),
+    }
+
+  @staticmethod
+  def format_text(plan):
+    lines = [
+      "Plan for {project} {env} build {build_number} ({ami_id}, {ami_state}) in {region}".format(**plan),
+      "Autoscale group {0}: {1} instance(s) of {2}, builds {3}".format(
+        plan['autoscaling_group'], plan['current_instances'], plan['instance_type'], plan['current_builds']),
+      "Mode: {0}{1}{2}, {3} batch(es), peak capacity {4}".format(
+        plan['mode'], ', pipelined' if plan['pipelined'] else '',
+        ', canary of {0}'.format(plan['canary_size']) if plan['canary_size'] else '', plan['batches'], plan['peak_capacity']),
+      "Launch {0} instance(s), terminate {1}".format(plan['launch'], plan['terminate']),
+    ]
+    for balancer in plan['balancers']:
+      lines.append("Check {0}: {1}/{2} healthy now".format(balancer['name'], balancer['healthy'], balancer['instances']))
+    lines.append("Disable then enable {0} alarm(s): {1}".format(len(plan['alarms']), ', '.join(plan['alarms'])))
+    lines.append("Steps:")
+    for step in plan['steps']:
+      lines.append("  {0:<16} {1:<40} up to {2:>6.0f}s".format(step['state'], step['step'], step['max_seconds']))
+    lines.append("Worst case: {0:.0f} minutes".format(plan['max_seconds'] / 60.0))
+    for problem in plan['problems']:
+      lines.append("Problem: {0}".format(problem))
+    return '\n'.join(lines)
+
+  @staticmethod
+  def format(plan, output='text'):
+    return json.dumps(plan, indent=2, sort_keys=True) if output == 'json' else DeployPlanner.format_text(plan)
@@ -0,0 +1,100 @@
+import logging
+import random
+import threading
+from time import sleep, time
+
+
+class WaitHistogram(object):
+  """ Collects how long each named wait took so the wait budgets can be tuned """
+
+  BUCKETS = [5, 15, 30, 60, 120, 300, 600, 1200]
+
+  def __init__(self):
+    self.durations = {}
+    self._lock = threading.Lock()
+
+  def record(self, name, seconds):
+    with self._lock:
+      self.durations.setdefault(name, []).append(seconds)
+
+  def buckets(self, name):
+    """ Count of waits per upper bound in seconds, the last bucket ('+Inf') holding everything slower """
+    counts = [0] * (len(self.BUCKETS) + 1)
+    for seconds in self.durations.get(name, []):
+      counts[next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))] += 1
+    return list(zip([str(bound) for bound in self.BUCKETS] + ['+Inf'], counts))
+
+  def log(self):
+    for name, durations in sorted(self.durations.items()):
+      logging.info("Wait {0}: {1} wait(s), slowest {2:.0f}s, total {3:.0f}s, histogram {4}".format(
+        name, len(durations), max(durations), sum(durations), [b for b in self.buckets(name) if b[1]]))
+
+
+class Poller(object):
+  """ Polls until something is ready or a deadline passes, probing right away and then backing off with jitter
+
+  Given a CancellationToken, the poller sleeps on it and raises DeployCancelled as soon as it is cancelled.
+  """
+
+  INITIAL_DELAY = 5
+
+  def __init__(self, timeout, initial_delay=INITIAL_DELAY, max_delay=30, factor=2, jitter=0.1, name=None,
+               histogram=None, token=None):
+    self.timeout = timeout
+    self.initial_delay = initial_delay
+    self.max_delay = max_delay
+    self.factor = factor
+    self.jitter = jitter
+    self.name = name
+    self.histogram = histogram
+    self.token = token
+    self.sleep = token.sleep if token else sleep
+
+  @classmethod
+  def from_tries(cls, tries, delay, name=None, histogram=None, token=None):
+    """ Map a (# of tries, delay) wait tuple to a deadline of tries * delay, backing off up to delay """
+    return cls(tries * delay, initial_delay=min(cls.INITIAL_DELAY, delay), max_delay=delay, name=name,
+               histogram=histogram, token=token)
+
+  def delays(self):
+    delay = min(self.initial_delay, self.max_delay)
+    while True:
+      yield max(0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+      delay = min(delay * self.factor, self.max_delay)
+
+  def wait(self, condition):
+    """ Call condition until it returns something truthy and return it, return False once time is up """
+    started = time()
+    deadline = started + self.timeout
+    delays = self.delays()
+    try:
+      while True:
+        if self.token:
+          self.token.check()
+        result = condition()
+        if result:
+          return result
+        remaining = deadline - time()
+        if remaining <= 0:
+          return False
+        self.sleep(min(next(delays), remaining))
+    finally:
+      self.record(time() - started)
+
+  def call(self, func, *args, **kwargs):
+    """ Call func until it stops raising and return its result, re-raise its last error once time is up """
+    errors = []
+    def attempt():
+      try:
+        return [func(*args, **kwargs)]
+      except Exception as e:
+        logging.warning("{0}: {1}".format(self.name or func.__name__, e))
+        errors[:] = [e]
+    result = self.wait(attempt)
+    if not result:
+      raise errors[0]
+    return result[0]
+
+  def record(self, seconds):
+    if self.histogram is not None and self.name:
+      self.histogram.record(self.name, seconds)
@@ -0,0 +1,178 @@
+import logging
+import threading
+from time import sleep, time
+from .AWSConn import AWSConn
+
+
+class TokenBucket(object):
+  """ Hands out rate tokens a second up to burst, halving the rate on every throttle and creeping back after
+
+  Callers reserve a token under the lock and sleep outside of it, so concurrent callers queue up fairly.
+  """
+
+  RECOVERY = 0.05
+
+  def __init__(self, rate, burst, min_rate=None):
+    self.max_rate = float(rate)
+    self.rate = float(rate)
+    self.burst = burst
+    self.min_rate = min_rate or self.max_rate / 20
+    self.tokens = float(burst)
+    self.clock = time
+    self.sleep = sleep
+    self.updated = self.clock()
+    self.requests = 0
+    self.waited = 0.0
+    self.waits = 0
+    self.throttles = 0
+    self._lock = threading.Lock()
+
+  def refill(self, now):
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def acquire(self):
+    """ Take a token, sleeping until it is there, and return the seconds slept """
+    with self._lock:
+      self.refill(self.clock())
+      self.tokens -= 1
+      self.requests += 1
+      wait = -self.tokens / self.rate if self.tokens < 0 else 0
+      if wait:
+        self.waited += wait
+        self.waits += 1
+    if wait:
+      self.sleep(wait)
+    return wait
+
+  def throttled(self):
+    """ AWS pushed back: halve the rate and drop the tokens left so the next callers wait """
+    with self._lock:
+      self.refill(self.clock())
+      self.rate = max(self.min_rate, self.rate / 2)
+      self.tokens = min(self.tokens, 0)
+      self.throttles += 1
+
+  def succeeded(self):
+    with self._lock:
+      if self.rate < self.max_rate:
+        self.rate = min(self.max_rate, self.rate + self.max_rate * self.RECOVERY)
+
+  def stats(self):
+    with self._lock:
+      return {'rate': self.rate, 'max_rate': self.max_rate, 'requests': self.requests, 'waits': self.waits,
+              'waited_seconds': self.waited, 'throttles': self.throttles}
+
+
+class RateLimitedConnection(object):
+  """ Wraps a connection so every method call takes a token of its API family first """
+
+  def __init__(self, connection, name, limiter):
+    self._connection = connection
+    self._name = name
+    self._limiter = limiter
+
+  def __getattr__(self, attr):
+    value = getattr(self._connection, attr)
+    if attr.startswith('_') or not callable(value):
+      return value
+    family = self._limiter.family(self._name, attr)
+    def call(*args, **kwargs):
+      self._limiter.acquire(family)
+      try:
+        result = value(*args, **kwargs)
+      except Exception as e:
+        if AWSConn.is_throttling_error(e):
+          self._limiter.throttled(family)
+        raise
+      self._limiter.succeeded(family)
+      return result
+    return call
+
+
+class RateLimiter(object):
+  """ Token buckets per API family shared by every client of one account (profile) and region in the process
+
+  boto3 clients take a token for every HTTP request they send, botocore's own retries included, through their
+  event hooks. Clients without botocore events take one per method call through RateLimitedConnection.
+  """
+
+  # requests a second and burst, after the EC2 request token buckets
+  BUDGETS = {
+    'ec2_describe': (20, 100),
+    'ec2': (5, 50),
+    'autoscaling': (10, 40),
+    'elb': (10, 40),
+    'cloudwatch': (10, 50),
+    'cloudformation': (5, 20),
+    'sqs': (50, 100),
+    'other': (10, 40),
+  }
+  CLIENT_FAMILIES = {
+    'ec2': 'ec2',
+    'asg': 'autoscaling',
+    'elb': 'elb', 'elb2': 'elb',
+    'cloudwatch': 'cloudwatch',
+    'cloudformation_client': 'cloudformation',
+    'sqs': 'sqs',
+  }
+  READ_PREFIXES = ('describe', 'get')
+
+  _shared = {}
+  _shared_lock = threading.Lock()
+
+  def __init__(self, budgets=None):
+    self.budgets = dict(self.BUDGETS)
+    self.budgets.update(budgets or {})
+    self.buckets = dict((family, TokenBucket(rate, burst)) for family, (rate, burst) in self.budgets.items())
+
+  @classmethod
+  def shared(cls, region, profile='default'):
+    """ The limiter of an account and region, one per process """
+    with cls._shared_lock:
+      key = (region, profile)
+      if key not in cls._shared:
+        cls._shared[key] = cls()
+      return cls._shared[key]
+
+  def family(self, client_name, operation):
+    """ API family of an operation, EC2 reads having their own larger budget """
+    family = self.CLIENT_FAMILIES.get(client_name, 'other')
+    if family == 'ec2' and operation.lower().startswith(self.READ_PREFIXES):
+      return 'ec2_describe'
+    return family
+
+  def acquire(self, family):
+    waited = self.buckets[family].acquire()
+    if waited > 1:
+      logging.info("Waited {0:.1f} seconds for the {1} rate limit".format(waited, family))
+    return waited
+
+  def throttled(self, family):
+    self.buckets[family].throttled()
+    logging.warning("Throttled by AWS, {0} requests slowed down to {1:.1f} a second".format(family, self.buckets[family].rate))
+
+  def succeeded(self, family):
+    self.buckets[family].succeeded()
+
+  def wrap(self, name, client):
+    """ Return the client with every request it makes going through the bucket of its family """
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    if events is None:
+      return RateLimitedConnection(client, name, self)
+    def before_send(event_name=None, **kwargs):
+      self.acquire(self.family(name, event_name.split('.')[-1]))
+    def needs_retry(response, operation, **kwargs):
+      if response and isinstance(response[1], dict) and response[1].get('Error', {}).get('Code') in AWSConn.THROTTLING_ERROR_CODES:
+        self.throttled(self.family(name, operation.name))
+    def after_call(parsed, model, **kwargs):
+      if not (isinstance(parsed, dict) and parsed.get('Error')):
+        self.succeeded(self.family(name, model.name))
+    events.register('before-send', before_send, unique_id='license2deploy-rate-limit-before-send')
+    events.register('needs-retry', needs_retry, unique_id='license2deploy-rate-limit-needs-retry')
+    events.register('after-call', after_call, unique_id='license2deploy-rate-limit-after-call')
+    return client
+
+  def stats(self):
+    """ Rate, waits, seconds waited and throttles of every family used so far """
+    return dict((family, bucket.stats()) for family, bucket in self.buckets.items() if bucket.requests)
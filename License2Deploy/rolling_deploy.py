@@ -1,17 +1,44 @@
 import logging
 import argparse
-import boto3
 import signal
-from sys import exit, argv
-from time import sleep, time
-from .AWSConn import AWSConn
+import threading
+from sys import exit
+from time import time
+from .AWSConn import AWSConn, AWSClients, lazy_client
+from .alarm_manager import AlarmManager
+from .batching import Batcher
+from .canary import CanaryAnalysis
+from .cancellation import CancellationToken, DeployCancelled, start_watchdog
+from .checkpoint import DeployCheckpoint
+from .history import DeployHistory
+from .instance_pipeline import InstancePipeline
+from .instrumentation import DeployMetrics
+from .inventory import InstanceInventory
+from .lifecycle import LifecycleEvents, SQSLifecycleQueue
+from .planner import DeployPlanner
+from .terminator import InstanceTerminator
+from .poller import Poller, WaitHistogram
 from .set_logging import SetLogging
-from retry.api import retry_call
 
 
 class RollingDeploy(object):
 
-  MAX_RETRIES = 10
+  DESCRIBE_CHUNK_SIZE = 100
+  DESCRIBE_CONCURRENCY = 4
+  ASG_PAGE_SIZE = 100
+  TUNED_WAITS = [('creation', 'creation_wait'), ('ready', 'ready_wait'), ('health', 'health_wait'),
+                 ('only_new', 'only_new_wait'), ('pipeline', 'pipeline_wait')]
+  SHUTDOWN_TIMEOUT = 60
+  # past these states the old instances are gone and the group is no longer above its original capacity
+  SCALED_IN_STATES = ['old_terminated', 'scaled_down', 'old_replaced', 'verified', 'tagged', 'completed']
+
+  asg = lazy_client('asg')
+  ec2 = lazy_client('ec2')
+  elb = lazy_client('elb')
+  elb2 = lazy_client('elb2')
+  cloudformation_client = lazy_client('cloudformation_client')
+  sqs = lazy_client('sqs')
+  cloudwatch = lazy_client('cloudwatch')
 
   def __init__(self,
                env=None,
@@ -28,7 +55,29 @@ class RollingDeploy(object):
                health_wait=[10, 30],
                only_new_wait=[10, 30],
                asg_logical_name=None,
-               load_balancer=False):
+               load_balancer=False,
+               alarm_prefix=None,
+               pipeline=False,
+               batch_size=None,
+               termination_concurrency=10,
+               region=None,
+               asg_name=None,
+               report_file=None,
+               metrics_textfile=None,
+               checkpoint_file=None,
+               resume=False,
+               client_pool=None,
+               lifecycle_queue_url=None,
+               lifecycle_role_arn=None,
+               canary_size=None,
+               canary_window=600,
+               canary_metrics=None,
+               canary_max_ratio=1.5,
+               history_file=None,
+               auto_wait=False,
+               checkpoint_dir=None,
+               canary_allow_missing_data=False,
+               drain_timeout=None):
     self.env = env
     self.session = session
     self.project = project.replace('-','')
@@ -41,67 +90,117 @@ class RollingDeploy(object):
     self.stack_resources = False
     self.autoscaling_group = False
     self.cloudwatch_alarms = False
-    self.environments = AWSConn.load_config(self.regions_conf).get(self.env)
+    self.project_cloudwatch_alarms = None
+    self.alarm_prefix = alarm_prefix
+    self.pipeline = pipeline
+    self.stage_timings = {}
+    self.batch_size = batch_size
+    self.promoted_instance_ids = []
+    self.retired_instance_ids = []
+    self.termination_concurrency = termination_concurrency
+    self.drain_timeout = drain_timeout
+    self.wait_histogram = WaitHistogram()
+    self.environments = region or AWSConn.load_config(self.regions_conf).get(self.env)
     self.region = AWSConn.determine_region(self.environments)
-    self.conn_ec2 = AWSConn.aws_conn_ec2(self.region, self.profile_name)
-    self.conn_elb = AWSConn.aws_conn_elb(self.region, self.profile_name)
-    self.asg = AWSConn.get_boto3_client('autoscaling', self.region, self.profile_name, session)
+    self.report_file = report_file
+    self.metrics_textfile = metrics_textfile
+    self.metrics = DeployMetrics({'project': self.project, 'env': self.env, 'build': self.build_number, 'region': self.region})
+    self.clients = AWSClients(self.region, self.profile_name, session, self.metrics, client_pool)
+    self.metrics.rate_limiter = self.clients.limiter
     self.asg_info = None
-    self.asg_name = ''
-    self.ec2 = AWSConn.get_boto3_client('ec2', self.region, self.profile_name, session)
-    self.elb2 = AWSConn.get_boto3_client('elbv2', self.region, self.profile_name, session)
-    self.conn_auto = AWSConn.aws_conn_auto(self.region, self.profile_name)
-    self.conn_cloudwatch = AWSConn.aws_conn_cloudwatch(self.region, self.profile_name)
-    self.cloudformation_client = AWSConn.get_boto3_client('cloudformation', self.region, self.profile_name, session)
+    self.asg_name = asg_name or ''
+    self.asg_descriptions = {}
     self.creation_wait = creation_wait
     self.ready_wait = ready_wait
     self.health_wait = health_wait
     self.only_new_wait = only_new_wait
+    self.pipeline_wait = None
     self.asg_logical_name = asg_logical_name
     self.load_balancer = load_balancer
-    self.target_group_arn = None
+    self.load_balancers = [load_balancer] if load_balancer else []
+    self.target_group_arns = []
     self.original_instance_ids = []
     self.new_desired_capacity = None
+    self.batcher = Batcher(self.DESCRIBE_CHUNK_SIZE, self.DESCRIBE_CONCURRENCY)
+    self.inventory = InstanceInventory(self.describe_instances)
+    self.new_instance_ids = []
+    if lifecycle_queue_url and not lifecycle_role_arn:
+      raise Exception("A lifecycle role ARN is needed for the autoscale group to publish to {0}".format(lifecycle_queue_url))
+    self.lifecycle_queue_url = lifecycle_queue_url
+    self.lifecycle_role_arn = lifecycle_role_arn
+    self.lifecycle = None
+    self.canary_size = canary_size
+    self.canary_window = canary_window
+    self.canary_metrics = canary_metrics
+    self.canary_max_ratio = canary_max_ratio
+    self.canary_allow_missing_data = canary_allow_missing_data
+    self.canary_instance_ids = []
+    self.history = DeployHistory(history_file) if history_file or auto_wait else None
+    self.auto_wait = auto_wait
+    self.cancel_token = CancellationToken()
+    self.resume = resume
+    self.checkpoint_state = None
+    if not checkpoint_file and (checkpoint_dir or resume):
+      checkpoint_file = DeployCheckpoint.default_path(checkpoint_dir, self.project, self.env, self.region,
+                                                      self.stack_name or self.asg_name)
+    self.checkpoint = DeployCheckpoint(checkpoint_file)
 
   def get_ami_id_state(self, ami_id):
     try:
-      ami_obj = self.conn_ec2.get_all_images(image_ids=ami_id)
+      ami_obj = self.ec2.describe_images(ImageIds=[ami_id])['Images']
     except Exception as e:
       raise Exception("Unable to get ami-id, please investigate: {0}".format(e))
     return ami_obj[0]
 
   def wait_ami_availability(self, ami_id, timer=20):
     """ Timeout should be in minutes """
-    timeout = time() + 60 * timer
-    while True:
-      ami_state = self.get_ami_id_state(ami_id).state
-      if time() <= timeout and ami_state == 'available':
-        logging.info("AMI {0} is ready".format(ami_id))
-        return True
-      elif time() > timeout:
-        raise Exception("AMI {0} is not ready after {1} minutes, please investigate".format(ami_id, timer))
-      else:
-        logging.warning("AMI {0} is not ready yet, retrying in 30 seconds".format(ami_id))
-        sleep(30)
+    def ami_available():
+      ami_state = self.get_ami_id_state(ami_id)['State']
+      if ami_state != 'available':
+        logging.warning("AMI {0} is not ready yet, state is {1}".format(ami_id, ami_state))
+      return ami_state == 'available'
+    poller = Poller(60 * timer, max_delay=30, name='ami', histogram=self.wait_histogram, token=self.cancel_token)
+    if not poller.wait(ami_available):
+      raise Exception("AMI {0} is not ready after {1} minutes, please investigate".format(ami_id, timer))
+    logging.info("AMI {0} is ready".format(ami_id))
+    return True
 
-  def get_group_info(self, group_name=None):
-    try:
-      if group_name:
-        rslt = self.conn_auto.get_all_groups([group_name])
-        if not rslt:
-          raise Exception("Bad Group: {0}".format(group_name))
-        return rslt
-      else:
-        return self.conn_auto.get_all_groups()
-    except Exception as e:
-      raise Exception("Unable to pull down autoscale group: {0}".format(e))
+  def poller(self, name, wait):
+    """ Poller for one of the (# of tries, delay) wait tuples """
+    return Poller.from_tries(wait[0], wait[1], name=name, histogram=self.wait_histogram, token=self.cancel_token)
 
   def get_asg_info(self):
-    if self.stack_name:
+    if self.stack_name and not self.asg_name:
       self.asg_name = self.get_autoscaling_group_name_from_cloudformation()
+      group = self.describe_autoscaling_group(self.asg_name)
+    elif self.asg_name:
+      group = self.describe_autoscaling_group(self.asg_name)
     else:
-        self.asg_name = next((instance.name for instance in [n for n in self.get_group_info() if n.name] if self.project in instance.name and self.env in instance.name), None)
-    self.asg_info = self.asg.describe_auto_scaling_groups(AutoScalingGroupNames=[self.asg_name])
+      group = self.find_project_autoscaling_group()
+      self.asg_name = group['AutoScalingGroupName']
+    self.asg_info = {'AutoScalingGroups': [group]}
+
+  def find_project_autoscaling_group(self):
+    """ Page through the autoscale groups lazily and stop at the first one named after project and env """
+    paginator = self.asg.get_paginator('describe_auto_scaling_groups')
+    for page in paginator.paginate(PaginationConfig={'PageSize': self.ASG_PAGE_SIZE}):
+      for group in page['AutoScalingGroups']:
+        if self.project in group['AutoScalingGroupName'] and self.env in group['AutoScalingGroupName']:
+          self.asg_descriptions[group['AutoScalingGroupName']] = group
+          return group
+    raise Exception("Unable to find an autoscale group for project {0} in {1}".format(self.project, self.env))
+
+  def describe_autoscaling_group(self, group_name, refresh=False):
+    """ Describe an autoscale group once per run, refresh when its instance list may have changed """
+    if refresh or group_name not in self.asg_descriptions:
+      try:
+        groups = self.asg.describe_auto_scaling_groups(AutoScalingGroupNames=[group_name])['AutoScalingGroups']
+      except Exception as e:
+        raise Exception("Unable to pull down autoscale group: {0}".format(e))
+      if not groups:
+        raise Exception("Unable to pull down autoscale group: Bad Group: {0}".format(group_name))
+      self.asg_descriptions[group_name] = groups[0]
+    return self.asg_descriptions[group_name]
 
   def get_autoscaling_group_name_from_cloudformation(self):
     if not self.autoscaling_group:
@@ -155,15 +254,11 @@ class RollingDeploy(object):
       raise Exception("Unable to update desired count, please investigate error: {0}".format(e))
 
   def get_instance_info(self, id_list):
-      return self.conn_ec2.get_all_instances(instance_ids=id_list)
+      return self.inventory.update(self.get_reservations(id_list))
 
   def get_instance_ip_addrs(self, id_list=[]):
-    ip_dict = {}
     try:
-      instance_data = [ids for instInfo in self.get_instance_info(id_list) for ids in instInfo.instances]
-      for instance in instance_data:
-        ip_dict[instance.id] = instance.private_ip_address
-      return ip_dict
+      return dict((instance_id, ip) for instance_id, ip in self.inventory.ip_addrs(id_list).items() if ip)
     except Exception as e:
       raise Exception("Unable to get IP Addresses for instances: {0}".format(e))
 
@@ -172,11 +267,11 @@ class RollingDeploy(object):
           raise Exception("There are no instances in this AutoScalingGroup, please check AutoScalingGroup desired capacity.")
       return True
 
-  def get_all_instance_ids(self, group_name):
+  def get_all_instance_ids(self, group_name, refresh=False):
     """ Gather Instance id's of all instances in the autoscale group """
-    instances = [i for i in self.get_group_info(group_name)[0].instances]
+    instances = self.describe_autoscaling_group(group_name, refresh)['Instances']
     self.validate_instance_list(instances)
-    id_list = [instance_id.instance_id for instance_id in instances]
+    id_list = [instance['InstanceId'] for instance in instances]
     return id_list
 
   def log_instances_ips(self, id_list, group_name):
@@ -184,19 +279,18 @@ class RollingDeploy(object):
     logging.info("List of all Instance ID's and IP addresses in {0}: {1}".format(group_name, id_ip_dict))
 
   def get_reservations(self, id_list):
-    return self.conn_ec2.get_all_reservations(instance_ids=id_list)
+    if not id_list:
+      # an empty id list describes every instance, as it always has
+      return Batcher.boto3_pages(self.ec2.describe_instances, 'Reservations')
+    return self.batcher.collect(
+      lambda chunk: Batcher.boto3_pages(self.ec2.describe_instances, 'Reservations', InstanceIds=chunk), id_list)
 
   def get_instance_ids_by_requested_build_tag(self, id_list, build):
     """ Gather Instance id's of all instances in the autoscale group """
-    reservations = self.get_reservations(id_list)
+    builds = self.get_build_tags(id_list)
     if self.force_redeploy:
       id_list = [id for id in id_list if id not in self.original_instance_ids]
-    new_instances = [inst.id
-                     for r in reservations
-                     for inst in r.instances
-                     if inst.id in id_list
-                     and 'BUILD' in inst.tags
-                     and inst.tags['BUILD'] == str(build)]
+    new_instances = [instance_id for instance_id in id_list if builds[instance_id] == str(build)]
 
     if len(new_instances) < self.get_new_instances_count():
       raise Exception('Not all new instances with build number "{0}" are in the group'.format(self.build_number))
@@ -205,118 +299,228 @@ class RollingDeploy(object):
       logging.info("New Instance List with IP Addresses: {0}".format(ip_dict))
       return new_instances
 
+  def find_new_instance_ids(self, group_name):
+    """ Instances of the autoscale group, outside of the original ones, tagged with the requested build """
+    id_list = [instance_id for instance_id in self.get_all_instance_ids(group_name, refresh=True)
+               if instance_id not in self.original_instance_ids]
+    builds = self.get_build_tags(id_list)
+    return [instance_id for instance_id in id_list if builds[instance_id] == str(self.build_number)]
+
+  def launched_instance_ids(self, lifecycle):
+    """ New instances announced by the lifecycle hook and promoted canaries, instances of any other build are let through right away """
+    launched = [i for i in sorted(set(lifecycle.launched_instance_ids()) | set(self.canary_instance_ids))
+                if i not in self.original_instance_ids]
+    builds = self.get_build_tags(launched)
+    lifecycle.complete([i for i in launched if builds[i] is not None and builds[i] != str(self.build_number)])
+    return [i for i in launched if builds[i] == str(self.build_number)]
+
+  def start_lifecycle_events(self):
+    """ Register the launch lifecycle hook when a lifecycle queue is configured, before any instance launches """
+    if self.lifecycle_queue_url and not self.lifecycle:
+      self.lifecycle = LifecycleEvents(self.asg, self.asg_name, SQSLifecycleQueue(self.sqs, self.lifecycle_queue_url),
+                                       self.lifecycle_role_arn)
+    if self.lifecycle:
+      self.lifecycle.register()
+
+  def stop_lifecycle_events(self):
+    if self.lifecycle:
+      self.lifecycle.remove()
+
+  def release_held_instances(self):
+    """ Launch events sent to an interrupted deploy are gone: drop its hook, let go of the instances it held and poll """
+    lifecycle = LifecycleEvents(self.asg, self.asg_name, None)
+    lifecycle.remove()
+    group = self.describe_autoscaling_group(self.asg_name, refresh=True)
+    lifecycle.release([i['InstanceId'] for i in group['Instances'] if i.get('LifecycleState') == 'Pending:Wait'])
+
   def get_new_instances_count(self):
+      if self.batch_size:
+        return self.new_desired_capacity - len(self.original_instance_ids) + len(self.retired_instance_ids)
       return self.new_desired_capacity / 2
 
+  def get_ready_instance_ids(self, instance_ids):
+    """ Return the instances whose system and instance status checks both report ok """
+    statuses = self.batcher.collect(
+      lambda chunk: Batcher.boto3_pages(self.ec2.describe_instance_status, 'InstanceStatuses', InstanceIds=chunk),
+      sorted(instance_ids))
+    return set(state['InstanceId'] for state in statuses
+               if state['SystemStatus']['Status'] == 'ok' and state['InstanceStatus']['Status'] == 'ok')
+
   def wait_for_new_instances(self, instance_ids, retry=10, wait_time=30):
     """ Monitor new instances that come up and wait until they are ready """
-    for instance in instance_ids:
-      count = 0
-      health = []
-      while count <= retry and (len(health) < 2):
-        instanceStatus = self.conn_ec2.get_all_instance_status(instance)
-        for state in instanceStatus:
-          health = [x for x in [str(state.system_status.status), str(state.instance_status.status)] if x == "ok"]
-          if (len(health) < 2):
-            logging.warning("{0} is not in a fully working state yet".format(instance))
-            sleep(wait_time)
-            count += 1
-            if count > retry:
-              logging.error("{0} has not reached a valid healthy state".format(instance))
-              self.revert_deployment()
-          else:
-            logging.info("{0} is in a healthy state. Moving on...".format(instance))
-
-  def lb_healthcheck(self, new_ids):
+    pending = set(instance_ids)
+    def all_ready():
+      try:
+        ready = self.get_ready_instance_ids(pending)
+      except Exception as e:
+        logging.warning("Unable to check instance status: {0}".format(e))
+        return False
+      for instance in sorted(ready):
+        logging.info("{0} is in a healthy state. Moving on...".format(instance))
+      pending.difference_update(ready)
+      if pending:
+        logging.warning("{0} is not in a fully working state yet".format(sorted(pending)))
+      return not pending
+    if not pending or self.poller('ready', [retry, wait_time]).wait(all_ready):
+      return
+    logging.error("{0} has not reached a valid healthy state".format(sorted(pending)))
+    self.revert_deployment()
+
+  def lb_healthcheck(self, new_ids, load_balancer):
     """ Confirm that the healthchecks report back OK in the LB. """
-    instance_ids = self.conn_elb.describe_instance_health(self.load_balancer, new_ids)
-    status = [instance for instance in instance_ids if instance.state != "InService"]
+    status = [state['InstanceId'] for state in self.describe_instance_health(new_ids, load_balancer)
+              if state['State'] != "InService"]
     if status:
-      raise Exception('Must check load balancer again. Following instance(s) are not "InService": {0}'.format(status))
+      raise Exception('Must check load balancer {0} again. Following instance(s) are not "InService": {1}'.format(load_balancer, status))
     else:
-      logging.info('ELB healthcheck OK')
+      logging.info('ELB {0} healthcheck OK'.format(load_balancer))
       return True
 
-  def target_group_healthcheck(self, new_ids):
-    targets = [{'Id': i} for i in new_ids]
-    health = self.elb2.describe_target_health(TargetGroupArn=self.target_group_arn, Targets=targets)
-    unhealthy = [d['Target']['Id'] for d in health['TargetHealthDescriptions'] if
+  def target_group_healthcheck(self, new_ids, target_group_arn):
+    unhealthy = [d['Target']['Id'] for d in self.describe_target_health(new_ids, target_group_arn) if
                d['TargetHealth']['State'] != 'healthy']
     if unhealthy:
       raise Exception(
-        'Must check load balancer 2 again. Following instance(s) are not "InService": {0}'.format(unhealthy))
-    logging.info('ELB2 healthcheck OK')
+        'Must check target group {0} again. Following instance(s) are not "healthy": {1}'.format(target_group_arn, unhealthy))
+    logging.info('TargetGroup {0} healthcheck OK'.format(target_group_arn))
+    return True
+
+  def get_healthy_instance_ids(self, instance_ids):
+    """ Return the instances reported healthy by every load balancer and target group, all checked at once """
+    instance_ids = sorted(instance_ids)
+    healthy = set(instance_ids)
+    for reported in self.check_every_balancer(lambda name: self.in_service_instance_ids(instance_ids, name),
+                                              lambda arn: self.healthy_target_ids(instance_ids, arn)):
+      healthy &= reported
+    return healthy
+
+  def in_service_instance_ids(self, instance_ids, load_balancer):
+    return set(state['InstanceId'] for state in self.describe_instance_health(instance_ids, load_balancer)
+               if state['State'] == 'InService')
+
+  def healthy_target_ids(self, instance_ids, target_group_arn):
+    return set(d['Target']['Id'] for d in self.describe_target_health(instance_ids, target_group_arn)
+               if d['TargetHealth']['State'] == 'healthy')
+
+  def describe_instance_health(self, instance_ids, load_balancer):
+    """ Classic ELB health of the instances, described a chunk at a time """
+    return self.batcher.collect(
+      lambda chunk: self.elb.describe_instance_health(LoadBalancerName=load_balancer,
+                                                      Instances=[{'InstanceId': i} for i in chunk])['InstanceStates'],
+      instance_ids)
+
+  def describe_target_health(self, instance_ids, target_group_arn):
+    """ Target group health descriptions of the instances, described a chunk at a time """
+    return self.batcher.collect(
+      lambda chunk: self.elb2.describe_target_health(TargetGroupArn=target_group_arn,
+                                                     Targets=[{'Id': i} for i in chunk])['TargetHealthDescriptions'],
+      instance_ids)
+
+  def check_every_balancer(self, load_balancer_check, target_group_check):
+    """ Run a check against every classic ELB and target group concurrently, return their results in order
+
+    Every check runs to completion, then the failures of all of them are raised together.
+    """
+    checks = [(load_balancer_check, name) for name in self.load_balancers] + \
+             [(target_group_check, arn) for arn in self.target_group_arns]
+
+    def run(check):
+      try:
+        return check[0](check[1]), None
+      except Exception as e:
+        return None, e
+    outcomes = self.batcher.each(run, checks)
+    errors = [str(error) for result, error in outcomes if error is not None]
+    if errors:
+      raise Exception(' '.join(errors))
+    return [result for result, error in outcomes]
 
   def elbs_healthcheck(self, new_ids):
-      if self.load_balancer:
-        self.lb_healthcheck(new_ids)
-      if self.target_group_arn:
-        self.target_group_healthcheck(new_ids)
+    """ Raise unless the new instances are healthy in every load balancer and target group """
+    return all(self.check_every_balancer(lambda name: self.lb_healthcheck(new_ids, name),
+                                         lambda arn: self.target_group_healthcheck(new_ids, arn)))
 
   def calculate_max_minutes(self, tries, delay):
     return tries * delay / 60
 
-  def only_new_instances_check(self):
-    instance_ids = self.conn_elb.describe_instance_health(self.load_balancer)
-    for instance in instance_ids:
-      build = self.conn_ec2.get_all_reservations(instance.instance_id)[0].instances[0].tags['BUILD']
-      if build != self.build_number:
-        raise Exception("There is still an old instance in the ELB: {0}.".format(instance))
-    logging.info("Deployed instances {0} to ELB: {1}".format(instance_ids, self.load_balancer))
+  def get_build_tags(self, id_list):
+    """ Return the BUILD tag of each instance, describing only instances not yet in the inventory """
+    return self.inventory.builds(id_list)
+
+  def describe_instances(self, id_list):
+    """ Describe instances by filter, instances that are already gone are left out instead of failing the call """
+    return self.batcher.collect(
+      lambda chunk: Batcher.boto3_pages(self.ec2.describe_instances, 'Reservations',
+                                        Filters=[{'Name': 'instance-id', 'Values': chunk}]), id_list)
+
+  @staticmethod
+  def chunk_list(items, size):
+    return Batcher(size).chunks(items)
+
+  def only_new_instances_check(self, load_balancer):
+    health = self.elb.describe_instance_health(LoadBalancerName=load_balancer)
+    instance_ids = [state['InstanceId'] for state in health['InstanceStates']]
+    builds = self.get_build_tags(instance_ids)
+    for instance_id in instance_ids:
+      if builds[instance_id] != self.build_number:
+        raise Exception("There is still an old instance in the ELB {0}: {1}.".format(load_balancer, instance_id))
+    logging.info("Deployed instances {0} to ELB: {1}".format(instance_ids, load_balancer))
     return instance_ids
 
-  def only_new_instances_target_group_check(self):
-    health = self.elb2.describe_target_health(TargetGroupArn=self.target_group_arn)
+  def only_new_instances_target_group_check(self, target_group_arn):
+    health = self.elb2.describe_target_health(TargetGroupArn=target_group_arn)
     instance_ids = [d['Target']['Id'] for d in health['TargetHealthDescriptions']]
+    builds = self.get_build_tags(instance_ids)
     for instance_id in instance_ids:
-      build = self.conn_ec2.get_all_reservations(instance_id)[0].instances[0].tags['BUILD']
-      if build != self.build_number:
-        raise Exception("There is still an old instance in the TargetGroup: {0}.".format(instance))
-      logging.info("Deployed instances {0} to TargetGroup".format(instance_ids))
+      if builds[instance_id] != self.build_number:
+        raise Exception("There is still an old instance in the TargetGroup {0}: {1}.".format(target_group_arn, instance_id))
+    logging.info("Deployed instances {0} to TargetGroup: {1}".format(instance_ids, target_group_arn))
     return instance_ids
 
   def only_new_instances_elbs_check(self):
-      if self.load_balancer:
-        self.only_new_instances_check()
-      if self.target_group_arn:
-        self.only_new_instances_target_group_check()
+    return [instance for instances in self.check_every_balancer(self.only_new_instances_check,
+                                                                self.only_new_instances_target_group_check)
+            for instance in instances]
 
   def confirm_lb_has_only_new_instances(self):
     try:
       logging.info("Waiting maximum {0} minutes to terminate old instances.".format(self.calculate_max_minutes(self.only_new_wait[0], self.only_new_wait[1])))
-      return retry_call(self.only_new_instances_elbs_check, tries=self.only_new_wait[0], delay=self.only_new_wait[1], logger=logging)
+      return self.poller('only_new', self.only_new_wait).call(self.only_new_instances_elbs_check)
     except Exception as e:
       raise Exception("There are still old instances in the ELB. Please investigate.")
 
   def tag_ami(self, ami_id, env):
     """ Tagging AMI with DEPLOYED tag """
     try:
-      current_tag = self.conn_ec2.get_all_images(image_ids=ami_id)[0].tags.get('deployed')
+      image = self.ec2.describe_images(ImageIds=[ami_id])['Images'][0]
+      current_tag = AWSConn.tag_dict(image.get('Tags')).get('deployed')
       if not current_tag:
         logging.info("No DEPLOY tags exist, tagging with {0}".format(env))
-        self.conn_ec2.create_tags([self.ami_id], {"deployed": env})
+        self.ec2.create_tags(Resources=[self.ami_id], Tags=[{'Key': 'deployed', 'Value': env}])
       elif env not in current_tag:
         new_tag = ', '.join([current_tag, env])
         logging.info("DEPLOY tags currently exist: {0}, new tag is {1}".format(current_tag, new_tag))
-        self.conn_ec2.create_tags([self.ami_id], {"deployed": new_tag})
+        self.ec2.create_tags(Resources=[self.ami_id], Tags=[{'Key': 'deployed', 'Value': new_tag}])
       else:
         logging.info("No tagging necessary, already tagged with env: {0}".format(env))
     except Exception as e:
       raise Exception("Unable to tag ID, please investigate: {0}".format(e))
 
   def gather_instance_info(self, group): #pragma: no cover
-    instance_ids = self.get_all_instance_ids(group)
+    instance_ids = self.get_all_instance_ids(group, refresh=True)
     logging.info("Instance ID List: {0}".format(instance_ids))
     new_instance_ids = self.get_instance_ids_by_requested_build_tag(instance_ids, self.build_number)
     return new_instance_ids
 
   def launch_new_instances(self, group_name): # pragma: no cover
+    if self.pipeline or self.lifecycle:
+      return self.launch_new_instances_pipelined(group_name)
     # step 1: wait for ec2 creating instances
     try:
       logging.info("Trying for maximum {0} minutes to allow for instances to be created.".format(self.calculate_max_minutes(self.creation_wait[0], self.creation_wait[1])))
-      new_instance_ids = retry_call(self.gather_instance_info, fargs=[group_name], tries=self.creation_wait[0], delay=self.creation_wait[1], logger=logging)
+      new_instance_ids = self.poller('creation', self.creation_wait).call(self.gather_instance_info, group_name)
     except Exception as e:
-      self.set_autoscale_instance_desired_count(self.calculate_autoscale_desired_instance_count(self.asg_name, 'decrease'), self.asg_name)
+      self.restore_original_capacity(self.asg_name)
       raise Exception("There are no instances in the group with build number {0}. Please ensure AMI was promoted.".format(self.build_number))
 
     # step 2: waiting for instances coming up and ready
@@ -326,20 +530,73 @@ class RollingDeploy(object):
     # step 3: waiting for instance health check to be completed
     try:
       logging.info("Trying for maximum {0} minutes to health-check all instances.".format(self.calculate_max_minutes(self.health_wait[0], self.health_wait[1])))
-      retry_call(self.elbs_healthcheck, fargs=[new_instance_ids], tries=self.health_wait[0], delay=self.health_wait[1], logger=logging)
+      self.poller('health', self.health_wait).call(self.elbs_healthcheck, new_instance_ids)
     except Exception as e:
       logging.error('Load balancer healthcheck has exceeded the timeout threshold. Rolling back.')
       self.revert_deployment()
+    return new_instance_ids
+
+  def launch_new_instances_pipelined(self, group_name, expected_count=None): # pragma: no cover
+    """ Let every new instance go through creation, status checks and health checks on its own """
+    waits = [self.creation_wait, self.ready_wait, self.health_wait]
+    if self.pipeline_wait:
+      poller = self.poller('pipeline', self.pipeline_wait)
+    else:
+      poller = Poller(sum(tries * delay for tries, delay in waits), max_delay=min(delay for tries, delay in waits),
+                      name='pipeline', histogram=self.wait_histogram, token=self.cancel_token)
+    pipeline = InstancePipeline(self, group_name, expected_count or self.get_new_instances_count(), poller,
+                                self.lifecycle)
+    logging.info("Trying for maximum {0} minutes to bring all new instances up and healthy.".format(poller.timeout / 60))
+    try:
+      return pipeline.run()
+    except Exception as e:
+      logging.error(str(e))
+      if not pipeline.current_stage:
+        self.restore_original_capacity(self.asg_name)
+        raise Exception("There are no instances in the group with build number {0}. Please ensure AMI was promoted.".format(self.build_number))
+      self.revert_deployment()
+    finally:
+      self.stage_timings = pipeline.stage_durations()
+
+  def replace_instances_in_batches(self, group_name): # pragma: no cover
+    """ Swap original instances for new ones batch_size at a time so capacity stays within original + batch_size """
+    original_count = len(self.original_instance_ids)
+    remaining = [instance_id for instance_id in self.original_instance_ids if instance_id not in self.retired_instance_ids]
+    for batch in self.chunk_list(remaining, self.batch_size):
+      logging.info("Replacing batch of old instances: {0}".format(batch))
+      self.new_desired_capacity = original_count + len(batch)
+      self.set_autoscale_instance_desired_count(self.new_desired_capacity, group_name)
+      self.promoted_instance_ids = list(self.launch_new_instances(group_name))
+      self.terminate_instances(batch)
+      self.retired_instance_ids.extend(batch)
+      self.save_checkpoint()
+    self.set_autoscale_instance_desired_count(original_count, group_name)
+
+  def restore_original_capacity(self, group_name):
+    self.set_autoscale_instance_desired_count(int(self.asg_info['AutoScalingGroups'][0]['DesiredCapacity']), group_name)
+    self.checkpoint.clear()
+
+  def terminate_instances(self, instance_ids):
+    """ Deregister and terminate instances concurrently, return the outcome for each instance """
+    terminator = InstanceTerminator(self.asg,
+                                    elb=self.elb if self.load_balancers else None,
+                                    elb2=self.elb2 if self.target_group_arns else None,
+                                    load_balancers=self.load_balancers,
+                                    target_group_arns=self.target_group_arns,
+                                    max_workers=self.termination_concurrency,
+                                    drain_timeout=0 if self.cancel_token.is_cancelled() else self.get_drain_timeout(),
+                                    token=self.cancel_token, histogram=self.wait_histogram)
+    report = terminator.terminate(instance_ids)
+    self.inventory.forget(instance_id for instance_id, result in report.items() if result['status'] == 'terminated')
+    failed = sorted(instance_id for instance_id, result in report.items() if result['status'] != 'terminated')
+    if failed:
+      logging.warning("Failed to terminate instances: {0}".format(failed))
+    return report
 
   def terminate_original_instances(self, group_name): #pragma: no cover
     """ Will remove original instances in autoscale group """
     logging.info("Removing old instances from autoscale group")
-    for instance_id in self.original_instance_ids:
-      try:
-        self.conn_auto.terminate_instance(instance_id, decrement_capacity=True)
-        logging.info("Removed {0} from autoscale group".format(instance_id))
-      except Exception as e:
-        logging.warning('Failed to remove instance: {0}. Please Investigate: {1}'.format(instance_id, e))
+    self.terminate_instances(self.original_instance_ids)
     logging.info("TERMINATION OF OLD INSTANCES COMPLETE!")
 
   def get_cloudwatch_alarms_from_stack(self):
@@ -352,45 +609,64 @@ class RollingDeploy(object):
     try:
       if self.stack_name:
         return self.get_cloudwatch_alarms_from_stack()
-      all_cloud_watch_alarms = self.conn_cloudwatch.describe_alarms()
+      if self.project_cloudwatch_alarms is None:
+        self.project_cloudwatch_alarms = self.alarm_manager.find_alarm_names(self.is_project_alarm, self.alarm_prefix)
     except Exception as e:
       raise Exception("Error while retrieving the list of cloud-watch alarms. Error: {0}".format(e))
-    project_cloud_watch_alarms = [alarm.name for alarm in all_cloud_watch_alarms if self.project in alarm.name and self.env in alarm.name]
-    if len(project_cloud_watch_alarms) == 0:
+    if len(self.project_cloudwatch_alarms) == 0:
        logging.info("No cloud-watch alarm found")
-    return project_cloud_watch_alarms
+    return self.project_cloudwatch_alarms
+
+  def is_project_alarm(self, alarm_name):
+    return self.project in alarm_name and self.env in alarm_name
+
+  @property
+  def alarm_manager(self):
+    return AlarmManager(self.cloudwatch)
 
   def disable_project_cloudwatch_alarms(self):
     """ Disable all the cloud watch alarms """
     project_cloud_watch_alarms = self.retrieve_project_cloudwatch_alarms()
-    for alarm in project_cloud_watch_alarms:
-      try:
-        self.conn_cloudwatch.disable_alarm_actions(alarm)
-        logging.info("Disabled cloud-watch alarm. {0}".format(alarm))
-      except Exception as e:
-        raise Exception("Unable to disable the cloud-watch alarm, please investigate: {0}".format(e))
+    try:
+      self.alarm_manager.disable_alarms(project_cloud_watch_alarms)
+    except Exception as e:
+      raise Exception("Unable to disable the cloud-watch alarm, please investigate: {0}".format(e))
 
   def enable_project_cloudwatch_alarms(self):
     """ Enable all the cloud watch alarms """
     project_cloud_watch_alarms = self.retrieve_project_cloudwatch_alarms()
-    for alarm in project_cloud_watch_alarms:
-      logging.info("Found an alarm. {0}".format(alarm))
-      try:
-        self.conn_cloudwatch.enable_alarm_actions(alarm)
-        logging.info("Enabled cloud-watch alarm. {0}".format(alarm))
-      except Exception as e:
-        raise Exception("Unable to enable the cloud-watch alarm, please investigate: {0}".format(e))
+    logging.info("Found alarms. {0}".format(project_cloud_watch_alarms))
+    try:
+      self.alarm_manager.enable_alarms(project_cloud_watch_alarms)
+    except Exception as e:
+      raise Exception("Unable to enable the cloud-watch alarm, please investigate: {0}".format(e))
+
+  def get_target_groups(self, asg_group):
+    return list(self.describe_autoscaling_group(asg_group).get('TargetGroupARNs', []))
 
-  def get_target_group(self, asg_group):
-    target_groups = self.asg.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_group])['AutoScalingGroups'][0]['TargetGroupARNs']
-    return target_groups[0] if target_groups else False
+  def get_drain_timeout(self):
+    """ Seconds to let terminated instances drain from the target groups, their longest deregistration delay by default """
+    if self.drain_timeout is None:
+      delays = [0]
+      for target_group_arn in self.target_group_arns:
+        try:
+          attributes = self.elb2.describe_target_group_attributes(TargetGroupArn=target_group_arn)['Attributes']
+          delays.extend(int(a['Value']) for a in attributes if a['Key'] == 'deregistration_delay.timeout_seconds')
+        except Exception as e:
+          logging.warning("Unable to read the deregistration delay of {0}: {1}".format(target_group_arn, e))
+      self.drain_timeout = max(delays)
+    return self.drain_timeout
+
+  def get_load_balancers(self, asg_group):
+    """ The classic ELB passed in, if any, and every classic ELB attached to the autoscale group """
+    load_balancers = [self.load_balancer] if self.load_balancer else []
+    for name in self.describe_autoscaling_group(asg_group).get('LoadBalancerNames', []):
+      if name not in load_balancers:
+        load_balancers.append(name)
+    return load_balancers
 
   def is_redeploy(self):
-    current_reservations = self.get_reservations(self.original_instance_ids)
-    current_build_numbers = [instance.tags['BUILD']
-                             for reservation in current_reservations
-                             for instance in reservation.instances
-                             if 'BUILD' in instance.tags]
+    current_build_numbers = [build for build in self.get_build_tags(self.original_instance_ids).values() if build]
     if not current_build_numbers:
       self.stop_deploy('Failed to determine current build. Ensure instances contain tag "BUILD"')
     return self.build_number in current_build_numbers
@@ -398,37 +674,262 @@ class RollingDeploy(object):
   def stop_deploy(self, message='an error has occurred', e=None, error_code=2):
     raise Exception('{0}: {1}'.format(message, e))
 
+  def deploy_steps(self):
+    """ (state reached, step) pairs of this deploy, in order """
+    if self.batch_size:
+      replace_steps = [('old_replaced', self.replace_original_instances)]
+    else:
+      replace_steps = [
+        ('scaled_up', self.scale_up),
+        ('new_healthy', self.bring_up_new_instances),
+        ('old_terminated', self.terminate_original_instances_step),
+        ('scaled_down', self.scale_down),
+      ]
+    canary_steps = [('canary_promoted', self.run_canary)] if self.canary_size else []
+    return ([('discovered', self.discover), ('alarms_disabled', self.disable_project_cloudwatch_alarms)] +
+            canary_steps + replace_steps +
+            [('verified', self.confirm_lb_has_only_new_instances), ('tagged', self.tag_deployed_ami),
+             ('completed', self.enable_project_cloudwatch_alarms)])
+
   def deploy(self): # pragma: no cover
     """ Rollin Rollin Rollin, Rawhide! """
+    try:
+      steps = self.deploy_steps()
+      done = self.resume_from_checkpoint([state for state, step in steps]) if self.resume else 0
+      for state, step in steps[done:]:
+        self.cancel_token.check()
+        with self.metrics.span(step.__name__):
+          step()
+        self.save_checkpoint(state)
+      self.checkpoint.clear()
+      self.metrics.status = 'succeeded'
+      self.wait_histogram.log()
+      logging.info("Deployment Complete!")
+    except DeployCancelled:
+      self.metrics.status = 'cancelled'
+      raise
+    finally:
+      self.write_reports()
+      self.record_history()
+      self.clients.shutdown()
+
+  def discover(self):
     self.get_asg_info()
-    self.target_group_arn = self.get_target_group(self.asg_name)
+    self.load_balancers = self.get_load_balancers(self.asg_name)
+    self.target_group_arns = self.get_target_groups(self.asg_name)
     self.wait_ami_availability(self.ami_id)
     logging.info("Build #: {0} ::: Autoscale Group: {1}".format(self.build_number, self.asg_name))
     self.original_instance_ids = list(self.get_all_instance_ids(self.asg_name))
     self.log_instances_ips(self.original_instance_ids, self.asg_name)
     if not self.force_redeploy and self.is_redeploy():
       self.stop_deploy('You are attempting to redeploy the same build. Please pass the force_redeploy flag if a redeploy is desired')
-    self.disable_project_cloudwatch_alarms()
+    if self.auto_wait:
+      self.tune_waits()
+
+  def instance_type(self):
+    """ Instance type of the new instances once there are any, of the original instances before that """
+    instance_ids = (self.new_instance_ids or self.promoted_instance_ids or self.canary_instance_ids or
+                    self.original_instance_ids)[:1]
+    return self.inventory.lookup(instance_ids, 'type').get(instance_ids[0]) if instance_ids else None
+
+  def tune_waits(self):
+    """ Replace the wait budgets with what recent deploys needed, keeping those there is too little history for """
+    instance_type = self.instance_type()
+    for name, attribute in self.TUNED_WAITS:
+      try:
+        wait = self.history.suggest_wait(self.project, self.env, name, instance_type)
+      except Exception as e:
+        logging.warning("Unable to read the deploy history, keeping the {0} wait: {1}".format(name, e))
+        continue
+      if wait:
+        logging.info("Auto wait {0}: {1} tries every {2} seconds instead of {3}".format(name, wait[0], wait[1], getattr(self, attribute)))
+        setattr(self, attribute, wait)
+
+  def record_history(self):
+    """ Add the waits and phases of this deploy to the history, never failing the deploy over it """
+    if not self.history:
+      return
+    try:
+      self.history.record(self.project, self.env, self.instance_type(), self.metrics.status,
+                          self.wait_histogram.durations, self.metrics.phases)
+    except Exception as e:
+      logging.warning("Unable to record the deploy history: {0}".format(e))
+
+  def run_canary(self):
+    """ Bring up canary_size new instances next to the old ones, then promote the build or abort on its metrics
+
+    The canaries join every load balancer of the group, so they take about canary_size / (fleet + canary_size)
+    of the traffic. Promoted canaries stay in the group and count towards the new instances.
+    """
+    if self.batch_size and self.canary_size > self.batch_size:
+      raise Exception("The canary size {0} cannot be above the batch size {1}".format(self.canary_size, self.batch_size))
+    if self.resume and self.lifecycle_queue_url:
+      self.release_held_instances()
+    else:
+      self.start_lifecycle_events()
+    try:
+      self.set_autoscale_instance_desired_count(len(self.original_instance_ids) + self.canary_size, self.asg_name)
+      self.canary_instance_ids = list(self.launch_new_instances_pipelined(self.asg_name, self.canary_size))
+    finally:
+      self.stop_lifecycle_events()
+    analysis = CanaryAnalysis(self.cloudwatch, self.canary_metrics, self.canary_max_ratio,
+                              allow_missing_data=self.canary_allow_missing_data)
+    analysis.sleep = self.cancel_token.sleep
+    failures = analysis.observe(self.canary_instance_ids, self.original_instance_ids, self.canary_window)
+    if failures:
+      logging.error("Canary failed, removing {0}: {1}".format(self.canary_instance_ids, failures))
+      self.terminate_instances(self.canary_instance_ids)
+      self.checkpoint.clear()
+      raise Exception("Canary of build {0} failed: {1}".format(self.build_number, '; '.join(failures)))
+    logging.info("Canary {0} passed, promoting build {1}".format(self.canary_instance_ids, self.build_number))
+
+  def scale_up(self):
+    self.start_lifecycle_events()
     self.new_desired_capacity = self.calculate_autoscale_desired_instance_count(self.asg_name, 'increase')
     self.set_autoscale_instance_desired_count(self.new_desired_capacity, self.asg_name)
-    self.launch_new_instances(self.asg_name)
-    self.terminate_original_instances(self.asg_name)
+
+  def bring_up_new_instances(self):
+    if self.resume and self.lifecycle_queue_url and not self.lifecycle:
+      self.release_held_instances()
+    try:
+      self.new_instance_ids = list(self.launch_new_instances(self.asg_name))
+    finally:
+      self.stop_lifecycle_events()
+
+  def terminate_original_instances_step(self):
+    if self.resume:
+      # the interrupted deploy may have terminated some of them already
+      group_ids = set(self.get_all_instance_ids(self.asg_name, refresh=True))
+      self.terminate_instances([i for i in self.original_instance_ids if i in group_ids])
+    else:
+      self.terminate_original_instances(self.asg_name)
+
+  def scale_down(self):
     self.set_autoscale_instance_desired_count(len(self.original_instance_ids), self.asg_name)
-    self.confirm_lb_has_only_new_instances()
+
+  def replace_original_instances(self):
+    self.start_lifecycle_events()
+    try:
+      self.replace_instances_in_batches(self.asg_name)
+    finally:
+      self.stop_lifecycle_events()
+
+  def tag_deployed_ami(self):
     self.tag_ami(self.ami_id, self.env)
-    self.enable_project_cloudwatch_alarms()
-    logging.info("Deployment Complete!")
+
+  def checkpoint_data(self):
+    return {
+      'project': self.project,
+      'env': self.env,
+      'build_number': self.build_number,
+      'ami_id': self.ami_id,
+      'batch_size': self.batch_size,
+      'asg_name': self.asg_name,
+      'load_balancers': self.load_balancers,
+      'target_group_arns': self.target_group_arns,
+      'original_desired_capacity': self.asg_info and self.asg_info['AutoScalingGroups'][0]['DesiredCapacity'],
+      'original_instance_ids': self.original_instance_ids,
+      'new_desired_capacity': self.new_desired_capacity,
+      'new_instance_ids': self.new_instance_ids,
+      'promoted_instance_ids': self.promoted_instance_ids,
+      'retired_instance_ids': self.retired_instance_ids,
+      'canary_instance_ids': self.canary_instance_ids,
+    }
+
+  def save_checkpoint(self, state=None):
+    """ Record that state was reached, or just the progress made within the current state """
+    self.checkpoint_state = state or self.checkpoint_state
+    try:
+      self.checkpoint.save(self.checkpoint_state, self.checkpoint_data())
+    except Exception as e:
+      logging.warning("Unable to save checkpoint {0}: {1}".format(self.checkpoint.path, e))
+
+  def resume_from_checkpoint(self, states):
+    """ Restore what the interrupted deploy knew and return how many of its steps are done """
+    checkpoint = self.checkpoint.load()
+    if not checkpoint:
+      raise Exception("There is no checkpoint to resume from at {0}".format(self.checkpoint.path))
+    for key in ['project', 'env', 'build_number', 'ami_id', 'batch_size']:
+      if checkpoint.get(key) != getattr(self, key):
+        raise Exception("Checkpoint {0} is for {1} {2}, not {3}".format(self.checkpoint.path, key, checkpoint.get(key), getattr(self, key)))
+    if checkpoint['state'] not in states:
+      raise Exception("Checkpoint {0} has an unknown state {1}".format(self.checkpoint.path, checkpoint['state']))
+    self.checkpoint_state = checkpoint['state']
+    self.asg_name = checkpoint['asg_name']
+    self.load_balancers = checkpoint['load_balancers']
+    self.target_group_arns = checkpoint['target_group_arns']
+    self.asg_info = {'AutoScalingGroups': [{'AutoScalingGroupName': self.asg_name,
+                                            'DesiredCapacity': checkpoint['original_desired_capacity']}]}
+    for key in ['original_instance_ids', 'new_desired_capacity', 'new_instance_ids', 'promoted_instance_ids',
+                'retired_instance_ids', 'canary_instance_ids']:
+      setattr(self, key, checkpoint[key])
+    logging.info("Resuming deploy of {0} after state {1}".format(self.asg_name, self.checkpoint_state))
+    if self.auto_wait:
+      self.tune_waits()
+    return states.index(self.checkpoint_state) + 1
+
+  def write_reports(self):
+    """ Write the deploy report and metrics that were asked for, never failing the deploy over them """
+    extra = {
+      'autoscaling_group': self.asg_name,
+      'ami_id': self.ami_id,
+      'waits': self.wait_histogram.durations,
+      'instance_stage_timings': self.stage_timings,
+    }
+    try:
+      if self.report_file:
+        self.metrics.write_json(self.report_file, extra)
+      if self.metrics_textfile:
+        self.metrics.write_textfile(self.metrics_textfile)
+    except Exception as e:
+      logging.warning("Unable to write the deploy report: {0}".format(e))
+
+  def cancel(self, reason='cancelled'):
+    """ Make every wait of the deploy raise DeployCancelled right away, safe to call from a signal handler """
+    self.cancel_token.cancel(reason)
+
+  def roll_back_capacity(self):
+    """ Remove the new instances of a deploy stopped before the original instances went away """
+    if not self.original_instance_ids or self.checkpoint_state in self.SCALED_IN_STATES:
+      return
+    self.remove_new_instances()
+
+  def remove_new_instances(self):
+    """ Terminate every instance that is neither original nor promoted, in parallel, then restore the original DesiredCapacity """
+    kept = set(self.original_instance_ids) | set(self.promoted_instance_ids)
+    new_instance_ids = [i for i in self.get_all_instance_ids(self.asg_name, refresh=True) if i not in kept]
+    if new_instance_ids:
+      logging.warning("Terminating the new instances {0}".format(new_instance_ids))
+      self.terminate_instances(new_instance_ids)
+    self.restore_original_capacity(self.asg_name)
+
+  def abort(self, timeout=SHUTDOWN_TIMEOUT):
+    """ Clean up after a cancelled deploy within timeout seconds, return False if the cleanup ran out of time
+
+    The capacity is rolled back and the alarms are re-enabled at the same time, each in its own thread.
+    """
+    def run(task):
+      try:
+        task()
+      except Exception as e:
+        logging.error("Cleanup step {0} failed: {1}".format(task.__name__, e))
+    deadline = time() + timeout
+    threads = [threading.Thread(target=run, args=(task,), name=task.__name__)
+               for task in [self.roll_back_capacity, self.enable_project_cloudwatch_alarms]]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join(max(0, deadline - time()))
+    unfinished = [thread.name for thread in threads if thread.is_alive()]
+    if unfinished:
+      logging.error("Cleanup did not finish within {0} seconds: {1}".format(timeout, unfinished))
+    return not unfinished
 
   def revert_deployment(self): #pragma: no cover
     """ Will revert back to original instances in autoscale group """
     logging.error("REVERTING: Removing new instances from autoscale group")
-    new_instance_ids = self.gather_instance_info(self.asg_name)
-    for instance_id in new_instance_ids:
-      try:
-        self.conn_auto.terminate_instance(instance_id, decrement_capacity=True)
-        logging.info("Removed {0} from autoscale group".format(instance_id))
-      except:
-        logging.warning('Failed to remove instance: {0}.'.format(instance_id))
+    self.remove_new_instances()
     # raise so main can handle
     raise Exception('REVERT COMPLETE')
 
@@ -449,6 +950,29 @@ def get_args(): # pragma: no cover
   parser.add_argument('-o', '--only-new-wait', action='store', dest='only_new_wait', help='Wait time for old ec2 instances to terminate', type=int, nargs=2, default=[10, 30])
   parser.add_argument('-A', '--asg-logical-name', action='store', dest='asg_logical_name', help='ASG Logical Name from CFN', type=str)
   parser.add_argument('-L', '--load_balancer', action='store', dest='load_balancer', help='LoadBalancerName', type=str)
+  parser.add_argument('--alarm-prefix', action='store', dest='alarm_prefix', help='Name prefix shared by the project CloudWatch alarms, used to filter them server side', type=str)
+  parser.add_argument('--pipeline', action='store_true', dest='pipeline', help='Move each new instance through creation, status checks and health checks independently instead of waiting on the whole fleet at every step')
+  parser.add_argument('--batch-size', action='store', dest='batch_size', help='Replace old instances this many at a time instead of doubling the autoscale group', type=int)
+  parser.add_argument('--termination-concurrency', action='store', dest='termination_concurrency', help='Maximum number of instances terminated at the same time', type=int, default=10)
+  parser.add_argument('--drain-timeout', action='store', dest='drain_timeout', help='Seconds to let instances drain from their target groups before terminating them, by default the longest deregistration delay of the target groups, 0 to not wait', type=int)
+  parser.add_argument('-R', '--region', action='store', dest='region', help='Region to deploy to, overrides the region of the environment in the config file', type=str)
+  parser.add_argument('-g', '--asg-name', action='store', dest='asg_name', help='Name of the AutoScaling Group to deploy to, skips discovery by project and environment', type=str)
+  parser.add_argument('--report-file', action='store', dest='report_file', help='File to write a JSON report of phase timings and AWS calls to', type=str)
+  parser.add_argument('--metrics-textfile', action='store', dest='metrics_textfile', help='File to write Prometheus metrics to, for the node exporter textfile collector', type=str)
+  parser.add_argument('--checkpoint-file', action='store', dest='checkpoint_file', help='File the deploy state is saved to after every step, so that an interrupted deploy can be resumed', type=str)
+  parser.add_argument('--checkpoint-dir', action='store', dest='checkpoint_dir', help='Save the deploy state after every step to one file per target in this directory, by default ~/.license2deploy/checkpoints with --resume', type=str)
+  parser.add_argument('--resume', action='store_true', dest='resume', help='Continue an interrupted deploy from its checkpoint instead of starting over')
+  parser.add_argument('--lifecycle-queue-url', action='store', dest='lifecycle_queue_url', help='SQS queue to receive launch lifecycle events on, new instances are then picked up as they launch instead of by polling', type=str)
+  parser.add_argument('--lifecycle-role-arn', action='store', dest='lifecycle_role_arn', help='IAM role allowing the autoscale group to publish to the lifecycle queue, required with --lifecycle-queue-url', type=str)
+  parser.add_argument('--canary-size', action='store', dest='canary_size', help='Bring up this many new instances first and only go on with the deploy if their metrics hold up against the old instances', type=int)
+  parser.add_argument('--canary-window', action='store', dest='canary_window', help='Seconds the canary takes traffic before its metrics are compared', type=int, default=600)
+  parser.add_argument('--canary-metric', action='append', dest='canary_metrics', help='NAMESPACE:METRIC[:STATISTIC] of a metric published per InstanceId to compare, may be repeated, default AWS/EC2:CPUUtilization:Average', type=str)
+  parser.add_argument('--canary-max-ratio', action='store', dest='canary_max_ratio', help='Abort when a canary metric is more than this many times the baseline', type=float, default=1.5)
+  parser.add_argument('--canary-allow-missing-data', action='store_true', dest='canary_allow_missing_data', help='Skip the canary metrics without datapoints on the canary or the baseline instead of aborting')
+  parser.add_argument('--history-file', action='store', dest='history_file', help='Deploy history database the waits and phases of every deploy are recorded in, ~/.license2deploy/history.sqlite with --auto-wait, none otherwise', type=str)
+  parser.add_argument('--auto-wait', action='store_true', dest='auto_wait', help='Derive the wait budgets from p95 of recent deploys plus a margin instead of the wait options, where there is enough history')
+  parser.add_argument('--plan', action='store', dest='plan', nargs='?', const='text', choices=['text', 'json'], help='Print what the deploy would do and its worst case duration, as text or json, from read-only calls, then exit: 0 when nothing would stop it, 2 otherwise')
+  parser.add_argument('--shutdown-timeout', action='store', dest='shutdown_timeout', help='Seconds allowed on SIGINT/SIGTERM to remove the new instances, restore the capacity and re-enable the alarms before exiting', type=int, default=RollingDeploy.SHUTDOWN_TIMEOUT)
   parser.add_argument('-D', '--debug', action='store_true', help='If set, do not re-enable alarms on failure. Useful for debugging only.')
   return parser.parse_args()
 
@@ -458,18 +982,39 @@ def main(): # pragma: no cover
   SetLogging.setup_logging()
   deployObj = RollingDeploy(args.env, args.project, args.build_number, args.ami_id, args.profile, args.config,
                             args.stack_name, args.force_redeploy, None, args.creation_wait, args.ready_wait,
-                            args.health_wait, args.only_new_wait, args.asg_logical_name, args.load_balancer)
+                            args.health_wait, args.only_new_wait, args.asg_logical_name, args.load_balancer,
+                            args.alarm_prefix, args.pipeline, args.batch_size, args.termination_concurrency,
+                            args.region, args.asg_name, args.report_file, args.metrics_textfile,
+                            args.checkpoint_file, args.resume, None, args.lifecycle_queue_url,
+                            args.lifecycle_role_arn, args.canary_size, args.canary_window, args.canary_metrics,
+                            args.canary_max_ratio, args.history_file, args.auto_wait, args.checkpoint_dir,
+                            args.canary_allow_missing_data, args.drain_timeout)
+
+  if args.plan:
+    try:
+      plan = DeployPlanner(deployObj).plan()
+    except Exception as e:
+      logging.error("Unable to plan the deploy: {0}".format(e))
+      exit(2)
+    print(DeployPlanner.format(plan, args.plan))
+    exit(2 if plan['problems'] else 0)
 
-  # support graceful exit on sigint/sigterm
+  # support graceful exit on sigint/sigterm: the waits are cancelled and the deploy cleans up within the deadline
   def signal_handler(signum, frame):
     # defined here to encapsulate deployObj for graceful exit
-    deployObj.enable_project_cloudwatch_alarms()
-    exit(2)
+    if not deployObj.cancel_token.is_cancelled():
+      logging.warning("Received signal {0}, cancelling the deploy".format(signum))
+      start_watchdog(args.shutdown_timeout)
+      deployObj.cancel("signal {0}".format(signum))
   signal.signal(signal.SIGINT, signal_handler)
   signal.signal(signal.SIGTERM, signal_handler)
 
   try:
     deployObj.deploy()
+  except DeployCancelled as e:
+    logging.error("Deploy cancelled by {0}, cleaning up".format(e))
+    deployObj.abort(args.shutdown_timeout)
+    exit(2)
   except Exception as e:
     logging.error(str(e))
     # don't auto recover if running in debug mode
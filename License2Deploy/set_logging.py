@@ -4,7 +4,7 @@ import logging
 class SetLogging(object):
 
   @staticmethod
-  def setup_logging(): # pragma: no cover
-    logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s',level=logging.INFO)
+  def setup_logging(thread_names=False): # pragma: no cover
+    fmt = '%(asctime)s: %(threadName)s: %(levelname)s: %(message)s' if thread_names else '%(asctime)s: %(levelname)s: %(message)s'
+    logging.basicConfig(format=fmt,level=logging.INFO)
     logging.info("Begin Logging...")
-
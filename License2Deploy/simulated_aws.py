@@ -0,0 +1,334 @@
+import math
+import os
+import random
+import threading
+from time import sleep, time
+from .lifecycle import LifecycleEvents, LocalLifecycleQueue
+from .rolling_deploy import RollingDeploy
+
+
+class SimulatedThrottle(Exception):
+  """ Throttling error carrying the error code the way botocore exceptions do """
+
+  def __init__(self, operation):
+    super(SimulatedThrottle, self).__init__('Rate exceeded calling {0}'.format(operation))
+    self.response = {'Error': {'Code': 'Throttling'}}
+
+
+class SimulatedAWS(object):
+  """ In-memory autoscale group, load balancers, EC2 and CloudWatch with per-call latency, throttling and lag
+
+  New instances show up in the autoscale group consistency_delay seconds after launch, pass their status
+  checks boot_delay seconds later and their load balancer health checks health_delay seconds after that.
+  While a lifecycle hook is registered, new instances are announced on lifecycle_queue right away and stay
+  out of the load balancers until their lifecycle action is completed. Every per instance metric reads
+  metric_values[build] of the build the instance runs, 1.0 by default. Targets deregistered from the target
+  groups drain for drain_delay seconds, the instances terminated before that are listed in terminated_draining.
+  """
+
+  def __init__(self, fleet_size, build_number='1', latency=0, throttle_rate=0, consistency_delay=0,
+               boot_delay=0, health_delay=0, alarm_count=0, project='server', env='qa', seed=None,
+               target_group_count=1, api_rate=None, drain_delay=0):
+    self.latency = latency
+    self.throttle_rate = throttle_rate
+    self.api_rate = api_rate
+    self.api_tokens = api_rate
+    self.api_updated = time()
+    self.consistency_delay = consistency_delay
+    self.boot_delay = boot_delay
+    self.health_delay = health_delay
+    self.drain_delay = drain_delay
+    self.terminated_draining = []
+    self.deploy_build = None
+    self.group_name = '{0}-{1}-asg'.format(project, env)
+    self.load_balancer = '{0}-{1}-elb'.format(project, env)
+    self.target_group_arns = ['arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/{0}-{1}/{2}'.format(project, env, i)
+                              for i in range(target_group_count)]
+    self.ami_id = 'ami-12345678'
+    self.ami_tags = {}
+    self.alarm_names = ['{0}-{1}-alarm-{2}'.format(project, env, i) for i in range(alarm_count)]
+    self.disabled_alarms = set()
+    self.metric_values = {}
+    self.calls = {}
+    self.random = random.Random(seed)
+    self.instances = {}
+    self.group_instances = []
+    self.desired_capacity = 0
+    self.lifecycle_hook = None
+    self.lifecycle_queue = LocalLifecycleQueue()
+    self._next_id = 0
+    self._lock = threading.RLock()
+    self.launch(fleet_size, build_number, ready=True)
+    self.desired_capacity = fleet_size
+
+  def clients(self):
+    """ Stand-ins for every client RollingDeploy uses, keyed by their AWSClients name """
+    return {
+      'ec2': SimulatedEC2(self),
+      'elb': SimulatedELB(self),
+      'cloudwatch': SimulatedCloudWatch(self),
+      'asg': SimulatedAutoScaling(self),
+      'elb2': SimulatedELBv2(self),
+    }
+
+  def call(self, operation):
+    """ Count the call, spend the simulated latency outside the lock and maybe throttle it
+
+    Calls are throttled at random at throttle_rate, and whenever they come in faster than api_rate a second
+    (with a burst of one second worth of calls).
+    """
+    with self._lock:
+      self.calls[operation] = self.calls.get(operation, 0) + 1
+      throttled = self.random.random() < self.throttle_rate
+      if self.api_rate:
+        now = time()
+        self.api_tokens = min(self.api_rate, self.api_tokens + (now - self.api_updated) * self.api_rate)
+        self.api_updated = now
+        throttled = throttled or self.api_tokens < 1
+        self.api_tokens = max(0, self.api_tokens - 1)
+    if self.latency:
+      sleep(self.latency)
+    if throttled:
+      with self._lock:
+        self.calls['throttled'] = self.calls.get('throttled', 0) + 1
+      raise SimulatedThrottle(operation)
+
+  def total_calls(self):
+    return sum(count for operation, count in self.calls.items() if operation != 'throttled')
+
+  def launch(self, count, build, ready=False):
+    now = time()
+    for i in range(count):
+      self._next_id += 1
+      launched = now - self.consistency_delay - self.boot_delay - self.health_delay if ready else now
+      instance_id = 'i-{0:08x}'.format(self._next_id)
+      self.instances[instance_id] = {
+        'build': build,
+        'ip': '10.0.{0}.{1}'.format(self._next_id // 250, self._next_id % 250 + 1),
+        'visible_at': launched + self.consistency_delay,
+        'ok_at': launched + self.consistency_delay + self.boot_delay,
+        'healthy_at': launched + self.consistency_delay + self.boot_delay + self.health_delay,
+      }
+      self.group_instances.append(instance_id)
+      if self.lifecycle_hook and not ready:
+        self.instances[instance_id]['held'] = True
+        self.lifecycle_queue.put({'LifecycleTransition': self.lifecycle_hook['LifecycleTransition'],
+                                  'LifecycleHookName': self.lifecycle_hook['LifecycleHookName'],
+                                  'AutoScalingGroupName': self.group_name, 'EC2InstanceId': instance_id,
+                                  'LifecycleActionToken': 'token-{0}'.format(instance_id)})
+
+  def set_desired_capacity(self, capacity):
+    with self._lock:
+      self.desired_capacity = capacity
+      missing = capacity - len(self.group_instances)
+      if missing > 0:
+        self.launch(missing, self.deploy_build)
+      for instance_id in self.group_instances[:max(0, -missing)]:
+        self.remove(instance_id)
+
+  def remove(self, instance_id):
+    if instance_id in self.group_instances:
+      self.group_instances.remove(instance_id)
+    self.instances.pop(instance_id, None)
+
+  def visible_instance_ids(self):
+    now = time()
+    return [i for i in self.group_instances if self.instances[i]['visible_at'] <= now]
+
+  def is_ok(self, instance_id):
+    return instance_id in self.instances and self.instances[instance_id]['ok_at'] <= time()
+
+  def is_draining(self, instance_id):
+    instance = self.instances.get(instance_id)
+    return bool(instance) and 'deregistered_at' in instance and time() < instance['deregistered_at'] + self.drain_delay
+
+  def target_state(self, instance_id):
+    if 'deregistered_at' in self.instances.get(instance_id, {}):
+      return 'draining' if self.is_draining(instance_id) else 'unused'
+    return 'healthy' if self.is_healthy(instance_id) else 'initial'
+
+  def is_healthy(self, instance_id):
+    instance = self.instances.get(instance_id)
+    return bool(instance) and not instance.get('held') and instance['healthy_at'] <= time()
+
+  def release(self, instance_id):
+    """ Lifecycle action completed, the instance joins the load balancers and starts its health checks """
+    with self._lock:
+      instance = self.instances.get(instance_id)
+      if instance and instance.pop('held', False):
+        instance['healthy_at'] = max(instance['healthy_at'], time() + self.health_delay)
+
+  def reservations(self, instance_ids):
+    with self._lock:
+      return {'Reservations': [{'Instances': [{
+        'InstanceId': i, 'InstanceType': 'm5.large', 'PrivateIpAddress': self.instances[i]['ip'],
+        'State': {'Name': 'running'}, 'Tags': [{'Key': 'BUILD', 'Value': self.instances[i]['build']}]}]}
+        for i in instance_ids if i in self.instances]}
+
+
+class SimulatedEC2(object):
+  """ The boto3 EC2 calls RollingDeploy makes """
+
+  def __init__(self, aws):
+    self.aws = aws
+
+  def describe_images(self, ImageIds=None):
+    self.aws.call('ec2.DescribeImages')
+    tags = [{'Key': key, 'Value': value} for key, value in sorted(self.aws.ami_tags.items())]
+    return {'Images': [{'ImageId': self.aws.ami_id, 'State': 'available', 'Tags': tags}]}
+
+  def create_tags(self, Resources, Tags):
+    self.aws.call('ec2.CreateTags')
+    self.aws.ami_tags.update((tag['Key'], tag['Value']) for tag in Tags)
+
+  def describe_instances(self, InstanceIds=None, Filters=None, NextToken=None):
+    self.aws.call('ec2.DescribeInstances')
+    instance_ids = InstanceIds or [v for f in Filters or [] if f['Name'] == 'instance-id' for v in f['Values']]
+    return self.aws.reservations(instance_ids)
+
+  def describe_instance_status(self, InstanceIds=None, NextToken=None):
+    self.aws.call('ec2.DescribeInstanceStatus')
+    with self.aws._lock:
+      return {'InstanceStatuses': [{'InstanceId': i, 'SystemStatus': {'Status': 'ok'}, 'InstanceStatus': {'Status': 'ok'}}
+                                   for i in InstanceIds if self.aws.is_ok(i)]}
+
+
+class SimulatedELB(object):
+  """ The boto3 classic load balancer calls RollingDeploy makes """
+
+  def __init__(self, aws):
+    self.aws = aws
+
+  def describe_instance_health(self, LoadBalancerName, Instances=None):
+    self.aws.call('elb.DescribeInstanceHealth')
+    with self.aws._lock:
+      instance_ids = [i['InstanceId'] for i in Instances] if Instances is not None else self.aws.visible_instance_ids()
+      return {'InstanceStates': [{'InstanceId': i, 'State': 'InService' if self.aws.is_healthy(i) else 'OutOfService'}
+                                 for i in instance_ids]}
+
+  def deregister_instances_from_load_balancer(self, LoadBalancerName, Instances):
+    self.aws.call('elb.DeregisterInstancesFromLoadBalancer')
+
+
+class SimulatedELBv2(object):
+  """ The boto3 target group calls RollingDeploy makes """
+
+  def __init__(self, aws):
+    self.aws = aws
+
+  def describe_target_health(self, TargetGroupArn, Targets=None):
+    self.aws.call('elbv2.DescribeTargetHealth')
+    with self.aws._lock:
+      instance_ids = [t['Id'] for t in Targets] if Targets is not None else self.aws.visible_instance_ids()
+      return {'TargetHealthDescriptions': [
+        {'Target': {'Id': i}, 'TargetHealth': {'State': self.aws.target_state(i)}} for i in instance_ids]}
+
+  def describe_target_group_attributes(self, TargetGroupArn):
+    self.aws.call('elbv2.DescribeTargetGroupAttributes')
+    return {'Attributes': [{'Key': 'deregistration_delay.timeout_seconds',
+                            'Value': str(int(math.ceil(self.aws.drain_delay)))}]}
+
+  def deregister_targets(self, TargetGroupArn, Targets):
+    self.aws.call('elbv2.DeregisterTargets')
+    with self.aws._lock:
+      for target in Targets:
+        self.aws.instances.get(target['Id'], {}).setdefault('deregistered_at', time())
+
+
+class SimulatedAutoScaling(object):
+  """ The boto3 autoscaling calls RollingDeploy makes """
+
+  def __init__(self, aws):
+    self.aws = aws
+
+  def describe_auto_scaling_groups(self, AutoScalingGroupNames=None):
+    self.aws.call('autoscaling.DescribeAutoScalingGroups')
+    with self.aws._lock:
+      return {'AutoScalingGroups': [{
+        'AutoScalingGroupName': self.aws.group_name,
+        'DesiredCapacity': self.aws.desired_capacity,
+        'LoadBalancerNames': [self.aws.load_balancer],
+        'TargetGroupARNs': list(self.aws.target_group_arns),
+        'Instances': [{'InstanceId': i} for i in self.aws.visible_instance_ids()],
+      }]}
+
+  def set_desired_capacity(self, AutoScalingGroupName, DesiredCapacity):
+    self.aws.call('autoscaling.SetDesiredCapacity')
+    self.aws.set_desired_capacity(DesiredCapacity)
+
+  def put_lifecycle_hook(self, **hook):
+    self.aws.call('autoscaling.PutLifecycleHook')
+    self.aws.lifecycle_hook = hook
+
+  def delete_lifecycle_hook(self, LifecycleHookName, AutoScalingGroupName):
+    self.aws.call('autoscaling.DeleteLifecycleHook')
+    self.aws.lifecycle_hook = None
+
+  def complete_lifecycle_action(self, LifecycleHookName, AutoScalingGroupName, LifecycleActionResult,
+                                InstanceId, LifecycleActionToken=None):
+    self.aws.call('autoscaling.CompleteLifecycleAction')
+    self.aws.release(InstanceId)
+
+  def terminate_instance_in_auto_scaling_group(self, InstanceId, ShouldDecrementDesiredCapacity):
+    self.aws.call('autoscaling.TerminateInstanceInAutoScalingGroup')
+    with self.aws._lock:
+      if self.aws.is_draining(InstanceId):
+        self.aws.terminated_draining.append(InstanceId)
+      self.aws.remove(InstanceId)
+      if ShouldDecrementDesiredCapacity:
+        self.aws.desired_capacity -= 1
+
+
+class SimulatedCloudWatch(object):
+  """ The boto3 CloudWatch calls RollingDeploy and the canary make """
+
+  def __init__(self, aws):
+    self.aws = aws
+
+  def describe_alarms(self, AlarmNamePrefix=None, MaxRecords=None, NextToken=None):
+    self.aws.call('cloudwatch.DescribeAlarms')
+    names = [name for name in self.aws.alarm_names if not AlarmNamePrefix or name.startswith(AlarmNamePrefix)]
+    start = int(NextToken or 0)
+    end = start + (MaxRecords or len(names))
+    page = {'MetricAlarms': [{'AlarmName': name} for name in names[start:end]]}
+    if end < len(names):
+      page['NextToken'] = str(end)
+    return page
+
+  def disable_alarm_actions(self, AlarmNames):
+    self.aws.call('cloudwatch.DisableAlarmActions')
+    self.aws.disabled_alarms.update(AlarmNames)
+
+  def enable_alarm_actions(self, AlarmNames):
+    self.aws.call('cloudwatch.EnableAlarmActions')
+    self.aws.disabled_alarms.difference_update(AlarmNames)
+
+  def get_metric_data(self, MetricDataQueries, StartTime, EndTime, NextToken=None):
+    self.aws.call('cloudwatch.GetMetricData')
+    results = []
+    with self.aws._lock:
+      for query in MetricDataQueries:
+        instance_id = query['MetricStat']['Metric']['Dimensions'][0]['Value']
+        instance = self.aws.instances.get(instance_id)
+        values = [self.aws.metric_values.get(instance['build'], 1.0)] if instance else []
+        results.append({'Id': query['Id'], 'Values': values, 'StatusCode': 'Complete'})
+    return {'MetricDataResults': results}
+
+
+WAIT = [2000, 0.05]
+
+
+def simulated_deploy(aws, directory=None, mode='double', batch_size=None, lifecycle=False, limiter=None, **settings):
+  """ RollingDeploy of build 2 to the group of aws through its simulated clients, checkpointed under directory if given """
+  if directory:
+    settings.setdefault('checkpoint_file', os.path.join(directory, 'checkpoint.json'))
+  deploy = RollingDeploy('qa', 'server', '2', aws.ami_id, 'default', None, None, False, None, WAIT, WAIT, WAIT, WAIT,
+                         None, aws.load_balancer, pipeline=mode == 'pipeline',
+                         batch_size=batch_size if mode == 'batch' else None, region='us-east-1',
+                         asg_name=aws.group_name, **settings)
+  for name, client in aws.clients().items():
+    deploy.clients.set(name, limiter.wrap(name, client) if limiter else client)
+  deploy.metrics.rate_limiter = limiter
+  if lifecycle:
+    deploy.lifecycle = LifecycleEvents(deploy.asg, aws.group_name, aws.lifecycle_queue)
+  return deploy
@@ -0,0 +1,92 @@
+import logging
+from multiprocessing.pool import ThreadPool
+from time import sleep
+from .AWSConn import AWSConn
+from .poller import Poller
+
+
+class InstanceTerminator(object):
+  """ Takes instances out of their load balancers in bulk, then terminates them with bounded concurrency
+
+  With a drain_timeout, the instances are only terminated once their target groups are done draining them, or
+  after drain_timeout seconds, or as soon as token is cancelled.
+  """
+
+  def __init__(self, asg, elb=None, elb2=None, load_balancers=(), target_group_arns=(),
+               max_workers=10, max_attempts=5, backoff=1, drain_timeout=0, token=None, histogram=None):
+    self.asg = asg
+    self.elb = elb
+    self.elb2 = elb2
+    self.load_balancers = list(load_balancers)
+    self.target_group_arns = list(target_group_arns)
+    self.max_workers = max_workers
+    self.max_attempts = max_attempts
+    self.backoff = backoff
+    self.drain_timeout = drain_timeout
+    self.token = token
+    self.histogram = histogram
+
+  def deregister(self, instance_ids):
+    """ Remove the instances from every classic ELB and target group with one call each, then let them drain """
+    instances = [{'InstanceId': instance_id} for instance_id in instance_ids]
+    for load_balancer in self.load_balancers:
+      self.elb.deregister_instances_from_load_balancer(LoadBalancerName=load_balancer, Instances=instances)
+      logging.info("Deregistered {0} from ELB {1}".format(instance_ids, load_balancer))
+    targets = [{'Id': instance_id} for instance_id in instance_ids]
+    for target_group_arn in self.target_group_arns:
+      self.elb2.deregister_targets(TargetGroupArn=target_group_arn, Targets=targets)
+      logging.info("Deregistered {0} from TargetGroup {1}".format(instance_ids, target_group_arn))
+    if self.drain_timeout:
+      for target_group_arn in self.target_group_arns:
+        self.wait_for_drain(target_group_arn, targets)
+
+  def wait_for_drain(self, target_group_arn, targets):
+    def drained():
+      if self.token and self.token.is_cancelled():
+        return True
+      try:
+        health = self.elb2.describe_target_health(TargetGroupArn=target_group_arn, Targets=targets)
+      except Exception as e:
+        if AWSConn.error_code(e) == 'InvalidTarget':
+          return True
+        raise
+      return all(d['TargetHealth']['State'] == 'unused' for d in health['TargetHealthDescriptions'])
+    poller = Poller(self.drain_timeout, max_delay=10, name='drain', histogram=self.histogram)
+    try:
+      if not poller.wait(drained):
+        logging.warning("Targets are still draining from {0} after {1} seconds, terminating anyway".format(
+          target_group_arn, self.drain_timeout))
+    except Exception as e:
+      logging.warning("Unable to wait for the targets to drain from {0}, terminating anyway: {1}".format(target_group_arn, e))
+
+  def terminate(self, instance_ids):
+    """ Deregister then terminate every instance, return a report of the outcome for each one """
+    instance_ids = list(instance_ids)
+    if not instance_ids:
+      return {}
+    try:
+      self.deregister(instance_ids)
+    except Exception as e:
+      logging.warning("Unable to deregister instances from the load balancers, terminating anyway: {0}".format(e))
+    pool = ThreadPool(min(self.max_workers, len(instance_ids)))
+    try:
+      results = pool.map(self.terminate_instance, instance_ids)
+    finally:
+      pool.close()
+      pool.join()
+    return dict(zip(instance_ids, results))
+
+  def terminate_instance(self, instance_id):
+    attempt = 0
+    while True:
+      attempt += 1
+      try:
+        self.asg.terminate_instance_in_auto_scaling_group(InstanceId=instance_id, ShouldDecrementDesiredCapacity=True)
+        logging.info("Removed {0} from autoscale group".format(instance_id))
+        return {'status': 'terminated', 'attempts': attempt}
+      except Exception as e:
+        if AWSConn.is_throttling_error(e) and attempt < self.max_attempts:
+          sleep(self.backoff * 2 ** (attempt - 1))
+          continue
+        logging.warning('Failed to remove instance: {0}. Please Investigate: {1}'.format(instance_id, e))
+        return {'status': 'failed', 'attempts': attempt, 'error': str(e)}
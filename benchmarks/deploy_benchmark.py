@@ -0,0 +1,134 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+from time import time
+from License2Deploy.rate_limiter import RateLimiter
+from License2Deploy.simulated_aws import SimulatedAWS, simulated_deploy
+
+
+class DeployBenchmark(object):
+  """ Runs RollingDeploy end to end against SimulatedAWS and measures wall time, AWS calls and peak memory """
+
+  def __init__(self, latency=0, throttle_rate=0, consistency_delay=0, boot_delay=0, health_delay=0,
+               alarm_count=0, mode='double', batch_size=None, seed=None, lifecycle=False, target_group_count=1,
+               api_rate=None, rate_limits=None):
+    self.latency = latency
+    self.throttle_rate = throttle_rate
+    self.consistency_delay = consistency_delay
+    self.boot_delay = boot_delay
+    self.health_delay = health_delay
+    self.alarm_count = alarm_count
+    self.mode = mode
+    self.batch_size = batch_size
+    self.seed = seed
+    self.lifecycle = lifecycle
+    self.target_group_count = target_group_count
+    self.api_rate = api_rate
+    self.rate_limits = rate_limits
+
+  def build_deploy(self, aws, directory=None, **settings):
+    """ RollingDeploy through the simulated clients, checkpoint and history kept in directory if given """
+    if directory:
+      settings.setdefault('history_file', os.path.join(directory, 'history.sqlite'))
+    return simulated_deploy(aws, directory, mode=self.mode, batch_size=self.batch_size, lifecycle=self.lifecycle,
+                            limiter=RateLimiter(self.rate_limits) if self.rate_limits is not None else None, **settings)
+
+  def run(self, fleet_size):
+    """ Deploy to a simulated fleet of fleet_size instances and return the measurements """
+    aws = SimulatedAWS(fleet_size, latency=self.latency, throttle_rate=self.throttle_rate,
+                       consistency_delay=self.consistency_delay, boot_delay=self.boot_delay,
+                       health_delay=self.health_delay, alarm_count=self.alarm_count, seed=self.seed,
+                       target_group_count=self.target_group_count, api_rate=self.api_rate)
+    aws.deploy_build = '2'
+    checkpoint_directory = tempfile.mkdtemp()
+    deploy = self.build_deploy(aws, checkpoint_directory)
+    tracemalloc = self.start_tracing()
+    started = time()
+    error = None
+    try:
+      deploy.deploy()
+    except Exception as e:
+      error = str(e)
+    finally:
+      shutil.rmtree(checkpoint_directory)
+    result = {
+      'fleet_size': fleet_size,
+      'mode': self.mode + ('+lifecycle' if self.lifecycle else '') + ('+limited' if self.rate_limits is not None else ''),
+      'status': 'failed' if error else 'succeeded',
+      'wall_seconds': round(time() - started, 3),
+      'api_calls': aws.total_calls(),
+      'api_calls_per_instance': round(float(aws.total_calls()) / fleet_size, 2),
+      'throttled': aws.calls.get('throttled', 0),
+      'calls': dict(aws.calls),
+      'peak_memory_kb': None,
+      'phases': dict((phase['name'], round(phase['duration'], 3)) for phase in deploy.metrics.phases),
+      'rate_limit_wait_seconds': round(sum(stats['waited_seconds'] for stats in
+                                           (deploy.metrics.rate_limiter.stats() if deploy.metrics.rate_limiter else {}).values()), 3),
+    }
+    if tracemalloc:
+      result['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+      tracemalloc.stop()
+    if error:
+      result['error'] = error
+    return result
+
+  @staticmethod
+  def start_tracing():
+    """ tracemalloc is only there on python 3, peak memory is left out on python 2 """
+    try:
+      import tracemalloc
+    except ImportError:
+      return None
+    tracemalloc.start()
+    return tracemalloc
+
+  def run_all(self, fleet_sizes):
+    return [self.run(fleet_size) for fleet_size in fleet_sizes]
+
+  @staticmethod
+  def format_table(results):
+    lines = ['{0:>6} {1:>18} {2:>10} {3:>8} {4:>10} {5:>10} {6:>12}'.format(
+      'fleet', 'mode', 'status', 'seconds', 'api calls', 'throttled', 'peak mem kb')]
+    for r in results:
+      lines.append('{0:>6} {1:>18} {2:>10} {3:>8.2f} {4:>10} {5:>10} {6:>12}'.format(
+        r['fleet_size'], r['mode'], r['status'], r['wall_seconds'], r['api_calls'], r['throttled'],
+        r['peak_memory_kb'] if r['peak_memory_kb'] is not None else '-'))
+    return '\n'.join(lines)
+
+
+def get_args(): # pragma: no cover
+  parser = argparse.ArgumentParser(description='Benchmark rolling deploys against a simulated AWS')
+  parser.add_argument('-n', '--fleet-sizes', action='store', dest='fleet_sizes', help='Fleet sizes to deploy to', type=int, nargs='+', default=[2, 10, 50, 100, 250, 500])
+  parser.add_argument('-m', '--mode', action='store', dest='mode', help='Deploy mode', choices=['double', 'pipeline', 'batch'], default='double')
+  parser.add_argument('--batch-size', action='store', dest='batch_size', help='Batch size in batch mode', type=int, default=10)
+  parser.add_argument('--latency', action='store', dest='latency', help='Seconds added to every AWS call', type=float, default=0.005)
+  parser.add_argument('--throttle-rate', action='store', dest='throttle_rate', help='Fraction of AWS calls failing with Throttling', type=float, default=0)
+  parser.add_argument('--consistency-delay', action='store', dest='consistency_delay', help='Seconds before a new instance shows up in the autoscale group', type=float, default=0.1)
+  parser.add_argument('--boot-delay', action='store', dest='boot_delay', help='Seconds before a new instance passes its status checks', type=float, default=0.2)
+  parser.add_argument('--health-delay', action='store', dest='health_delay', help='Seconds before a ready instance passes its health checks', type=float, default=0.2)
+  parser.add_argument('--alarms', action='store', dest='alarm_count', help='Number of project CloudWatch alarms', type=int, default=20)
+  parser.add_argument('--seed', action='store', dest='seed', help='Seed of the simulated throttling', type=int)
+  parser.add_argument('--lifecycle', action='store_true', dest='lifecycle', help='Pick up new instances from launch lifecycle events instead of polling')
+  parser.add_argument('--target-groups', action='store', dest='target_group_count', help='Number of target groups attached to the autoscale group', type=int, default=1)
+  parser.add_argument('--api-rate', action='store', dest='api_rate', help='AWS calls a second the simulated account allows before throttling', type=float)
+  parser.add_argument('--rate-limit', action='store', dest='rate_limit', help='Send every call through the client side rate limiter, with this many calls a second for every API family', type=float)
+  parser.add_argument('--json', action='store_true', dest='json', help='Print the results as JSON instead of a table')
+  return parser.parse_args()
+
+
+def main(): # pragma: no cover
+  args = get_args()
+  logging.basicConfig(level=logging.ERROR)
+  benchmark = DeployBenchmark(args.latency, args.throttle_rate, args.consistency_delay, args.boot_delay,
+                              args.health_delay, args.alarm_count, args.mode, args.batch_size, args.seed,
+                              args.lifecycle, args.target_group_count, args.api_rate,
+                              dict((family, (args.rate_limit, args.rate_limit)) for family in RateLimiter.BUDGETS) if args.rate_limit else None)
+  results = benchmark.run_all(args.fleet_sizes)
+  print(json.dumps(results, indent=2, sort_keys=True) if args.json else DeployBenchmark.format_table(results))
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
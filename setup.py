@@ -18,22 +18,23 @@ setup(
     packages=['License2Deploy'],
     entry_points={
         'console_scripts': [
-            'rolling_deploy = License2Deploy.rolling_deploy:main'
+            'rolling_deploy = License2Deploy.rolling_deploy:main',
+            'rolling_deploy_orchestrate = License2Deploy.orchestrator:main',
+            'rolling_deploy_daemon = License2Deploy.daemon:main',
+            'rolling_deploy_history = License2Deploy.history:main'
         ]
     },
     include_package_data=True,
     install_requires=[
         'botocore==1.12.123',
-        'boto==2.49.0',
         'boto3==1.9.123',
-        'PyYAML==5.1',
-        'retry==0.9.2',
-        'decorator==4.4.2'
+        'futures==3.2.0; python_version < "3"',
+        'PyYAML==5.1'
     ],
     extras_require={'test': [
         'coverage',
         'mock',
-        'moto',
+        'moto==1.3.8',
         'placebo',
         'pytest',
     ]},
@@ -0,0 +1,43 @@
+import unittest
+from mock import MagicMock, call
+
+from License2Deploy.alarm_manager import AlarmManager
+
+
+def alarm_page(names, next_token=None):
+  page = {'MetricAlarms': [{'AlarmName': name} for name in names]}
+  if next_token:
+    page['NextToken'] = next_token
+  return page
+
+
+class AlarmManagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.conn = MagicMock()
+    self.alarm_manager = AlarmManager(self.conn)
+
+  def test_find_alarm_names_follows_pages(self):
+    self.conn.describe_alarms.side_effect = [alarm_page(['project-stg-cpu', 'other-stg'], 'token'),
+                                             alarm_page(['project-stg-disk'])]
+    names = self.alarm_manager.find_alarm_names(lambda name: 'project' in name, 'project')
+    self.assertEqual(names, ['project-stg-cpu', 'project-stg-disk'])
+    self.conn.describe_alarms.assert_has_calls([
+      call(AlarmNamePrefix='project', MaxRecords=AlarmManager.PAGE_SIZE),
+      call(AlarmNamePrefix='project', MaxRecords=AlarmManager.PAGE_SIZE, NextToken='token')])
+
+  def test_find_alarm_names_without_prefix(self):
+    self.conn.describe_alarms.return_value = alarm_page(['project-stg-cpu'])
+    self.assertEqual(self.alarm_manager.find_alarm_names(lambda name: True), ['project-stg-cpu'])
+    self.conn.describe_alarms.assert_called_once_with(MaxRecords=AlarmManager.PAGE_SIZE)
+
+  def test_toggle_alarms_in_batches(self):
+    names = ['alarm{0}'.format(i) for i in range(AlarmManager.MAX_ALARMS_PER_CALL + 1)]
+    self.alarm_manager.disable_alarms(names)
+    self.alarm_manager.enable_alarms(names)
+    self.conn.disable_alarm_actions.assert_has_calls([call(AlarmNames=names[:-1]), call(AlarmNames=names[-1:])])
+    self.conn.enable_alarm_actions.assert_has_calls([call(AlarmNames=names[:-1]), call(AlarmNames=names[-1:])])
+
+  def test_toggle_no_alarms(self):
+    self.alarm_manager.enable_alarms([])
+    self.conn.enable_alarm_actions.assert_not_called()
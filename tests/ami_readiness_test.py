@@ -0,0 +1,113 @@
+import threading
+import unittest
+from mock import MagicMock
+
+from License2Deploy.AWSConn import ClientPool
+from License2Deploy.ami_readiness import AMIReadiness
+from License2Deploy.cancellation import CancellationToken, DeployCancelled
+
+
+class FakeEC2(object):
+  """ describe_images answering each AMI with the next of its states, the last one sticking """
+
+  def __init__(self, states):
+    self.states = states
+    self.calls = []
+    self.copy_image = MagicMock(return_value={'ImageId': 'ami-copy'})
+
+  def describe_images(self, ImageIds):
+    self.calls.append(sorted(ImageIds))
+    images = []
+    for ami_id in ImageIds:
+      states = self.states.setdefault(ami_id, ['pending'])
+      images.append({'ImageId': ami_id, 'Name': 'app-42', 'State': states.pop(0) if len(states) > 1 else states[0]})
+    return {'Images': images}
+
+
+class AMIReadinessTest(unittest.TestCase):
+
+  def readiness(self, regions, **kwargs):
+    pool = ClientPool()
+    for region, ec2 in regions.items():
+      pool.clients(region, None).set('ec2', ec2)
+    readiness = AMIReadiness(client_pool=pool, max_delay=1, **kwargs)
+    readiness.sleep = MagicMock()
+    return readiness
+
+  def test_one_call_per_region_and_poll(self):
+    east = FakeEC2({'ami-1': ['pending', 'available'], 'ami-2': ['available']})
+    west = FakeEC2({'ami-3': ['pending', 'pending', 'available']})
+    readiness = self.readiness({'us-east-1': east, 'us-west-2': west})
+    readiness.add('us-east-1', 'ami-1')
+    readiness.add('us-east-1', 'ami-2')
+    readiness.add('us-west-2', 'ami-3')
+    readiness.run()
+    self.assertEqual(east.calls, [['ami-1', 'ami-2'], ['ami-1']])
+    self.assertEqual(west.calls, [['ami-3']] * 3)
+    self.assertEqual(readiness.wait('us-west-2', 'ami-3'), 'ami-3')
+    self.assertEqual(readiness.sleep.call_count, 2)
+
+  def test_failed_ami_raises_for_its_region_only(self):
+    readiness = self.readiness({'us-east-1': FakeEC2({'ami-1': ['failed']}), 'us-west-2': FakeEC2({'ami-2': ['available']})},
+                               amis={'us-east-1': 'ami-1', 'us-west-2': 'ami-2'})
+    readiness.run()
+    self.assertEqual(readiness.wait('us-west-2', 'ami-2'), 'ami-2')
+    self.assertRaises(Exception, lambda: readiness.wait('us-east-1', 'ami-1'))
+
+  def test_timeout_fails_pending_amis(self):
+    readiness = self.readiness({'us-east-1': FakeEC2({})}, amis={'us-east-1': 'ami-1'}, timeout=0)
+    readiness.run()
+    self.assertTrue('not ready in us-east-1' in str(readiness.errors[('us-east-1', 'ami-1')]))
+
+  def test_copies_once_the_source_is_available(self):
+    east = FakeEC2({'ami-1': ['pending', 'available']})
+    west = FakeEC2({'ami-copy': ['pending', 'available']})
+    readiness = self.readiness({'us-east-1': east, 'us-west-2': west})
+    keys = readiness.copy('us-east-1', 'ami-1', ['us-east-1', 'us-west-2'])
+    self.assertEqual(keys, [('us-east-1', 'ami-1'), ('us-west-2', 'ami-1')])
+    readiness.run()
+    west.copy_image.assert_called_once_with(SourceRegion='us-east-1', SourceImageId='ami-1', Name='app-42',
+                                            ClientToken='license2deploy-ami-1-us-west-2')
+    self.assertEqual(west.calls, [['ami-copy']] * 2)
+    self.assertEqual(readiness.wait('us-west-2', 'ami-1'), 'ami-copy')
+
+  def test_regions_finish_independently(self):
+    west = FakeEC2({'ami-2': ['pending']})
+    readiness = self.readiness({'us-east-1': FakeEC2({'ami-1': ['available']}), 'us-west-2': west},
+                               amis={'us-east-1': 'ami-1', 'us-west-2': 'ami-2'})
+    release = threading.Event()
+    readiness.sleep = lambda seconds: release.wait(5)
+    readiness.start()
+    try:
+      self.assertEqual(readiness.wait_any([('us-east-1', 'ami-1'), ('us-west-2', 'ami-2')], 5), [('us-east-1', 'ami-1')])
+    finally:
+      west.states['ami-2'] = ['available']
+      release.set()
+    self.assertEqual(readiness.wait('us-west-2', 'ami-2'), 'ami-2')
+
+  def test_describe_errors_fail_their_region_only(self):
+    east = FakeEC2({})
+    east.describe_images = MagicMock(side_effect=Exception('UnauthorizedOperation'))
+    west = FakeEC2({'ami-2': ['pending', 'pending', 'pending', 'available']})
+    readiness = self.readiness({'us-east-1': east, 'us-west-2': west}, amis={'us-east-1': 'ami-1', 'us-west-2': 'ami-2'})
+    readiness.run()
+    self.assertEqual(east.describe_images.call_count, AMIReadiness.MAX_ERRORS)
+    self.assertTrue('after 3 attempts' in str(readiness.errors[('us-east-1', 'ami-1')]))
+    self.assertEqual(readiness.wait('us-west-2', 'ami-2'), 'ami-2')
+
+  def test_describe_errors_must_be_consecutive(self):
+    east = FakeEC2({})
+    pending = {'Images': [{'ImageId': 'ami-1', 'State': 'pending'}]}
+    available = {'Images': [{'ImageId': 'ami-1', 'Name': 'app-42', 'State': 'available'}]}
+    east.describe_images = MagicMock(side_effect=[Exception('throttled'), Exception('throttled'), pending,
+                                                  Exception('throttled'), Exception('throttled'), available])
+    readiness = self.readiness({'us-east-1': east}, amis={'us-east-1': 'ami-1'})
+    readiness.run()
+    self.assertEqual(readiness.wait('us-east-1', 'ami-1'), 'ami-1')
+
+  def test_cancelled_token_fails_pending_amis(self):
+    token = CancellationToken()
+    readiness = self.readiness({'us-east-1': FakeEC2({})}, amis={'us-east-1': 'ami-1'}, token=token)
+    readiness.sleep = lambda seconds: token.cancel('signal 15')
+    readiness.run()
+    self.assertRaises(DeployCancelled, lambda: readiness.wait('us-east-1', 'ami-1'))
@@ -0,0 +1,35 @@
+import threading
+import unittest
+from mock import MagicMock
+
+from License2Deploy.batching import Batcher
+
+
+class BatcherTest(unittest.TestCase):
+
+  def setUp(self):
+    self.batcher = Batcher(chunk_size=2, max_workers=3)
+
+  def test_chunks(self):
+    self.assertEqual(self.batcher.chunks(['i-1', 'i-2', 'i-3']), [['i-1', 'i-2'], ['i-3']])
+    self.assertEqual(self.batcher.chunks([]), [])
+
+  def test_collect_keeps_chunk_order(self):
+    threads = set()
+    def describe(chunk):
+      threads.add(threading.current_thread().name)
+      return [i.upper() for i in chunk]
+    self.assertEqual(self.batcher.collect(describe, ['a', 'b', 'c', 'd', 'e']), ['A', 'B', 'C', 'D', 'E'])
+    self.assertTrue(threading.current_thread().name not in threads)
+
+  def test_single_chunk_runs_inline(self):
+    describe = MagicMock(return_value=['i-1'])
+    self.assertEqual(self.batcher.collect(describe, ['i-1']), ['i-1'])
+    describe.assert_called_once_with(['i-1'])
+    self.assertEqual(self.batcher.collect(describe, []), [])
+    self.assertEqual(describe.call_count, 1)
+
+  def test_boto3_pages(self):
+    call = MagicMock(side_effect=[{'Items': ['a'], 'NextMarker': 'm'}, {'Items': ['b']}])
+    self.assertEqual(Batcher.boto3_pages(call, 'Items', 'NextMarker', 'Marker', Names=['x']), ['a', 'b'])
+    call.assert_called_with(Names=['x'], Marker='m')
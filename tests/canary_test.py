@@ -0,0 +1,94 @@
+import unittest
+from datetime import datetime
+from mock import MagicMock
+
+from License2Deploy.canary import CanaryAnalysis, CanaryMetric
+from tests.simulation import SimulatedDeployTest
+
+
+class CanaryMetricTest(unittest.TestCase):
+
+  def test_parse(self):
+    metric = CanaryMetric.parse('App/Server:Latency')
+    self.assertEqual((metric.namespace, metric.name, metric.statistic), ('App/Server', 'Latency', 'Average'))
+    self.assertEqual(str(CanaryMetric.parse('App/Server:5xx:Sum')), 'App/Server:5xx:Sum')
+    self.assertRaises(ValueError, lambda: CanaryMetric.parse('Latency'))
+    self.assertRaises(ValueError, lambda: CanaryMetric.parse('App::Sum'))
+
+
+class CanaryAnalysisTest(unittest.TestCase):
+
+  def setUp(self):
+    self.values = {'i-canary': [3.0, 5.0]}
+    self.cloudwatch = MagicMock()
+    self.cloudwatch.get_metric_data.side_effect = lambda MetricDataQueries, StartTime, EndTime: {'MetricDataResults': [
+      {'Id': query['Id'], 'Values': self.values.get(query['MetricStat']['Metric']['Dimensions'][0]['Value'], [2.0])}
+      for query in MetricDataQueries]}
+    self.analysis = CanaryAnalysis(self.cloudwatch, ['App:Latency', 'App:5xx:Sum'], max_ratio=1.5)
+    self.start, self.end = datetime(2020, 1, 1), datetime(2020, 1, 1, 0, 10)
+
+  def test_canary_above_baseline_fails(self):
+    failures = self.analysis.compare(['i-canary'], ['i-1', 'i-2'], self.start, self.end)
+    self.assertEqual(len(failures), 2)
+    self.assertTrue(failures[0].startswith('App:Latency:Average is 4.00 on the canary against 2.00'))
+
+  def test_canary_within_ratio_passes(self):
+    self.values['i-canary'] = [2.5]
+    self.assertEqual(self.analysis.compare(['i-canary'], ['i-1'], self.start, self.end), [])
+
+  def test_metrics_without_datapoints_fail(self):
+    self.values['i-canary'] = []
+    failures = self.analysis.compare(['i-canary'], ['i-1'], self.start, self.end)
+    self.assertEqual(failures, ['App:Latency:Average has no datapoints on the canary',
+                                'App:5xx:Sum has no datapoints on the canary'])
+
+  def test_metrics_without_datapoints_are_skipped_when_allowed(self):
+    self.values['i-canary'] = []
+    self.analysis.allow_missing_data = True
+    self.assertEqual(self.analysis.compare(['i-canary'], ['i-1'], self.start, self.end), [])
+
+  def test_values_are_concatenated_across_pages(self):
+    pages = [{'MetricDataResults': [{'Id': 'm0', 'Values': [1.0]}, {'Id': 'm1', 'Values': [2.0]}], 'NextToken': 't'},
+             {'MetricDataResults': [{'Id': 'm0', 'Values': [3.0, 5.0]}]}]
+    self.cloudwatch.get_metric_data.side_effect = lambda **kwargs: pages.pop(0)
+    analysis = CanaryAnalysis(self.cloudwatch, ['App:Latency'])
+    values = analysis.metric_values(['i-canary', 'i-1'], self.start, self.end)
+    self.assertEqual(values, {'App:Latency:Average': {'i-canary': [1.0, 3.0, 5.0], 'i-1': [2.0]}})
+    self.assertEqual(self.cloudwatch.get_metric_data.call_args[1]['NextToken'], 't')
+
+  def test_queries_are_batched_and_baseline_sampled(self):
+    self.analysis.batcher.chunk_size = 4
+    self.analysis.compare(['i-canary'], ['i-{0}'.format(i) for i in range(20)], self.start, self.end)
+    queries = [query for call in self.cloudwatch.get_metric_data.call_args_list for query in call[1]['MetricDataQueries']]
+    self.assertEqual(len(queries), 2 * (1 + CanaryAnalysis.BASELINE_SIZE))
+    self.assertEqual(self.cloudwatch.get_metric_data.call_count, 6)
+    self.assertEqual(len(set(query['Id'] for query in queries)), len(queries))
+
+
+class CanaryDeployTest(SimulatedDeployTest):
+
+  def setUp(self):
+    super(CanaryDeployTest, self).setUp()
+    self.aws = self.simulated_aws(4)
+    self.deploy = self.build_deploy(self.aws, canary_size=1, canary_window=0)
+
+  def builds(self):
+    return sorted(self.aws.instances[i]['build'] for i in self.aws.group_instances)
+
+  def test_good_canary_is_promoted(self):
+    self.deploy.deploy()
+    self.assertEqual(self.builds(), ['2'] * 4)
+    self.assertEqual(len(self.deploy.canary_instance_ids), 1)
+    self.assertTrue(self.deploy.canary_instance_ids[0] in self.aws.group_instances)
+
+  def test_bad_canary_aborts_the_deploy(self):
+    self.aws.metric_values['2'] = 5.0
+    self.assertRaises(Exception, self.deploy.deploy)
+    self.assertEqual(self.builds(), ['1'] * 4)
+    self.assertEqual(self.aws.desired_capacity, 4)
+    self.assertEqual(self.deploy.checkpoint.load(), None)
+
+  def test_canary_in_batch_mode(self):
+    self.deploy.batch_size = 2
+    self.deploy.deploy()
+    self.assertEqual(self.builds(), ['2'] * 4)
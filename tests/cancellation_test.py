@@ -0,0 +1,85 @@
+import threading
+import unittest
+from time import time
+
+from License2Deploy.cancellation import CancellationToken, DeployCancelled
+from License2Deploy.lifecycle import LifecycleEvents, LocalLifecycleQueue
+from License2Deploy.poller import Poller
+from tests.simulation import SimulatedDeployTest
+
+
+class CancellationTokenTest(unittest.TestCase):
+
+  def test_cancel_wakes_up_sleep(self):
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel, ['signal 15']).start()
+    started = time()
+    self.assertRaises(DeployCancelled, lambda: token.sleep(30))
+    self.assertTrue(time() - started < 5)
+    self.assertEqual(token.reason, 'signal 15')
+
+  def test_cancelled_is_not_an_exception(self):
+    self.assertFalse(issubclass(DeployCancelled, Exception))
+
+  def test_poller_stops_polling_once_cancelled(self):
+    token = CancellationToken()
+    token.cancel()
+    poller = Poller(100, token=token)
+    self.assertRaises(DeployCancelled, lambda: poller.wait(lambda: True))
+
+  def test_lifecycle_wait_stops_once_cancelled(self):
+    token = CancellationToken()
+    lifecycle = LifecycleEvents(None, 'server-qa-asg', LocalLifecycleQueue())
+    lifecycle.CANCEL_CHECK = 0.05
+    threading.Timer(0.05, token.cancel).start()
+    started = time()
+    self.assertRaises(DeployCancelled, lambda: lifecycle.wait(30, token))
+    self.assertTrue(time() - started < 5)
+
+
+class DeployAbortTest(SimulatedDeployTest):
+
+  def start_deploy(self, aws):
+    """ Deploy in a thread until the group is scaled up, new instances never passing their status checks """
+    deploy = self.build_deploy(aws)
+    errors = []
+    def run():
+      try:
+        deploy.deploy()
+      except BaseException as e:
+        errors.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return deploy, thread, errors
+
+  def wait_for(self, condition):
+    deadline = time() + 10
+    while not condition() and time() < deadline:
+      threading.Event().wait(0.01)
+    self.assertTrue(condition())
+
+  def test_cancelled_deploy_rolls_back(self):
+    aws = self.simulated_aws(4, alarm_count=2, boot_delay=3600)
+    deploy, thread, errors = self.start_deploy(aws)
+    self.wait_for(lambda: aws.desired_capacity == 8 and len(aws.group_instances) == 8)
+    originals = list(aws.group_instances[:4])
+    self.assertEqual(len(aws.disabled_alarms), 2)
+    started = time()
+    deploy.cancel('signal 15')
+    thread.join(10)
+    self.assertTrue(time() - started < 5)
+    self.assertTrue(isinstance(errors[0], DeployCancelled))
+    self.assertEqual(deploy.metrics.status, 'cancelled')
+    self.assertTrue(deploy.abort(10))
+    self.assertEqual((aws.desired_capacity, aws.group_instances), (4, originals))
+    self.assertEqual(aws.disabled_alarms, set())
+    self.assertEqual(deploy.checkpoint.load(), None)
+
+  def test_abort_keeps_instances_once_old_ones_are_gone(self):
+    aws = self.simulated_aws(2)
+    deploy = self.build_deploy(aws)
+    deploy.original_instance_ids = list(aws.group_instances)
+    deploy.checkpoint_state = 'old_terminated'
+    self.assertTrue(deploy.abort(10))
+    self.assertEqual(aws.calls.get('autoscaling.TerminateInstanceInAutoScalingGroup'), None)
+    self.assertEqual(aws.calls.get('autoscaling.SetDesiredCapacity'), None)
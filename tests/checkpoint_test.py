@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from License2Deploy.checkpoint import DeployCheckpoint
+from License2Deploy.simulated_aws import simulated_deploy
+from tests.simulation import SimulatedDeployTest
+
+
+class DeployCheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.checkpoint = DeployCheckpoint(os.path.join(self.directory, 'nested', 'deploy.json'))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_save_load_clear(self):
+    self.assertEqual(self.checkpoint.load(), None)
+    self.checkpoint.save('scaled_up', {'asg_name': 'group'})
+    checkpoint = self.checkpoint.load()
+    self.assertEqual((checkpoint['state'], checkpoint['asg_name']), ('scaled_up', 'group'))
+    self.checkpoint.clear()
+    self.assertEqual(self.checkpoint.load(), None)
+
+  def test_default_path(self):
+    self.assertEqual(DeployCheckpoint.default_path(self.directory, 'server', 'qa', 'us-east-1', '', 'a/b'),
+                     os.path.join(self.directory, 'server-qa-us-east-1-a_b.json'))
+
+  def test_no_path_saves_nothing(self):
+    checkpoint = DeployCheckpoint(None)
+    checkpoint.save('scaled_up', {'asg_name': 'group'})
+    checkpoint.clear()
+    self.assertEqual(checkpoint.load(), None)
+
+
+class ResumeTest(SimulatedDeployTest):
+
+  def setUp(self):
+    super(ResumeTest, self).setUp()
+    self.aws = self.simulated_aws(3, alarm_count=2)
+    self.path = os.path.join(self.directory, 'checkpoint.json')
+
+  def build_deploy(self, resume=False):
+    return super(ResumeTest, self).build_deploy(self.aws, resume=resume)
+
+  def test_resume_skips_completed_steps(self):
+    deploy = self.build_deploy()
+    with patch.object(deploy, 'confirm_lb_has_only_new_instances', side_effect=Exception('interrupted')):
+      self.assertRaises(Exception, deploy.deploy)
+    self.assertEqual(DeployCheckpoint(self.path).load()['state'], 'scaled_down')
+    self.assertEqual(len(self.aws.group_instances), 3)
+    calls = dict(self.aws.calls)
+
+    resumed = self.build_deploy(resume=True)
+    resumed.deploy()
+    self.assertEqual(resumed.original_instance_ids, deploy.original_instance_ids)
+    self.assertEqual(self.aws.calls['autoscaling.SetDesiredCapacity'], calls['autoscaling.SetDesiredCapacity'])
+    self.assertEqual(self.aws.calls.get('autoscaling.DescribeAutoScalingGroups'), calls.get('autoscaling.DescribeAutoScalingGroups'))
+    self.assertEqual(self.aws.ami_tags, {'deployed': 'qa'})
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_resume_needs_matching_checkpoint(self):
+    self.assertRaises(Exception, self.build_deploy(resume=True).deploy)
+    DeployCheckpoint(self.path).save('discovered', {'project': 'server', 'env': 'qa', 'build_number': '1',
+                                                    'ami_id': self.aws.ami_id, 'batch_size': None})
+    self.assertRaises(Exception, self.build_deploy(resume=True).deploy)
+
+  def test_checkpoint_only_when_asked(self):
+    self.assertEqual(simulated_deploy(self.aws).checkpoint.path, None)
+    deploy = simulated_deploy(self.aws, checkpoint_dir=self.directory)
+    self.assertEqual(os.path.dirname(deploy.checkpoint.path), self.directory)
@@ -17,7 +17,7 @@ class CloudformationClientTest(unittest.TestCase):
 
     def test_get_autoscaling_group_name_via_cloudformation(self):
         self.assertEqual(self.rolling_deploy.autoscaling_group, False)
-        asg_name = self.rolling_deploy.get_autoscale_group_name()
+        asg_name = self.rolling_deploy.get_autoscaling_group_name_from_cloudformation()
         self.assertTrue(self.rolling_deploy.autoscaling_group)
         self.assertEqual(asg_name, 'dnbi-backend-qa-dnbigmsextenderASGqa-1NP5ZBSVZRD0N')
 
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+from mock import MagicMock
+from time import sleep, time
+
+from License2Deploy.AWSConn import AWSClients, ClientPool
+from License2Deploy.daemon import DaemonHTTPServer, DaemonUnixServer, DeployConflict, DeployDaemon
+
+try:
+  from urllib2 import Request, urlopen, HTTPError
+except ImportError:
+  from urllib.request import Request, urlopen
+  from urllib.error import HTTPError
+
+
+class FakeDeploy(object):
+
+  release = threading.Event()
+  instances = []
+
+  def __init__(self, env=None, project=None, region=None, profile_name=None, asg_name=None, stack_name=None,
+               fail=False, client_pool=None):
+    self.env = env
+    self.project = project
+    self.region = region or 'us-west-1'
+    self.profile_name = profile_name
+    self.asg_name = asg_name
+    self.fail = fail
+    self.client_pool = client_pool
+    self.alarms_enabled = False
+    FakeDeploy.instances.append(self)
+
+  def get_asg_info(self):
+    self.asg_name = '{0}-{1}-asg'.format(self.project, self.env)
+
+  def deploy(self):
+    FakeDeploy.release.wait(5)
+    if self.fail:
+      raise Exception('deploy failed')
+
+  def enable_project_cloudwatch_alarms(self):
+    self.alarms_enabled = True
+
+
+class DeployDaemonTest(unittest.TestCase):
+
+  def setUp(self):
+    FakeDeploy.instances = []
+    FakeDeploy.release.set()
+    self.daemon = DeployDaemon(workers=2, deploy_class=FakeDeploy)
+
+  def test_jobs_run_and_reuse_metadata(self):
+    first = self.daemon.submit({'env': 'qa', 'project': 'server'})
+    self.daemon.close()
+    self.assertEqual(self.daemon.job(first['id'])['status'], 'succeeded')
+    self.assertEqual(self.daemon.asg_names, {'qa/default/server': 'server-qa-asg'})
+    self.assertTrue(FakeDeploy.instances[0].client_pool is self.daemon.client_pool)
+
+    daemon = DeployDaemon(workers=1, deploy_class=FakeDeploy)
+    daemon.asg_names = {'qa/default/server': 'cached-asg'}
+    daemon.submit({'env': 'qa', 'project': 'server'})
+    daemon.close()
+    self.assertEqual(FakeDeploy.instances[1].asg_name, 'cached-asg')
+
+  def test_one_job_per_target(self):
+    FakeDeploy.release.clear()
+    self.daemon.submit({'env': 'qa', 'project': 'server', 'asg_name': 'server-qa-asg'})
+    self.assertRaises(DeployConflict, lambda: self.daemon.submit({'env': 'qa', 'project': 'server', 'asg_name': 'server-qa-asg'}))
+    self.daemon.submit({'env': 'qa', 'project': 'server', 'asg_name': 'server-qa-asg', 'region': 'us-east-1'})
+    self.daemon.submit({'env': 'qa', 'project': 'server', 'asg_name': 'server-qa-asg', 'profile_name': 'other'})
+    FakeDeploy.release.set()
+    self.daemon.close()
+    self.assertEqual([job['status'] for job in self.daemon.list_jobs()], ['succeeded'] * 3)
+    self.assertEqual((self.daemon.active_targets, self.daemon.job_targets), ({}, {}))
+
+  def test_group_found_by_discovery_is_taken_once(self):
+    FakeDeploy.release.clear()
+    first = self.daemon.submit({'env': 'qa', 'project': 'server', 'asg_name': 'server-qa-asg'})
+    second = self.daemon.submit({'env': 'qa', 'project': 'server', 'stack_name': 'server-qa'})
+    self.assertNotEqual(first['target'], second['target'])
+    deadline = time() + 5
+    while self.daemon.job(second['id'])['status'] != 'failed' and time() < deadline:
+      sleep(0.01)
+    FakeDeploy.release.set()
+    self.daemon.close()
+    self.assertEqual(self.daemon.job(first['id'])['status'], 'succeeded')
+    self.assertTrue('already deploying' in self.daemon.job(second['id'])['error'])
+    self.assertFalse(FakeDeploy.instances[1].alarms_enabled)
+
+  def test_failed_job_re_enables_alarms(self):
+    job = self.daemon.submit({'env': 'qa', 'project': 'server', 'fail': True})
+    self.daemon.close()
+    self.assertEqual(self.daemon.job(job['id'])['error'], 'deploy failed')
+    self.assertTrue(FakeDeploy.instances[0].alarms_enabled)
+    self.assertEqual(self.daemon.asg_names, {})
+
+  def test_invalid_job(self):
+    self.assertRaises(ValueError, lambda: self.daemon.submit({'env': 'qa'}))
+
+
+class DeployApiTest(unittest.TestCase):
+
+  def setUp(self):
+    FakeDeploy.release.set()
+    self.daemon = DeployDaemon(workers=1, deploy_class=FakeDeploy)
+    self.server = DaemonHTTPServer(('127.0.0.1', 0), self.daemon)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+    self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+    self.daemon.close()
+
+  def request(self, path, payload=None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    try:
+      response = urlopen(Request(self.url + path, data=data, headers={'Content-Type': 'application/json'}))
+      return response.getcode(), json.loads(response.read().decode('utf-8'))
+    except HTTPError as e:
+      return e.code, json.loads(e.read().decode('utf-8'))
+
+  def test_submit_and_poll(self):
+    status, job = self.request('/deploys', {'env': 'qa', 'project': 'server'})
+    self.assertEqual((status, job['status']), (202, 'queued'))
+    self.assertEqual(self.request('/deploys/{0}'.format(job['id']))[0], 200)
+    self.assertEqual(self.request('/deploys')[1]['jobs'][0]['id'], job['id'])
+    self.assertEqual(self.request('/deploys/nope')[0], 404)
+    self.assertEqual(self.request('/deploys', {'env': 'qa'})[0], 400)
+    self.assertEqual(self.request('/health')[1]['status'], 'ok')
+
+
+class DaemonUnixServerTest(unittest.TestCase):
+
+  def test_socket_is_private(self):
+    directory = tempfile.mkdtemp()
+    server = DaemonUnixServer(os.path.join(directory, 'daemon.sock'), DeployDaemon(workers=1, deploy_class=FakeDeploy))
+    try:
+      self.assertEqual(stat.S_IMODE(os.stat(server.server_address).st_mode), 0o600)
+    finally:
+      server.server_close()
+      shutil.rmtree(directory)
+
+
+class ClientPoolTest(unittest.TestCase):
+
+  def test_boto3_clients_are_shared_between_deploys(self):
+    pool = ClientPool()
+    shared = MagicMock()
+    pool.clients('us-east-1').set('asg', shared)
+    first = AWSClients('us-east-1', pool=pool)
+    second = AWSClients('us-east-1', pool=pool)
+    self.assertTrue(first.get('asg') is shared)
+    self.assertTrue(second.get('asg') is shared)
+    self.assertTrue(pool.clients('us-east-1') is pool.clients('us-east-1'))
+    self.assertFalse(pool.clients('us-east-1') is pool.clients('us-west-1'))
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from License2Deploy.history import DeployHistory
+from tests.simulation import SimulatedDeployTest
+
+
+class DeployHistoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.history = DeployHistory(os.path.join(self.directory, 'nested', 'history.sqlite'))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def record(self, seconds, instance_type='m5.large', status='succeeded', env='qa'):
+    return self.history.record('server', env, instance_type, status, {'health': [seconds]},
+                               [{'name': 'scale_up', 'duration': 1.5}, {'name': 'discover', 'duration': None}])
+
+  def test_record_and_durations(self):
+    self.assertEqual(self.record(100), 2)
+    self.record(200, status='failed')
+    self.record(300, env='prd')
+    self.assertEqual(self.history.durations('server', 'qa', 'health'), [100])
+    self.assertEqual(self.history.durations('server', 'qa', 'scale_up', kind='phase'), [1.5])
+    self.assertEqual(self.history.durations('server', 'qa', 'health', status='failed'), [200])
+
+  def test_percentile(self):
+    self.assertEqual(DeployHistory.percentile([], 95), None)
+    self.assertEqual(DeployHistory.percentile(list(range(1, 101)), 95), 95)
+    self.assertEqual(DeployHistory.percentile([3, 1, 2], 50), 2)
+
+  def test_suggest_wait(self):
+    for seconds in [100, 100, 100, 100]:
+      self.record(seconds)
+    self.assertEqual(self.history.suggest_wait('server', 'qa', 'health', 'm5.large'), None)
+    self.record(200, instance_type='c5.large')
+    # p95 200 * 1.25 = 250 seconds, polling every 100 / 4 = 25 seconds
+    self.assertEqual(self.history.suggest_wait('server', 'qa', 'health', 'm5.large'), [10, 25])
+    for seconds in [1, 1, 1, 1, 1]:
+      self.record(seconds, instance_type='t3.micro')
+    self.assertEqual(self.history.suggest_wait('server', 'qa', 'health', 't3.micro'), [6, 5])
+
+  def test_trend(self):
+    self.record(100)
+    self.record(300)
+    rows = self.history.trend(project='server', kind='wait')
+    self.assertEqual(len(rows), 1)
+    self.assertEqual((rows[0]['name'], rows[0]['count'], rows[0]['p50'], rows[0]['max']), ('health', 2, 100, 300))
+    self.assertEqual(len(DeployHistory.format_trend(rows).splitlines()), 2)
+    self.assertEqual(self.history.trend(env='prd'), [])
+
+
+class AutoWaitTest(SimulatedDeployTest):
+
+  def setUp(self):
+    super(AutoWaitTest, self).setUp()
+    self.history = DeployHistory(os.path.join(self.directory, 'history.sqlite'))
+
+  def build_deploy(self, auto_wait=False):
+    return super(AutoWaitTest, self).build_deploy(self.simulated_aws(2), history_file=self.history.path,
+                                                  auto_wait=auto_wait)
+
+  def test_deploys_are_recorded_and_tune_waits(self):
+    for i in range(DeployHistory.MIN_SAMPLES):
+      self.build_deploy().deploy()
+    self.assertEqual(len(self.history.durations('server', 'qa', 'health')), DeployHistory.MIN_SAMPLES)
+    self.assertEqual(self.history.durations('server', 'qa', 'health', instance_type='m5.large'),
+                     self.history.durations('server', 'qa', 'health'))
+    deploy = self.build_deploy(auto_wait=True)
+    deploy.deploy()
+    self.assertEqual(deploy.health_wait, [int(DeployHistory.MIN_DEADLINE / DeployHistory.MIN_DELAY), DeployHistory.MIN_DELAY])
+    self.assertEqual(deploy.creation_wait, deploy.health_wait)
+    self.assertEqual(deploy.pipeline_wait, None)
+
+  def test_history_errors_do_not_fail_the_deploy(self):
+    deploy = self.build_deploy(auto_wait=True)
+    with patch.object(deploy.history, 'connect', side_effect=Exception('locked')):
+      deploy.deploy()
+    self.assertEqual(deploy.metrics.status, 'succeeded')
+
+  def test_plain_deploy_keeps_no_history(self):
+    path = os.path.join(self.directory, 'default.sqlite')
+    with patch.object(DeployHistory, 'DEFAULT_PATH', path):
+      deploy = super(AutoWaitTest, self).build_deploy(self.simulated_aws(2))
+      deploy.deploy()
+    self.assertEqual(deploy.history, None)
+    self.assertFalse(os.path.exists(path))
@@ -0,0 +1,50 @@
+import unittest
+from mock import MagicMock
+
+from License2Deploy.instance_pipeline import InstancePipeline
+from License2Deploy.poller import Poller
+
+
+class InstancePipelineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.deploy = MagicMock()
+    self.pipeline = InstancePipeline(self.deploy, 'group', 2, Poller(5, initial_delay=0))
+
+  def test_instances_move_through_stages_independently(self):
+    self.deploy.find_new_instance_ids.side_effect = [['i-1'], ['i-1', 'i-2'], ['i-1', 'i-2']]
+    self.deploy.get_ready_instance_ids.side_effect = lambda ids: set(ids)
+    self.deploy.get_healthy_instance_ids.side_effect = [set(['i-1']), set(['i-2'])]
+    self.assertEqual(self.pipeline.run(), ['i-1', 'i-2'])
+    self.assertEqual(self.deploy.find_new_instance_ids.call_count, 2)
+    self.deploy.get_ready_instance_ids.assert_any_call(['i-1'])
+    self.deploy.get_healthy_instance_ids.assert_any_call(['i-2'])
+    self.assertEqual(sorted(self.pipeline.stage_durations()['healthy']), ['i-1', 'i-2'])
+
+  def test_failed_check_does_not_advance_instances(self):
+    self.deploy.find_new_instance_ids.return_value = ['i-1', 'i-2']
+    self.deploy.get_ready_instance_ids.side_effect = Exception('throttled')
+    self.pipeline.started = 0
+    self.assertFalse(self.pipeline.tick())
+    self.assertEqual(self.pipeline.instances_at('created'), ['i-1', 'i-2'])
+    self.deploy.get_healthy_instance_ids.assert_not_called()
+
+  def test_run_times_out(self):
+    self.deploy.find_new_instance_ids.return_value = ['i-1']
+    self.deploy.get_ready_instance_ids.return_value = set()
+    self.pipeline.poller.timeout = 0
+    self.assertRaises(Exception, self.pipeline.run)
+    self.assertEqual(self.pipeline.instances_at('created'), ['i-1'])
+
+  def test_lifecycle_events_replace_polling_the_group(self):
+    lifecycle = MagicMock()
+    pipeline = InstancePipeline(self.deploy, 'group', 1, Poller(5, initial_delay=0), lifecycle)
+    self.deploy.launched_instance_ids.return_value = ['i-1']
+    self.deploy.get_ready_instance_ids.side_effect = lambda ids: set(ids)
+    self.deploy.get_healthy_instance_ids.side_effect = [set(), set(['i-1'])]
+    self.assertEqual(pipeline.run(), ['i-1'])
+    self.deploy.find_new_instance_ids.assert_not_called()
+    self.deploy.launched_instance_ids.assert_called_with(lifecycle)
+    lifecycle.complete.assert_called_with(['i-1'])
+    self.assertTrue(lifecycle.wait.called)
+    self.assertEqual(lifecycle.wait.call_args[0][1], None)
@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import boto3
+from mock import MagicMock
+from moto import mock_autoscaling
+
+from License2Deploy.AWSConn import AWSClients
+from License2Deploy.instrumentation import DeployMetrics, InstrumentedConnection
+
+
+class DeployMetricsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.metrics = DeployMetrics({'project': 'server', 'env': 'qa'})
+
+  def test_calls_are_counted_per_operation_and_phase(self):
+    with self.metrics.span('launch') as phase:
+      self.metrics.record_call('ec2', 'DescribeInstances', 0.5)
+      self.metrics.record_call('ec2', 'DescribeInstances', 0.25, 'Throttling')
+      self.metrics.record_call('ec2', 'DescribeInstances', 0.25, 'InvalidInstanceID.NotFound')
+    self.metrics.record_call('asg', 'DescribeAutoScalingGroups', 1)
+    self.assertEqual(phase['api_calls'], 3)
+    self.assertEqual(phase['throttled'], 1)
+    self.assertTrue(phase['duration'] >= 0)
+    self.assertEqual(self.metrics.api_calls['ec2']['DescribeInstances'],
+                     {'calls': 3, 'seconds': 1.0, 'errors': 2, 'throttled': 1})
+    self.assertEqual(self.metrics.report()['total_api_calls'], 4)
+
+  def test_span_closes_on_error(self):
+    def fail():
+      with self.metrics.span('wait_ami_availability'):
+        raise Exception('AMI never became available')
+    self.assertRaises(Exception, fail)
+    self.assertTrue(self.metrics.phases[0]['duration'] is not None)
+    self.assertEqual(self.metrics.current_phase, None)
+    self.assertEqual(self.metrics.report()['status'], 'failed')
+
+  def test_connection_without_events_is_proxied(self):
+    connection = MagicMock(spec=['describe_images', 'region'])
+    connection.describe_images.return_value = {'Images': []}
+    connection.region = 'us-west-1'
+    instrumented = self.metrics.instrument('ec2', connection)
+    self.assertTrue(isinstance(instrumented, InstrumentedConnection))
+    self.assertEqual(instrumented.describe_images(ImageIds=['ami-1']), {'Images': []})
+    self.assertEqual(instrumented.region, 'us-west-1')
+    connection.describe_images.side_effect = Exception('boom')
+    self.assertRaises(Exception, instrumented.describe_images)
+    self.assertEqual(self.metrics.api_calls['ec2']['describe_images']['calls'], 2)
+    self.assertEqual(self.metrics.api_calls['ec2']['describe_images']['errors'], 1)
+
+  @mock_autoscaling
+  def test_boto3_client_events_are_recorded(self):
+    clients = AWSClients('us-east-1', session=boto3.session.Session(region_name='us-east-1'), metrics=self.metrics)
+    clients.get('asg').describe_auto_scaling_groups()
+    self.assertEqual(self.metrics.api_calls['asg']['DescribeAutoScalingGroups']['calls'], 1)
+
+  def test_shared_boto3_client_is_proxied(self):
+    client = MagicMock()
+    client.meta.method_to_api_mapping = {'describe_auto_scaling_groups': 'DescribeAutoScalingGroups'}
+    instrumented = self.metrics.instrument('asg', client, shared=True)
+    instrumented.describe_auto_scaling_groups()
+    client.meta.events.register.assert_not_called()
+    self.assertEqual(self.metrics.api_calls['asg']['DescribeAutoScalingGroups']['calls'], 1)
+
+  def test_prometheus_lines(self):
+    with self.metrics.span('tag_ami'):
+      self.metrics.record_call('ec2', 'CreateTags', 0.5)
+    lines = self.metrics.prometheus_lines()
+    self.assertTrue('# TYPE license2deploy_aws_calls_total counter' in lines)
+    self.assertTrue('license2deploy_aws_calls_total{client="ec2",env="qa",operation="CreateTags",project="server"} 1' in lines)
+    self.assertTrue([line for line in lines if line.startswith('license2deploy_phase_duration_seconds{env="qa",phase="tag_ami"')])
+
+  def test_write_reports(self):
+    directory = tempfile.mkdtemp()
+    try:
+      self.metrics.status = 'succeeded'
+      report_file = os.path.join(directory, 'report.json')
+      self.metrics.write_json(report_file, {'ami_id': 'ami-1'})
+      with open(report_file) as stream:
+        report = json.load(stream)
+      self.assertEqual(report['status'], 'succeeded')
+      self.assertEqual(report['ami_id'], 'ami-1')
+      textfile = os.path.join(directory, 'deploy.prom')
+      self.metrics.write_textfile(textfile)
+      self.assertEqual(sorted(os.listdir(directory)), ['deploy.prom', 'report.json'])
+    finally:
+      shutil.rmtree(directory)
@@ -0,0 +1,43 @@
+import unittest
+from mock import MagicMock
+
+from License2Deploy.inventory import InstanceInventory
+
+
+def Instance(instance_id, build=None, ip=None):
+  instance = {'InstanceId': instance_id, 'Tags': [{'Key': 'BUILD', 'Value': build}] if build else []}
+  if ip:
+    instance['PrivateIpAddress'] = ip
+  return instance
+
+
+def Reservation(*instances):
+  return {'Instances': list(instances)}
+
+
+class InstanceInventoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.describe = MagicMock(side_effect=lambda ids: [Reservation(*[Instance(i, '2', '10.0.0.1') for i in ids])])
+    self.inventory = InstanceInventory(self.describe)
+
+  def test_known_instances_are_not_described_again(self):
+    self.assertEqual(self.inventory.builds(['i-1', 'i-2']), {'i-1': '2', 'i-2': '2'})
+    self.assertEqual(self.inventory.ip_addrs(['i-2', 'i-1']), {'i-1': '10.0.0.1', 'i-2': '10.0.0.1'})
+    self.inventory.builds(['i-1', 'i-3'])
+    self.assertEqual([c[0][0] for c in self.describe.call_args_list], [['i-1', 'i-2'], ['i-3']])
+
+  def test_update_from_other_describes(self):
+    self.inventory.update([Reservation(Instance('i-1', '1', '10.0.0.2'))])
+    self.assertEqual(self.inventory.builds(['i-1']), {'i-1': '1'})
+    self.describe.assert_not_called()
+
+  def test_untagged_instances_are_described_again(self):
+    self.inventory.update([Reservation(Instance('i-1'))])
+    self.assertEqual(self.inventory.builds(['i-1']), {'i-1': '2'})
+    self.describe.assert_called_once_with(['i-1'])
+
+  def test_forget(self):
+    self.inventory.builds(['i-1'])
+    self.inventory.forget(['i-1'])
+    self.assertEqual(self.inventory.records, {})
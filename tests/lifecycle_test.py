@@ -0,0 +1,124 @@
+import json
+import unittest
+from mock import MagicMock
+
+from License2Deploy.lifecycle import LifecycleEvents, LocalLifecycleQueue, SQSLifecycleQueue
+from tests.simulation import SimulatedDeployTest
+
+
+def launch_event(instance_id, group='server-qa-asg', hook=LifecycleEvents.HOOK_NAME,
+                 transition=LifecycleEvents.LAUNCHING):
+  return {'LifecycleTransition': transition, 'LifecycleHookName': hook, 'AutoScalingGroupName': group,
+          'EC2InstanceId': instance_id, 'LifecycleActionToken': 'token-{0}'.format(instance_id)}
+
+
+class LocalLifecycleQueueTest(unittest.TestCase):
+
+  def test_receive_drains_queue(self):
+    queue = LocalLifecycleQueue()
+    self.assertEqual(queue.receive(0), [])
+    queue.put({'a': 1})
+    queue.put({'b': 2})
+    self.assertEqual(queue.receive(1), [{'a': 1}, {'b': 2}])
+    self.assertEqual(queue.receive(0.01), [])
+
+
+class SQSLifecycleQueueTest(unittest.TestCase):
+
+  def test_receive_deletes_messages(self):
+    sqs = MagicMock()
+    sqs.get_queue_attributes.return_value = {'Attributes': {'QueueArn': 'arn:aws:sqs:us-east-1:1:queue'}}
+    sqs.receive_message.return_value = {'Messages': [{'Body': json.dumps({'a': 1}), 'ReceiptHandle': 'r1'}]}
+    queue = SQSLifecycleQueue(sqs, 'https://queue')
+    self.assertEqual(queue.arn, 'arn:aws:sqs:us-east-1:1:queue')
+    self.assertEqual(queue.receive(5), [{'a': 1}])
+    sqs.receive_message.assert_called_with(QueueUrl='https://queue', MaxNumberOfMessages=10, WaitTimeSeconds=5)
+    sqs.delete_message_batch.assert_called_with(QueueUrl='https://queue', Entries=[{'Id': '0', 'ReceiptHandle': 'r1'}])
+
+  def test_receive_deletes_accepted_messages_only(self):
+    sqs = MagicMock()
+    sqs.receive_message.return_value = {'Messages': [
+      {'Body': json.dumps(launch_event('i-1')), 'ReceiptHandle': 'r1'},
+      {'Body': json.dumps(launch_event('i-2', group='other-asg')), 'ReceiptHandle': 'r2'}]}
+    lifecycle = LifecycleEvents(MagicMock(), 'server-qa-asg', SQSLifecycleQueue(sqs, 'https://queue'))
+    self.assertEqual(lifecycle.launched_instance_ids(), ['i-1'])
+    sqs.delete_message_batch.assert_called_once_with(QueueUrl='https://queue', Entries=[{'Id': '0', 'ReceiptHandle': 'r1'}])
+
+  def test_receive_leaves_other_messages(self):
+    sqs = MagicMock()
+    sqs.receive_message.return_value = {'Messages': [{'Body': json.dumps(launch_event('i-2', hook='other')), 'ReceiptHandle': 'r2'}]}
+    lifecycle = LifecycleEvents(MagicMock(), 'server-qa-asg', SQSLifecycleQueue(sqs, 'https://queue'))
+    self.assertEqual(lifecycle.launched_instance_ids(), [])
+    sqs.delete_message_batch.assert_not_called()
+
+  def test_receive_gives_up_at_deadline(self):
+    sqs = MagicMock()
+    sqs.receive_message.return_value = {}
+    self.assertEqual(SQSLifecycleQueue(sqs, 'https://queue').receive(0), [])
+    sqs.delete_message_batch.assert_not_called()
+
+
+class LifecycleEventsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.asg = MagicMock()
+    self.queue = LocalLifecycleQueue()
+    self.lifecycle = LifecycleEvents(self.asg, 'server-qa-asg', self.queue)
+
+  def test_register_and_remove(self):
+    self.queue.arn = 'arn:aws:sqs:us-east-1:1:queue'
+    LifecycleEvents(self.asg, 'server-qa-asg', self.queue, 'arn:aws:iam::1:role/hooks').register()
+    self.asg.put_lifecycle_hook.assert_called_with(
+      LifecycleHookName=LifecycleEvents.HOOK_NAME, AutoScalingGroupName='server-qa-asg',
+      LifecycleTransition=LifecycleEvents.LAUNCHING, HeartbeatTimeout=900, DefaultResult='ABANDON',
+      NotificationTargetARN='arn:aws:sqs:us-east-1:1:queue', RoleARN='arn:aws:iam::1:role/hooks')
+    self.asg.delete_lifecycle_hook.side_effect = Exception('gone')
+    self.lifecycle.remove()
+    self.asg.delete_lifecycle_hook.assert_called_with(LifecycleHookName=LifecycleEvents.HOOK_NAME,
+                                                      AutoScalingGroupName='server-qa-asg')
+
+  def test_only_launch_events_of_the_group_and_hook_count(self):
+    for event in [launch_event('i-1'), launch_event('i-2', group='other-asg'), launch_event('i-3', hook='other'),
+                  launch_event('i-4', transition='autoscaling:EC2_INSTANCE_TERMINATING'), {'Event': 'autoscaling:TEST_NOTIFICATION'}]:
+      self.queue.put(event)
+    self.assertEqual(self.lifecycle.launched_instance_ids(), ['i-1'])
+    self.assertEqual(self.lifecycle.pending, {'i-1': 'token-i-1'})
+
+  def test_complete_retries_failures(self):
+    self.queue.put(launch_event('i-1'))
+    self.lifecycle.wait(0)
+    self.asg.complete_lifecycle_action.side_effect = [Exception('throttled'), None]
+    self.lifecycle.complete(['i-1', 'i-2'])
+    self.assertEqual(self.lifecycle.pending, {'i-1': 'token-i-1'})
+    self.lifecycle.complete(['i-1'])
+    self.assertEqual(self.lifecycle.pending, {})
+    self.asg.complete_lifecycle_action.assert_called_with(
+      LifecycleHookName=LifecycleEvents.HOOK_NAME, AutoScalingGroupName='server-qa-asg',
+      LifecycleActionToken='token-i-1', LifecycleActionResult='CONTINUE', InstanceId='i-1')
+    self.assertEqual(self.lifecycle.launched_instance_ids(), ['i-1'])
+
+  def test_release(self):
+    self.lifecycle.release(['i-1'])
+    self.asg.complete_lifecycle_action.assert_called_once_with(
+      LifecycleHookName=LifecycleEvents.HOOK_NAME, AutoScalingGroupName='server-qa-asg',
+      LifecycleActionResult='CONTINUE', InstanceId='i-1')
+
+
+class LifecycleDeployTest(SimulatedDeployTest):
+
+  def test_deploy_with_lifecycle_hook(self):
+    aws = self.simulated_aws(4)
+    self.build_deploy(aws, lifecycle=True).deploy()
+    self.assertEqual(aws.calls['autoscaling.PutLifecycleHook'], 1)
+    self.assertEqual(aws.calls['autoscaling.DeleteLifecycleHook'], 1)
+    self.assertEqual(aws.calls['autoscaling.CompleteLifecycleAction'], 4)
+
+  def test_batch_deploy_with_lifecycle_hook(self):
+    aws = self.simulated_aws(4)
+    self.build_deploy(aws, mode='batch', batch_size=2, lifecycle=True).deploy()
+    self.assertEqual(aws.calls['autoscaling.CompleteLifecycleAction'], 4)
+
+  def test_queue_needs_a_role(self):
+    aws = self.simulated_aws(2)
+    self.assertRaises(Exception, lambda: self.build_deploy(aws, lifecycle_queue_url='https://queue'))
+    self.build_deploy(aws, lifecycle_queue_url='https://queue', lifecycle_role_arn='arn:aws:iam::1:role/hooks')
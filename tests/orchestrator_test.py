@@ -0,0 +1,118 @@
+import os
+import tempfile
+import threading
+import unittest
+from mock import MagicMock, patch
+
+from License2Deploy.cancellation import DeployCancelled
+from License2Deploy.orchestrator import DeployOrchestrator
+
+
+class FakeDeploy(object):
+
+  deployed = []
+  lock = threading.Lock()
+
+  def __init__(self, env=None, project=None, region=None, ami_id=None, fail=False):
+    self.env = env
+    self.region = region
+    self.fail = fail
+    self.alarms_enabled = False
+
+  def deploy(self):
+    with self.lock:
+      self.deployed.append((self.env, self.region))
+    if self.fail:
+      raise Exception('deploy failed')
+
+  def enable_project_cloudwatch_alarms(self):
+    self.alarms_enabled = True
+
+
+class DeployOrchestratorTest(unittest.TestCase):
+
+  def setUp(self):
+    FakeDeploy.deployed = []
+
+  def orchestrator(self, targets, stop_on_failure=True):
+    return DeployOrchestrator(targets, parallelism=2, stop_on_failure=stop_on_failure, deploy_class=FakeDeploy)
+
+  def test_run_all_targets(self):
+    report = self.orchestrator([{'env': 'prd', 'region': 'us-east-1', 'project': 'p'},
+                                {'env': 'prd', 'region': 'us-west-1', 'project': 'p'}]).run()
+    self.assertTrue(report['success'])
+    self.assertEqual(report['counts'], {'succeeded': 2, 'failed': 0, 'cancelled': 0, 'skipped': 0})
+    self.assertEqual(sorted(FakeDeploy.deployed), [('prd', 'us-east-1'), ('prd', 'us-west-1')])
+
+  def test_waves_run_in_order(self):
+    self.orchestrator([{'env': 'prd', 'wave': 2}, {'env': 'stg', 'wave': 1}, {'env': 'qa'}]).run()
+    self.assertEqual(FakeDeploy.deployed, [('qa', None), ('stg', None), ('prd', None)])
+
+  def test_stop_on_first_failure(self):
+    report = self.orchestrator([{'env': 'stg', 'fail': True}, {'env': 'prd', 'wave': 1}]).run()
+    self.assertFalse(report['success'])
+    self.assertEqual([r['status'] for r in report['targets']], ['failed', 'skipped'])
+    self.assertEqual(report['targets'][0]['error'], 'deploy failed')
+    self.assertEqual(FakeDeploy.deployed, [('stg', None)])
+
+  def test_keep_going_after_failure(self):
+    report = self.orchestrator([{'env': 'stg', 'fail': True}, {'env': 'prd', 'wave': 1}], stop_on_failure=False).run()
+    self.assertEqual(report['counts'], {'succeeded': 1, 'failed': 1, 'cancelled': 0, 'skipped': 0})
+
+  def test_load_targets(self):
+    handle, path = tempfile.mkstemp(suffix='.yml')
+    with os.fdopen(handle, 'w') as stream:
+      stream.write("defaults:\n  project: p\n  env: prd\ntargets:\n  - region: us-east-1\n  - region: us-west-1\n    env: stg\n")
+    try:
+      targets = DeployOrchestrator.load_targets(path)
+    finally:
+      os.remove(path)
+    self.assertEqual(targets, [{'project': 'p', 'env': 'prd', 'region': 'us-east-1'},
+                               {'project': 'p', 'env': 'stg', 'region': 'us-west-1'}])
+
+  def test_deploys_start_as_their_amis_become_available(self):
+    orchestrator = DeployOrchestrator([{'env': 'prd', 'region': 'us-east-1', 'ami_id': 'ami-1'},
+                                       {'env': 'prd', 'region': 'us-west-2', 'source_ami_id': 'ami-2', 'source_region': 'us-east-1'},
+                                       {'env': 'qa'}], parallelism=1, deploy_class=FakeDeploy)
+    readiness = MagicMock(images={('us-east-1', 'ami-2'): 'ami-2'})
+    finished = [[('us-west-2', 'ami-2')], [('us-east-1', 'ami-1')]]
+    readiness.wait_any.side_effect = lambda keys, timeout: finished.pop(0)
+    readiness.wait.side_effect = lambda region, ami_id: {'us-east-1': ami_id, 'us-west-2': 'ami-copy'}[region]
+    readiness.start.return_value = readiness
+    with patch('License2Deploy.orchestrator.AMIReadiness', return_value=readiness):
+      report = orchestrator.run()
+    readiness.add.assert_called_once_with('us-east-1', 'ami-1', None)
+    readiness.copy.assert_called_once_with('us-east-1', 'ami-2', ['us-west-2'], None)
+    self.assertEqual(FakeDeploy.deployed, [('qa', None), ('prd', 'us-west-2'), ('prd', 'us-east-1')])
+    self.assertEqual([r['target'] for r in report['targets']], ['prd/us-east-1/None', 'prd/us-west-2/None', 'qa/default/None'])
+    self.assertEqual(orchestrator.deploy_settings(orchestrator.targets[1])['ami_id'], 'ami-copy')
+
+  def test_cancelled_deploy_cleans_up(self):
+    class CancelledDeploy(FakeDeploy):
+      def deploy(self):
+        raise DeployCancelled('signal 15')
+      def abort(self, timeout):
+        self.aborted = timeout
+    orchestrator = DeployOrchestrator([{'env': 'stg'}, {'env': 'prd', 'wave': 1}], deploy_class=CancelledDeploy,
+                                      shutdown_timeout=5)
+    report = orchestrator.run()
+    self.assertEqual([r['status'] for r in report['targets']], ['cancelled', 'skipped'])
+    self.assertFalse(report['success'])
+
+  def test_cancel_interrupts_the_ami_wait(self):
+    orchestrator = DeployOrchestrator([{'env': 'prd', 'region': 'us-east-1', 'ami_id': 'ami-1'}, {'env': 'qa', 'wave': 1}],
+                                      deploy_class=FakeDeploy)
+    readiness = MagicMock(images={('us-east-1', 'ami-1'): 'ami-1'})
+    readiness.start.return_value = readiness
+    readiness.wait_any.side_effect = lambda keys, timeout: keys
+    readiness.wait.side_effect = DeployCancelled('signal 15')
+    with patch('License2Deploy.orchestrator.AMIReadiness', return_value=readiness) as ami_readiness:
+      report = orchestrator.run()
+    ami_readiness.assert_called_once_with(timeout=orchestrator.ami_timeout, token=orchestrator.token)
+    self.assertEqual(FakeDeploy.deployed, [])
+    self.assertEqual([r['status'] for r in report['targets']], ['cancelled', 'skipped'])
+
+  def test_cancel_cancels_the_token(self):
+    orchestrator = self.orchestrator([{'env': 'prd'}])
+    orchestrator.cancel('signal 15')
+    self.assertRaises(DeployCancelled, orchestrator.token.check)
@@ -0,0 +1,43 @@
+import json
+import unittest
+
+from License2Deploy.planner import DeployPlanner
+from License2Deploy.simulated_aws import SimulatedAWS, simulated_deploy
+
+
+class DeployPlannerTest(unittest.TestCase):
+
+  def plan(self, aws, **settings):
+    return DeployPlanner(simulated_deploy(aws, **settings)).plan()
+
+  def test_plan_only_reads(self):
+    aws = SimulatedAWS(4, alarm_count=2, target_group_count=2)
+    plan = self.plan(aws)
+    self.assertEqual([operation for operation in aws.calls
+                      if not operation.split('.')[1].startswith(('Describe', 'Get', 'List'))], [])
+    self.assertEqual(aws.desired_capacity, 4)
+    self.assertEqual((plan['launch'], plan['terminate'], plan['peak_capacity']), (4, 4, 8))
+    self.assertEqual(plan['current_builds'], {'1': 4})
+    self.assertEqual(plan['instance_type'], 'm5.large')
+    self.assertEqual(len(plan['alarms']), 2)
+    self.assertEqual([(b['healthy'], b['instances']) for b in plan['balancers']], [(4, 4)] * 3)
+    self.assertEqual(plan['problems'], [])
+
+  def test_time_budget_follows_the_waits(self):
+    plan = self.plan(SimulatedAWS(4))
+    budgets = dict((step['state'], step['max_seconds']) for step in plan['steps'])
+    self.assertEqual(budgets['new_healthy'], 3 * 2000 * 0.05)
+    self.assertEqual(budgets['verified'], 2000 * 0.05)
+    self.assertEqual(plan['max_seconds'], sum(budgets.values()))
+
+  def test_batch_plan(self):
+    plan = self.plan(SimulatedAWS(5), mode='batch', batch_size=2)
+    self.assertEqual((plan['mode'], plan['batches'], plan['peak_capacity']), ('batch', 3, 7))
+    self.assertEqual([step['max_seconds'] for step in plan['steps'] if step['state'] == 'old_replaced'], [3 * 3 * 100.0])
+
+  def test_redeploy_is_a_problem(self):
+    plan = self.plan(SimulatedAWS(2, build_number='2'))
+    self.assertEqual(len(plan['problems']), 1)
+    self.assertTrue('already deployed' in plan['problems'][0])
+    self.assertTrue('Problem: Build 2 is already deployed' in DeployPlanner.format(plan))
+    self.assertEqual(json.loads(DeployPlanner.format(plan, 'json'))['problems'], plan['problems'])
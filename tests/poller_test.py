@@ -0,0 +1,49 @@
+import unittest
+from mock import MagicMock
+
+from License2Deploy.poller import Poller, WaitHistogram
+
+
+class PollerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.histogram = WaitHistogram()
+    self.poller = Poller(100, initial_delay=1, max_delay=8, jitter=0, name='test', histogram=self.histogram)
+    self.poller.sleep = MagicMock()
+
+  def test_first_probe_is_immediate(self):
+    self.assertEqual(self.poller.wait(lambda: 'ready'), 'ready')
+    self.poller.sleep.assert_not_called()
+    self.assertEqual(len(self.histogram.durations['test']), 1)
+
+  def test_delays_back_off_up_to_max_delay(self):
+    delays = self.poller.delays()
+    self.assertEqual([next(delays) for i in range(6)], [1, 2, 4, 8, 8, 8])
+
+  def test_first_delay_never_exceeds_max_delay(self):
+    self.assertEqual(next(Poller(100, initial_delay=5, max_delay=2, jitter=0).delays()), 2)
+
+  def test_wait_gives_up_at_deadline(self):
+    self.poller.timeout = 0
+    self.assertFalse(self.poller.wait(lambda: False))
+
+  def test_call_retries_until_success(self):
+    func = MagicMock(side_effect=[Exception('not yet'), Exception('not yet'), 'done'])
+    self.assertEqual(self.poller.call(func, 'arg'), 'done')
+    func.assert_called_with('arg')
+    self.assertEqual([c[0][0] for c in self.poller.sleep.call_args_list], [1, 2])
+
+  def test_call_raises_last_error(self):
+    self.poller.timeout = 0
+    self.assertRaises(ValueError, lambda: self.poller.call(MagicMock(side_effect=ValueError('never'))))
+
+  def test_from_tries(self):
+    poller = Poller.from_tries(10, 30)
+    self.assertEqual((poller.timeout, poller.initial_delay, poller.max_delay), (300, 5, 30))
+    self.assertEqual(Poller.from_tries(3, 1).initial_delay, 1)
+
+  def test_histogram_buckets(self):
+    for seconds in [1, 4, 20, 5000]:
+      self.histogram.record('ami', seconds)
+    buckets = dict(self.histogram.buckets('ami'))
+    self.assertEqual((buckets['5'], buckets['30'], buckets['+Inf'], buckets['60']), (2, 1, 1, 0))
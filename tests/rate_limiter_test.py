@@ -0,0 +1,141 @@
+import unittest
+import boto3
+from mock import MagicMock
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from License2Deploy.AWSConn import AWSClients
+from License2Deploy.instrumentation import DeployMetrics
+from License2Deploy.rate_limiter import RateLimitedConnection, RateLimiter, TokenBucket
+from tests.simulation import SimulatedDeployTest
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 0.0
+    self.slept = []
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.slept.append(seconds)
+
+
+class FakeRaw(object):
+
+  def __init__(self, body):
+    self.body = body
+
+  def stream(self, **kwargs):
+    return iter([self.body.encode('utf-8')])
+
+
+class FakeHTTPSession(object):
+  """ Stands in for the HTTP session of a botocore endpoint, answering each request with the next response """
+
+  def __init__(self, responses):
+    self.responses = list(responses)
+
+  def send(self, request):
+    status_code, body = self.responses.pop(0)
+    return AWSResponse(request.url, status_code, {}, FakeRaw(body))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = FakeClock()
+    self.bucket = TokenBucket(10, 2)
+    self.bucket.clock = self.clock
+    self.bucket.sleep = self.clock.sleep
+    self.bucket.updated = 0.0
+
+  def test_burst_then_rate(self):
+    self.assertEqual([self.bucket.acquire() for i in range(4)], [0, 0, 0.1, 0.2])
+    self.assertEqual(self.clock.slept, [0.1, 0.2])
+    self.clock.now = 1.0
+    self.assertEqual(self.bucket.acquire(), 0)
+    self.assertEqual(self.bucket.stats()['waits'], 2)
+    self.assertEqual(self.bucket.stats()['requests'], 5)
+
+  def test_throttle_halves_rate_and_recovers(self):
+    self.bucket.throttled()
+    self.assertEqual(self.bucket.rate, 5)
+    self.assertEqual(self.bucket.acquire(), 0.2)
+    for i in range(20):
+      self.bucket.throttled()
+    self.assertEqual(self.bucket.rate, self.bucket.min_rate)
+    for i in range(100):
+      self.bucket.succeeded()
+    self.assertEqual(self.bucket.rate, 10)
+    self.assertEqual(self.bucket.stats()['throttles'], 21)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.limiter = RateLimiter({'autoscaling': (1, 1)})
+
+  def throttling_error(self):
+    return ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'SetDesiredCapacity')
+
+  def test_families(self):
+    self.assertEqual(self.limiter.family('ec2', 'DescribeInstances'), 'ec2_describe')
+    self.assertEqual(self.limiter.family('ec2', 'CreateTags'), 'ec2')
+    self.assertEqual(self.limiter.family('asg', 'SetDesiredCapacity'), 'autoscaling')
+    self.assertEqual(self.limiter.family('elb', 'DescribeInstanceHealth'), 'elb')
+    self.assertEqual(self.limiter.family('elb2', 'DescribeTargetHealth'), 'elb')
+    self.assertEqual(self.limiter.family('unknown', 'Call'), 'other')
+    self.assertEqual(self.limiter.budgets['autoscaling'], (1, 1))
+
+  def test_shared_per_account_and_region(self):
+    self.assertTrue(RateLimiter.shared('us-east-1', 'a') is RateLimiter.shared('us-east-1', 'a'))
+    self.assertFalse(RateLimiter.shared('us-east-1', 'a') is RateLimiter.shared('us-west-1', 'a'))
+    clients = AWSClients('us-east-1', 'a')
+    self.assertTrue(clients.limiter is RateLimiter.shared('us-east-1', 'a'))
+
+  def test_connection_calls_take_tokens(self):
+    asg = MagicMock(spec=['set_desired_capacity'])
+    asg.set_desired_capacity.side_effect = [None, self.throttling_error()]
+    connection = self.limiter.wrap('asg', asg)
+    self.assertTrue(isinstance(connection, RateLimitedConnection))
+    self.limiter.buckets['autoscaling'].sleep = lambda seconds: None
+    connection.set_desired_capacity('group', 2)
+    self.assertRaises(ClientError, lambda: connection.set_desired_capacity('group', 2))
+    stats = self.limiter.stats()
+    self.assertEqual(list(stats), ['autoscaling'])
+    self.assertEqual((stats['autoscaling']['requests'], stats['autoscaling']['throttles']), (2, 1))
+    self.assertEqual(stats['autoscaling']['rate'], 0.5)
+
+  def test_boto3_requests_take_tokens(self):
+    client = boto3.session.Session(aws_access_key_id='key', aws_secret_access_key='secret', region_name='us-east-1').client(
+      'ec2', config=Config(retries={'max_attempts': 0}))
+    client._endpoint.http_session = FakeHTTPSession([
+      (200, '<DescribeInstancesResponse><reservationSet/></DescribeInstancesResponse>'),
+      (503, '<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>'
+            '</Error></Errors><RequestID>r-1</RequestID></Response>')])
+    self.assertTrue(self.limiter.wrap('ec2', client) is client)
+    self.assertEqual(client.describe_instances()['Reservations'], [])
+    self.assertRaises(ClientError, lambda: client.create_tags(Resources=['i-1'], Tags=[{'Key': 'BUILD', 'Value': '2'}]))
+    self.assertEqual(self.limiter.buckets['ec2_describe'].requests, 1)
+    self.assertEqual((self.limiter.buckets['ec2'].requests, self.limiter.buckets['ec2'].throttles), (1, 1))
+
+  def test_metrics_report_rate_limits(self):
+    metrics = DeployMetrics({'project': 'server'})
+    metrics.rate_limiter = self.limiter
+    self.limiter.acquire('elb')
+    self.assertEqual(metrics.report()['rate_limits']['elb']['requests'], 1)
+    self.assertTrue('license2deploy_rate_limit_waits_total{family="elb",project="server"} 0' in metrics.prometheus_lines())
+
+
+class RateLimitedDeployTest(SimulatedDeployTest):
+
+  def test_deploy_through_rate_limiter(self):
+    limiter = RateLimiter({})
+    deploy = self.build_deploy(self.simulated_aws(4, api_rate=1000), limiter=limiter)
+    deploy.deploy()
+    self.assertEqual(deploy.metrics.status, 'succeeded')
+    self.assertEqual(sum(stats['waited_seconds'] for stats in limiter.stats().values()), 0)
@@ -1,17 +1,17 @@
 import sys
+import threading
 import pytest
 import unittest
-import boto
-from boto.ec2.autoscale.launchconfig import LaunchConfiguration
-from boto.ec2.autoscale.group import AutoScalingGroup
-from boto.ec2.cloudwatch.alarm import MetricAlarm
-from moto import mock_autoscaling_deprecated
-from moto import mock_ec2_deprecated
-from moto import mock_elb_deprecated
-from moto.cloudwatch import mock_cloudwatch_deprecated
+import boto3
+from mock import MagicMock, patch
+from moto import mock_autoscaling
+from moto import mock_ec2
+from moto import mock_elb
+from moto import mock_cloudwatch
 
 from License2Deploy.rolling_deploy import RollingDeploy
-from License2Deploy.AWSConn import AWSConn
+from License2Deploy.AWSConn import AWSConn, AWSClients
+from License2Deploy.batching import Batcher
 
 
 class RollingDeployTest(unittest.TestCase):
@@ -25,9 +25,9 @@ class RollingDeployTest(unittest.TestCase):
   GMS_AUTOSCALING_GROUP_STG = 'server-backend-stg-servergmsextenderASGstg-3ELOD1FOTESTING'
   GMS_AUTOSCALING_GROUP_PRD = 'server-backend-prd-servergmsextenderASGprd-3ELOD1FOTESTING'
 
-  @mock_autoscaling_deprecated
-  @mock_elb_deprecated
-  @mock_ec2_deprecated
+  @mock_autoscaling
+  @mock_elb
+  @mock_ec2
   def setUp(self):
     self.setUpELB()
     self.rolling_deploy = RollingDeploy('stg', 'server-gms-extender', '0', 'ami-abcd1234', None, './regions.yml', force_redeploy=True)
@@ -38,148 +38,154 @@ class RollingDeployTest(unittest.TestCase):
       self.launch_configuration_name: launch_configuration_name
     }
 
-  @mock_autoscaling_deprecated
+  def setUpSubnet(self):
+    ec2 = boto3.client('ec2', region_name='us-east-1')
+    vpc_id = ec2.create_vpc(CidrBlock='10.10.0.0/16')['Vpc']['VpcId']
+    return ec2.create_subnet(VpcId=vpc_id, CidrBlock='10.10.0.0/24', AvailabilityZone='us-east-1a')['Subnet']['SubnetId']
+
   def setUpAutoScaleGroup(self, configurations, env="stg"):
-    conn = boto.connect_autoscale()
+    conn = boto3.client('autoscaling', region_name='us-east-1')
+    subnet_id = self.setUpSubnet()
     for configuration in configurations:
-      config = LaunchConfiguration(
-        name=configuration[self.launch_configuration_name],
-        image_id='ami-abcd1234',
-        instance_type='m1.medium',
+      conn.create_launch_configuration(
+        LaunchConfigurationName=configuration[self.launch_configuration_name],
+        ImageId='ami-abcd1234',
+        InstanceType='m1.medium',
       )
-      load_balancer_name = self.load_balancer_name
-      group = AutoScalingGroup(
-        name=configuration[self.autoscaling_group_name],
-        availability_zones=['us-east-1a'],
-        default_cooldown=300,
-        desired_capacity=2,
-        health_check_period='0',
-        health_check_type="EC2",
-        max_size=10,
-        min_size=2,
-        launch_config=config,
-        load_balancers=[load_balancer_name],
-        vpc_zone_identifier='subnet-1234abcd',
-        termination_policies=["Default"],
+      conn.create_auto_scaling_group(
+        AutoScalingGroupName=configuration[self.autoscaling_group_name],
+        AvailabilityZones=['us-east-1a'],
+        DefaultCooldown=300,
+        DesiredCapacity=2,
+        HealthCheckGracePeriod=0,
+        HealthCheckType="EC2",
+        MaxSize=10,
+        MinSize=2,
+        LaunchConfigurationName=configuration[self.launch_configuration_name],
+        LoadBalancerNames=[self.load_balancer_name],
+        VPCZoneIdentifier=subnet_id,
+        TerminationPolicies=["Default"],
       )
-      conn.create_launch_configuration(config)
-      conn.create_auto_scaling_group(group)
 
-  @mock_elb_deprecated
   def setUpELB(self, env='stg'):
-    conn_elb = boto.connect_elb()
-    zones = ['us-east-1a']
-    ports = [(80, 8080, 'http')]
-    load_balancer_name = self.load_balancer_name
-    conn_elb.create_load_balancer(load_balancer_name, zones, ports)
-    balancers = conn_elb.get_all_load_balancers(load_balancer_names=[load_balancer_name])
-    self.assertEqual(balancers[0].name, load_balancer_name)
-
-  @mock_ec2_deprecated
-  @mock_elb_deprecated
+    conn_elb = boto3.client('elb', region_name='us-east-1')
+    conn_elb.create_load_balancer(LoadBalancerName=self.load_balancer_name, AvailabilityZones=['us-east-1a'],
+                                  Listeners=[{'Protocol': 'http', 'LoadBalancerPort': 80, 'InstancePort': 8080}])
+    balancers = conn_elb.describe_load_balancers(LoadBalancerNames=[self.load_balancer_name])['LoadBalancerDescriptions']
+    self.assertEqual(balancers[0]['LoadBalancerName'], self.load_balancer_name)
+
   def setUpEC2(self, tag=True):
     self.setUpELB()
-    conn_elb = boto.connect_elb()
-    conn = boto.connect_ec2()
-    instance_id_list = []
-    reservation = conn.run_instances('ami-1234abcd', min_count=2, private_ip_address="10.10.10.10")
-    instance_ids = reservation.instances
-    for instance in instance_ids:
-      if tag:
-        instance.add_tag('BUILD', 0)
-      instance_id_list.append(instance.id)
-    elb = conn_elb.get_all_load_balancers(load_balancer_names=[self.load_balancer_name])[0]
-    elb.register_instances(instance_id_list)
-    elb_ids = [instance.id for instance in elb.instances]
-    self.assertEqual(instance_id_list.sort(), elb_ids.sort())
+    conn_elb = boto3.client('elb', region_name='us-east-1')
+    conn = boto3.client('ec2', region_name='us-east-1')
+    reservation = conn.run_instances(ImageId='ami-1234abcd', MinCount=2, MaxCount=2, PrivateIpAddress="10.10.10.10")
+    instance_id_list = [instance['InstanceId'] for instance in reservation['Instances']]
+    if tag:
+      conn.create_tags(Resources=instance_id_list, Tags=[{'Key': 'BUILD', 'Value': '0'}])
+    conn_elb.register_instances_with_load_balancer(LoadBalancerName=self.load_balancer_name,
+                                                   Instances=[{'InstanceId': i} for i in instance_id_list])
+    elb = conn_elb.describe_load_balancers(LoadBalancerNames=[self.load_balancer_name])['LoadBalancerDescriptions'][0]
+    self.assertEqual(sorted(instance_id_list), sorted(i['InstanceId'] for i in elb['Instances']))
 
     return [conn, instance_id_list]
 
-  @mock_cloudwatch_deprecated
-  def setUpCloudWatch(self, instance_ids, env="stg"):
-    alarm = MetricAlarm(
-      name = "servergmsextender_CloudWatchAlarm" + env,
-      namespace = "AWS/EC2",
-      metric = "CPUUtilization",
-      comparison = ">=",
-      threshold = "90",
-      evaluation_periods = 1,
-      statistic = "Average",
-      period = 300,
-      dimensions = {'InstanceId': instance_ids},
-      alarm_actions=['arn:alarm'],
-      ok_actions=['arn:ok']
+  def setUpCloudWatch(self, instance_ids, env="stg", comparison="GreaterThanOrEqualToThreshold"):
+    watch_conn = boto3.client('cloudwatch', region_name='us-east-1')
+    watch_conn.put_metric_alarm(
+      AlarmName="servergmsextender_CloudWatchAlarm" + env,
+      Namespace="AWS/EC2",
+      MetricName="CPUUtilization",
+      ComparisonOperator=comparison,
+      Threshold=90,
+      EvaluationPeriods=1,
+      Statistic="Average",
+      Period=300,
+      Dimensions=[{'Name': 'InstanceId', 'Value': instance_id} for instance_id in instance_ids],
+      AlarmActions=['arn:alarm'],
+      OKActions=['arn:ok']
     )
-    watch_conn = boto.connect_cloudwatch()
-    watch_conn.put_metric_alarm(alarm)
-
-  @mock_cloudwatch_deprecated
-  def setUpCloudWatchWithWrongConfig(self, instance_ids, env="stg"):
-    alarm = MetricAlarm(
-      name = "servergmsextender_CloudWatchAlarm" + env,
-      namespace = "AWS/EC2",
-      metric = "CPUUtilization",
-      comparison = "GreaterThanThreshold", # wrong configuration that would generate error.
-      threshold = "90",
-      evaluation_periods = 1,
-      statistic = "Average",
-      period = 300,
-      dimensions = {'InstanceId': instance_ids},
-      alarm_actions=['arn:alarm'],
-      ok_actions=['arn:ok']
-    )
-    watch_conn = boto.connect_cloudwatch()
-    watch_conn.put_metric_alarm(alarm)
 
-  @mock_cloudwatch_deprecated
+  def instance_ids_with_build(self, build):
+    reservations = boto3.client('ec2', region_name='us-east-1').describe_instances()['Reservations']
+    return [instance['InstanceId'] for reservation in reservations for instance in reservation['Instances']
+            if AWSConn.tag_dict(instance.get('Tags')).get('BUILD') == build]
+
+  @mock_cloudwatch
+  @mock_ec2
+  @mock_elb
   def test_retrieve_project_cloudwatch_alarms(self):
-    instance_ids = self.setUpEC2()
+    instance_ids = self.setUpEC2()[1]
     self.setUpCloudWatch(instance_ids)
     cloud_watch_alarms = self.rolling_deploy.retrieve_project_cloudwatch_alarms()
     print(cloud_watch_alarms)
     self.assertEqual(1, len(cloud_watch_alarms))
 
-  @mock_cloudwatch_deprecated
+  @mock_cloudwatch
+  @mock_ec2
+  @mock_elb
+  def test_retrieve_project_cloudwatch_alarms_is_cached(self):
+    instance_ids = self.setUpEC2()[1]
+    self.setUpCloudWatch(instance_ids)
+    self.rolling_deploy.alarm_prefix = 'servergmsextender'
+    self.assertEqual(self.rolling_deploy.retrieve_project_cloudwatch_alarms(), ['servergmsextender_CloudWatchAlarmstg'])
+    cloudwatch = self.rolling_deploy.cloudwatch
+    with patch.object(cloudwatch, 'describe_alarms') as describe_alarms, patch.object(cloudwatch, 'enable_alarm_actions') as enable:
+      self.rolling_deploy.enable_project_cloudwatch_alarms()
+    describe_alarms.assert_not_called()
+    enable.assert_called_once_with(AlarmNames=['servergmsextender_CloudWatchAlarmstg'])
+
+  @mock_cloudwatch
+  @mock_ec2
+  @mock_elb
   def test_retrieve_project_cloudwatch_alarms_with_no_valid_alarms(self):
-    instance_ids = self.setUpEC2()
+    instance_ids = self.setUpEC2()[1]
     self.setUpCloudWatch(instance_ids)
     self.rolling_deploy.env = "wrong_env_prd" # set a wrong environment
     cloud_watch_alarms = self.rolling_deploy.retrieve_project_cloudwatch_alarms()
     self.assertEqual(0, len(cloud_watch_alarms))
 
-  @mock_cloudwatch_deprecated
+  @mock_cloudwatch
+  @mock_ec2
+  @mock_elb
   def test_retrieve_project_cloudwatch_alarms_with_wrong_config(self):
-    instance_ids = self.setUpEC2()
-    self.setUpCloudWatchWithWrongConfig(instance_ids)
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.retrieve_project_cloudwatch_alarms())
+    instance_ids = self.setUpEC2()[1]
+    self.setUpCloudWatch(instance_ids)
+    with patch.object(self.rolling_deploy.cloudwatch, 'describe_alarms', side_effect=Exception('ValidationError')):
+      self.assertRaises(Exception, lambda: self.rolling_deploy.retrieve_project_cloudwatch_alarms())
 
-  @mock_cloudwatch_deprecated
+  @mock_cloudwatch
+  @mock_ec2
+  @mock_elb
   def test_enable_project_cloudwatch_alarms_Error(self):
-    instance_ids = self.setUpEC2()
+    instance_ids = self.setUpEC2()[1]
     self.setUpCloudWatch(instance_ids)
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.enable_project_cloudwatch_alarms())
+    with patch.object(self.rolling_deploy.cloudwatch, 'enable_alarm_actions', side_effect=Exception('denied')):
+      self.assertRaises(Exception, lambda: self.rolling_deploy.enable_project_cloudwatch_alarms())
 
-  @mock_cloudwatch_deprecated
+  @mock_cloudwatch
+  @mock_ec2
+  @mock_elb
   def test_disable_project_cloudwatch_alarms_Error(self):
-    instance_ids = self.setUpEC2()
+    instance_ids = self.setUpEC2()[1]
     self.setUpCloudWatch(instance_ids)
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.disable_project_cloudwatch_alarms())
+    with patch.object(self.rolling_deploy.cloudwatch, 'disable_alarm_actions', side_effect=Exception('denied')):
+      self.assertRaises(Exception, lambda: self.rolling_deploy.disable_project_cloudwatch_alarms())
 
-  @mock_ec2_deprecated
+  @mock_ec2
+  @mock_elb
   def test_tag_ami(self):
     conn = self.setUpEC2()[0]
-    reservation = conn.run_instances('ami-1234xyz1', min_count=1)
-    instance_ids = reservation.instances
-    conn.create_image(instance_ids[0].id, "test-ami", "this is a test ami")
-    _ami_ids = conn.get_all_images()
-    _ami_id = _ami_ids[0].id
+    instance_id = conn.run_instances(ImageId='ami-1234xyz1', MinCount=1, MaxCount=1)['Instances'][0]['InstanceId']
+    _ami_id = conn.create_image(InstanceId=instance_id, Name="test-ami", Description="this is a test ami")['ImageId']
     self.rolling_deploy = RollingDeploy('stg', 'server-gms-extender', '0', _ami_id, None, './regions.yml')
     self.rolling_deploy.tag_ami(str(_ami_id), 'stg')
     self.rolling_deploy.tag_ami(str(_ami_id), 'qa')
     self.rolling_deploy.tag_ami(str(_ami_id), 'qa')
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.tag_ami('blargness', 'qa'))
+    tags = AWSConn.tag_dict(conn.describe_images(ImageIds=[_ami_id])['Images'][0]['Tags'])
+    self.assertEqual(tags['deployed'], 'stg, qa')
+    self.assertRaises(Exception, lambda: self.rolling_deploy.tag_ami('blargness', 'qa'))
 
-  @mock_ec2_deprecated
+  @mock_ec2
   def test_load_config(self):
     self.assertEqual(AWSConn.load_config('regions.yml').get('qa'), 'us-west-1')
     self.assertEqual(AWSConn.load_config('regions.yml').get('stg'), 'us-east-1')
@@ -187,150 +193,302 @@ class RollingDeployTest(unittest.TestCase):
     self.assertEqual(AWSConn.load_config('regions.yml').get('default'), 'us-west-1')
     self.assertEqual(AWSConn.load_config('regions.yml').get('zero'), None)
 
-  @mock_ec2_deprecated
+  @mock_ec2
   def test_load_config(self):
     self.assertEqual(AWSConn.determine_region('get-shwifty'), 'us-west-1')
 
-  @mock_ec2_deprecated
+  def test_region_overrides_environment(self):
+    rolling_deploy = RollingDeploy('stg', 'server-gms-extender', '0', 'ami-abcd1234', None, './regions.yml', region='us-west-2')
+    self.assertEqual(rolling_deploy.region, 'us-west-2')
+
+  def test_determine_region_known_region(self):
+    self.assertEqual(AWSConn.determine_region('us-east-1'), 'us-east-1')
+
+  def test_clients_are_built_on_first_use(self):
+    clients = AWSClients('us-east-1')
+    with patch.object(AWSConn, 'get_boto3_session') as get_boto3_session:
+      self.assertFalse(clients.is_built('elb'))
+      self.assertEqual(clients.get('elb'), clients.get('elb'))
+      clients.get('asg')
+      clients.get('ec2')
+    get_boto3_session.assert_called_once_with('us-east-1', 'default')
+    self.assertEqual([c[0][0] for c in get_boto3_session.return_value.client.call_args_list], ['elb', 'autoscaling', 'ec2'])
+    self.assertEqual(get_boto3_session.return_value.client.call_args[1]['config'].max_pool_connections, AWSClients.MAX_WORKERS)
+    self.assertRaises(Exception, lambda: clients.get('nothing'))
+
+  def test_operations_run_on_worker_threads(self):
+    clients = AWSClients('us-east-1')
+    ec2 = MagicMock()
+    ec2.describe_images.side_effect = lambda ImageIds: {'Images': [{'ImageId': i, 'thread': threading.current_thread().name}
+                                                                   for i in ImageIds]}
+    clients.set('ec2', ec2)
+    try:
+      image = clients.call('ec2', 'describe_images', ImageIds=['ami-1'])['Images'][0]
+      self.assertEqual(image['thread'], threading.current_thread().name)
+      image = clients.submit('ec2', 'describe_images', ImageIds=['ami-2']).result(timeout=10)['Images'][0]
+      self.assertEqual(image['ImageId'], 'ami-2')
+      self.assertNotEqual(image['thread'], threading.current_thread().name)
+    finally:
+      clients.shutdown()
+
+  @unittest.skipIf(sys.version_info < (3, 4), 'asyncio needs python 3.4')
+  def test_operations_can_be_awaited(self):
+    import asyncio
+    clients = AWSClients('us-east-1')
+    clients.set('ec2', MagicMock(**{'describe_images.return_value': {'Images': []}}))
+    loop = asyncio.new_event_loop()
+    try:
+      self.assertEqual(loop.run_until_complete(asyncio.wrap_future(clients.submit('ec2', 'describe_images'), loop=loop)),
+                       {'Images': []})
+    finally:
+      loop.close()
+      clients.shutdown()
+
+  @mock_ec2
+  @mock_elb
   def test_wait_ami_availability(self):
-    conn = self.setUpEC2()[0]
-    inst_ids = self.setUpEC2()[1]
-    conn.create_image(inst_ids[0], "test-ami", "this is a test ami")
-    ami_ids = conn.get_all_images()
-    ami_id = ami_ids[0]
-    self.assertEqual(str(ami_id), str(self.rolling_deploy.get_ami_id_state(ami_id.id)))
-    self.assertTrue(self.rolling_deploy.wait_ami_availability(ami_id.id))
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.wait_ami_availability('bad-id')) #Will raise exception because ami can't be found
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.wait_ami_availability(ami_id.id, -100)) #Will raise exception as time limit is over
-
-  @mock_ec2_deprecated
-  @mock_elb_deprecated
+    conn, inst_ids = self.setUpEC2()
+    ami_id = conn.create_image(InstanceId=inst_ids[0], Name="test-ami", Description="this is a test ami")['ImageId']
+    self.assertEqual(ami_id, self.rolling_deploy.get_ami_id_state(ami_id)['ImageId'])
+    self.assertTrue(self.rolling_deploy.wait_ami_availability(ami_id))
+    self.assertRaises(Exception, lambda: self.rolling_deploy.wait_ami_availability('bad-id')) #Will raise exception because ami can't be found
+    with patch.object(self.rolling_deploy, 'get_ami_id_state', return_value={'ImageId': ami_id, 'State': 'pending'}):
+      self.assertRaises(Exception, lambda: self.rolling_deploy.wait_ami_availability(ami_id, 0)) #Will raise exception as time limit is over
+
+  @mock_ec2
+  @mock_elb
   def test_confirm_lb_has_only_new_instances(self):
     instance_ids = self.setUpEC2()[1]
-    self.rolling_deploy.load_balancer = self.load_balancer_name
+    self.rolling_deploy.load_balancers = [self.load_balancer_name]
     self.assertEqual(len(instance_ids), len(self.rolling_deploy.confirm_lb_has_only_new_instances())) #Return All LB's with the proper build number
 
-  @mock_ec2_deprecated
-  @mock_elb_deprecated
+  @mock_ec2
+  @mock_elb
+  def test_get_build_tags(self):
+    instance_ids = self.setUpEC2()[1]
+    self.assertEqual(self.rolling_deploy.get_build_tags(instance_ids), dict((i, '0') for i in instance_ids))
+    with patch.object(self.rolling_deploy.ec2, 'describe_instances') as reservations:
+      self.assertEqual(self.rolling_deploy.get_build_tags(instance_ids[:1]), {instance_ids[0]: '0'})
+    reservations.assert_not_called()
+
+  def test_chunk_list(self):
+    self.assertEqual(RollingDeploy.chunk_list([1, 2, 3, 4, 5], 2), [[1, 2], [3, 4], [5]])
+    self.assertEqual(RollingDeploy.chunk_list([], 2), [])
+
+  def test_target_health_is_described_in_chunks(self):
+    elb2 = MagicMock()
+    elb2.describe_target_health.side_effect = lambda TargetGroupArn, Targets: {'TargetHealthDescriptions': [
+      {'Target': t, 'TargetHealth': {'State': 'healthy' if t['Id'] != 'i-2' else 'initial'}} for t in Targets]}
+    self.rolling_deploy.clients.set('elb2', elb2)
+    self.rolling_deploy.target_group_arns = ['arn']
+    self.rolling_deploy.batcher = Batcher(chunk_size=2, max_workers=2)
+    self.assertEqual(self.rolling_deploy.get_healthy_instance_ids(['i-1', 'i-2', 'i-3']), set(['i-1', 'i-3']))
+    self.assertEqual(elb2.describe_target_health.call_count, 2)
+    self.assertRaises(Exception, lambda: self.rolling_deploy.target_group_healthcheck(['i-1', 'i-2', 'i-3'], 'arn'))
+
+  def test_every_target_group_and_load_balancer_is_checked(self):
+    elb2 = MagicMock()
+    elb2.describe_target_health.side_effect = lambda TargetGroupArn, Targets: {'TargetHealthDescriptions': [
+      {'Target': t, 'TargetHealth': {'State': 'initial' if (TargetGroupArn, t['Id']) == ('arn:grpc', 'i-2') else 'healthy'}}
+      for t in Targets]}
+    elb = MagicMock(spec=['describe_instance_health'])
+    elb.describe_instance_health.side_effect = lambda LoadBalancerName, Instances: {'InstanceStates': [
+      {'InstanceId': i['InstanceId'], 'State': 'InService'} for i in Instances]}
+    self.rolling_deploy.clients.set('elb2', elb2)
+    self.rolling_deploy.clients.set('elb', elb)
+    self.rolling_deploy.load_balancers = ['classic']
+    self.rolling_deploy.target_group_arns = ['arn:internal', 'arn:grpc']
+    self.assertEqual(self.rolling_deploy.get_healthy_instance_ids(['i-1', 'i-2']), set(['i-1']))
+    self.assertEqual(sorted(c[1]['TargetGroupArn'] for c in elb2.describe_target_health.call_args_list),
+                     ['arn:grpc', 'arn:internal'])
+    elb.describe_instance_health.assert_called_once_with(LoadBalancerName='classic',
+                                                         Instances=[{'InstanceId': 'i-1'}, {'InstanceId': 'i-2'}])
+    self.assertTrue(self.rolling_deploy.elbs_healthcheck(['i-1']))
+    self.assertRaisesRegexp(Exception, 'arn:grpc', lambda: self.rolling_deploy.elbs_healthcheck(['i-1', 'i-2']))
+
+  def test_get_load_balancers(self):
+    self.rolling_deploy.load_balancer = 'classic'
+    with patch.object(self.rolling_deploy, 'describe_autoscaling_group',
+                      return_value={'LoadBalancerNames': ['attached', 'classic'], 'TargetGroupARNs': ['arn:1', 'arn:2']}):
+      self.assertEqual(self.rolling_deploy.get_load_balancers('group'), ['classic', 'attached'])
+      self.assertEqual(self.rolling_deploy.get_target_groups('group'), ['arn:1', 'arn:2'])
+
+  @mock_ec2
+  @mock_elb
+  def test_get_healthy_instance_ids(self):
+    instance_ids = self.setUpEC2()[1]
+    self.rolling_deploy.load_balancers = [self.load_balancer_name]
+    self.assertEqual(self.rolling_deploy.get_healthy_instance_ids(instance_ids), set(instance_ids))
+
+  @mock_ec2
+  @mock_elb
+  def test_find_new_instance_ids(self):
+    conn, instance_ids = self.setUpEC2(tag=False)
+    conn.create_tags(Resources=instance_ids[:1], Tags=[{'Key': 'BUILD', 'Value': '0'}])
+    with patch.object(self.rolling_deploy, 'get_all_instance_ids', return_value=instance_ids) as get_all_instance_ids:
+      self.assertEqual(self.rolling_deploy.find_new_instance_ids('group'), instance_ids[:1])
+      self.rolling_deploy.original_instance_ids = instance_ids
+      self.assertEqual(self.rolling_deploy.find_new_instance_ids('group'), [])
+    get_all_instance_ids.assert_called_with('group', refresh=True)
+
+  @mock_ec2
+  @mock_elb
   def test_lb_healthcheck(self):
     instance_ids = self.setUpEC2()[1]
-    self.rolling_deploy.load_balancer = self.load_balancer_name
-    self.assertTrue(self.rolling_deploy.lb_healthcheck(instance_ids)) #Return InService for all instances in ELB
+    self.rolling_deploy.load_balancers = [self.load_balancer_name]
+    self.assertTrue(self.rolling_deploy.lb_healthcheck(instance_ids, self.load_balancer_name)) #Return InService for all instances in ELB
     # Below doesn't work as I am unable to change the instance state. Need to modify elb_healthcheck method and also modify instance_health template.
     ## https://github.com/spulec/moto/blob/master/moto/elb/responses.py#L511 ##
     ## https://github.com/spulec/moto/blob/master/moto/elb/responses.py#L219 ##
     #self.assertRaises(SystemExit, lambda: self.rolling_deploy.lb_healthcheck(instance_ids, 1, 1)) #Return OutOfService for the first instance in the ELB which will raise an exit call
 
-  @mock_autoscaling_deprecated
-  def test_get_group_info(self):
+  @mock_autoscaling
+  @mock_ec2
+  def test_describe_autoscaling_group(self):
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    group = self.rolling_deploy.get_group_info([self.GMS_AUTOSCALING_GROUP_STG])[0]
-    self.assertEqual(group.name, self.GMS_AUTOSCALING_GROUP_STG)
+    group = self.rolling_deploy.describe_autoscaling_group(self.GMS_AUTOSCALING_GROUP_STG)
+    self.assertEqual(group['AutoScalingGroupName'], self.GMS_AUTOSCALING_GROUP_STG)
 
-  @mock_autoscaling_deprecated
-  def test_failure_get_group_info(self):
+  @mock_autoscaling
+  @mock_ec2
+  def test_failure_describe_autoscaling_group(self):
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.get_group_info('cool'))
+    self.assertRaises(Exception, lambda: self.rolling_deploy.describe_autoscaling_group('cool'))
 
-  @mock_autoscaling_deprecated
+  @mock_autoscaling
+  @mock_ec2
   def test_get_autoscale_group_name_stg(self):
     autoscaling_configurations = list()
     autoscaling_configurations.append(self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG))
     autoscaling_configurations.append(self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_PRD, self.GMS_AUTOSCALING_GROUP_PRD))
     self.setUpAutoScaleGroup(autoscaling_configurations)
-    group = self.rolling_deploy.get_autoscale_group_name()
+    self.rolling_deploy.get_asg_info()
+    group = self.rolling_deploy.asg_name
     self.assertEqual(group, self.GMS_AUTOSCALING_GROUP_STG)
     self.assertNotEqual(group, self.GMS_AUTOSCALING_GROUP_PRD)
 
-  @mock_autoscaling_deprecated
-  @mock_elb_deprecated
+  @mock_autoscaling
+  @mock_elb
+  @mock_ec2
   def test_get_autoscale_group_name_prd(self):
     self.setUpELB(env='prd')
     self.rolling_deploy = RollingDeploy('prd', 'server-gms-extender', '0', 'ami-test212', None, './regions.yml')
     autoscaling_configurations = list()
     autoscaling_configurations.append(self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_PRD, self.GMS_AUTOSCALING_GROUP_PRD))
     self.setUpAutoScaleGroup(autoscaling_configurations, env='prd')
-    group = self.rolling_deploy.get_autoscale_group_name()
+    self.rolling_deploy.get_asg_info()
+    group = self.rolling_deploy.asg_name
     self.assertEqual(group, self.GMS_AUTOSCALING_GROUP_PRD)
     self.assertNotEqual(group, self.GMS_AUTOSCALING_GROUP_STG)
 
-  @mock_autoscaling_deprecated
+  @mock_autoscaling
+  @mock_ec2
+  def test_get_asg_info(self):
+    autoscaling_configurations = list()
+    autoscaling_configurations.append(self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_PRD, self.GMS_AUTOSCALING_GROUP_PRD))
+    autoscaling_configurations.append(self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG))
+    self.setUpAutoScaleGroup(autoscaling_configurations)
+    self.rolling_deploy.get_asg_info()
+    self.assertEqual(self.rolling_deploy.asg_name, self.GMS_AUTOSCALING_GROUP_STG)
+    self.assertEqual(self.rolling_deploy.asg_info['AutoScalingGroups'][0]['DesiredCapacity'], 2)
+    with patch.object(self.rolling_deploy.asg, 'describe_auto_scaling_groups') as describe:
+      self.assertEqual(self.rolling_deploy.get_target_groups(self.GMS_AUTOSCALING_GROUP_STG), [])
+    describe.assert_not_called()
+
+  @mock_autoscaling
+  @mock_ec2
+  def test_get_asg_info_by_name(self):
+    self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_PRD, self.GMS_AUTOSCALING_GROUP_PRD)])
+    self.rolling_deploy.asg_name = self.GMS_AUTOSCALING_GROUP_PRD
+    self.rolling_deploy.get_asg_info()
+    self.assertEqual(self.rolling_deploy.asg_info['AutoScalingGroups'][0]['AutoScalingGroupName'], self.GMS_AUTOSCALING_GROUP_PRD)
+
+  @mock_autoscaling
+  @mock_ec2
+  def test_get_asg_info_no_matching_group(self):
+    self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_PRD, self.GMS_AUTOSCALING_GROUP_PRD)])
+    self.assertRaises(Exception, lambda: self.rolling_deploy.get_asg_info())
+
+  @mock_autoscaling
+  @mock_ec2
   def test_calculate_autoscale_desired_instance_count(self):
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
+    self.rolling_deploy.get_asg_info()
     increase = self.rolling_deploy.calculate_autoscale_desired_instance_count(self.GMS_AUTOSCALING_GROUP_STG, 'increase')
     decrease = self.rolling_deploy.calculate_autoscale_desired_instance_count(self.GMS_AUTOSCALING_GROUP_STG, 'decrease')
     self.assertEqual(increase, 4)
     self.assertEqual(decrease, 1)
 
-  @mock_autoscaling_deprecated
+  @mock_autoscaling
+  @mock_ec2
   def test_calculate_autoscale_desired_instance_count_failure(self):
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.calculate_autoscale_desired_instance_count(self.GMS_AUTOSCALING_GROUP_STG, 'nothing'))
+    self.rolling_deploy.get_asg_info()
+    self.assertRaises(Exception, lambda: self.rolling_deploy.calculate_autoscale_desired_instance_count(self.GMS_AUTOSCALING_GROUP_STG, 'nothing'))
 
-  @mock_ec2_deprecated
+  @mock_ec2
+  @mock_elb
   def test_get_instance_ip_addrs(self):
-    self.setUpEC2()
-    self.rolling_deploy.get_instance_ip_addrs(self.setUpEC2()[1])
-    self.rolling_deploy.log_instances_ips(self.setUpEC2()[1], 'group')
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.get_instance_ip_addrs(['blah', 'blarg']))
+    instance_ids = self.setUpEC2()[1]
+    self.assertEqual(self.rolling_deploy.get_instance_ip_addrs(instance_ids), dict((i, '10.10.10.10') for i in instance_ids))
+    self.rolling_deploy.log_instances_ips(instance_ids, 'group')
+    self.assertEqual(self.rolling_deploy.get_instance_ip_addrs(['i-00000000']), {}) # gone instances are left out
 
-  @mock_ec2_deprecated
+  @mock_ec2
+  @mock_elb
   def test_is_redeploy(self):
-    self.setUpEC2()
+    self.rolling_deploy.original_instance_ids = self.setUpEC2()[1]
     self.assertTrue(self.rolling_deploy.is_redeploy())
 
-  @mock_ec2_deprecated
+  @mock_ec2
+  @mock_elb
   def test_is_redeploy_fails(self):
-    self.setUpEC2(tag=False)
-    with pytest.raises(SystemExit):
+    self.rolling_deploy.original_instance_ids = self.setUpEC2(tag=False)[1]
+    with pytest.raises(Exception):
       self.rolling_deploy.is_redeploy()
 
   def test_stop_deploy(self):
-    with pytest.raises(SystemExit):
+    with pytest.raises(Exception):
       self.rolling_deploy.stop_deploy('error!')
 
-  @mock_ec2_deprecated
-  @mock_autoscaling_deprecated
-  @mock_elb_deprecated
+  @mock_ec2
+  @mock_autoscaling
+  @mock_elb
   def test_get_all_instance_ids(self):
     self.setUpELB()
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    conn = boto.connect_ec2()
-    reservation = conn.run_instances('ami-1234abcd', min_count=2, private_ip_address="10.10.10.10")
-    instance_ids = reservation.instances
+    conn = boto3.client('ec2', region_name='us-east-1')
+    reservation = conn.run_instances(ImageId='ami-1234abcd', MinCount=2, MaxCount=2, PrivateIpAddress="10.10.10.10")
+    instance_ids = reservation['Instances']
     rslt = self.rolling_deploy.get_all_instance_ids(self.GMS_AUTOSCALING_GROUP_STG)
     self.assertEqual(len(instance_ids), len(rslt))
 
-  @mock_ec2_deprecated
-  @mock_autoscaling_deprecated
-  @mock_elb_deprecated
+  @mock_ec2
+  @mock_autoscaling
+  @mock_elb
   def test_validate_instance_list(self):
     self.setUpELB()
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    conn = boto.connect_ec2()
-    reservation = conn.run_instances('ami-1234abcd', min_count=2, private_ip_address="10.10.10.10")
-    instances = reservation.instances
+    conn = boto3.client('ec2', region_name='us-east-1')
+    reservation = conn.run_instances(ImageId='ami-1234abcd', MinCount=2, MaxCount=2, PrivateIpAddress="10.10.10.10")
+    instances = reservation['Instances']
     self.assertTrue(self.rolling_deploy.validate_instance_list(instances))
 
-  @mock_ec2_deprecated
-  @mock_autoscaling_deprecated
-  @mock_elb_deprecated
+  @mock_ec2
+  @mock_autoscaling
+  @mock_elb
   def test_failure_validate_instance_list(self):
     instances = []
     self.assertRaises(Exception, lambda: self.rolling_deploy.validate_instance_list(instances))
 
-  @mock_ec2_deprecated
-  @mock_autoscaling_deprecated
+  @mock_ec2
+  @mock_autoscaling
+  @mock_elb
   def test_get_instance_ids_by_requested_build_tag(self):
     self.setUpEC2()
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    conn = boto.connect_ec2()
-    new_inst = []
-    res_ids = conn.get_all_instances()
-    for i_id in res_ids:
-       for name in i_id.instances:
-         if [y for y in name.tags if y == 'BUILD' and name.tags['BUILD'] == '0']:
-           new_inst.append(name.id)
+    new_inst = self.instance_ids_with_build('0')
+    self.rolling_deploy.get_asg_info()
     self.rolling_deploy.new_desired_capacity = self.rolling_deploy.calculate_autoscale_desired_instance_count(self.GMS_AUTOSCALING_GROUP_STG, 'increase')
 
     self.assertEqual(len(self.rolling_deploy.get_instance_ids_by_requested_build_tag(new_inst, 0)), 2)
@@ -342,49 +500,79 @@ class RollingDeployTest(unittest.TestCase):
     self.rolling_deploy.force_redeploy = True
     self.assertRaises(Exception, lambda: self.rolling_deploy.get_instance_ids_by_requested_build_tag(new_inst, 0))
 
-  @mock_ec2_deprecated
-  @mock_autoscaling_deprecated
+  @mock_ec2
+  @mock_autoscaling
+  @mock_elb
   def test_get_instance_ids_by_requested_build_tag_race_condition(self):
     self.setUpEC2()
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
-    conn = boto.connect_ec2()
-    new_inst = []
-    res_ids = conn.get_all_instances()
-    for i_id in res_ids:
-       for name in i_id.instances:
-         if [y for y in name.tags if y == 'BUILD' and name.tags['BUILD'] == '0']:
-           new_inst.append(name.id)
-           break
+    new_inst = self.instance_ids_with_build('0')[:1]
     self.rolling_deploy.force_redeploy = True
+    self.rolling_deploy.get_asg_info()
     self.rolling_deploy.new_desired_capacity = self.rolling_deploy.calculate_autoscale_desired_instance_count(self.GMS_AUTOSCALING_GROUP_STG, 'increase')
     self.assertRaises(Exception, lambda: self.rolling_deploy.get_instance_ids_by_requested_build_tag(new_inst, 1))
 
 
-  @mock_ec2_deprecated
+  @mock_ec2
+  @mock_elb
   def test_get_instance_ids_by_requested_build_tag_failure(self):
     self.setUpEC2()
     self.assertRaises(Exception, lambda: self.rolling_deploy.get_instance_ids_by_requested_build_tag([], 0))
 
-  @mock_autoscaling_deprecated
+  @mock_autoscaling
+  @mock_ec2
   def test_set_autoscale_instance_desired_count(self):
     self.setUpAutoScaleGroup([self.get_autoscaling_configurations(self.GMS_LAUNCH_CONFIGURATION_STG, self.GMS_AUTOSCALING_GROUP_STG)])
     self.assertTrue(self.rolling_deploy.set_autoscale_instance_desired_count(4, self.GMS_AUTOSCALING_GROUP_STG))
 
-  @mock_ec2_deprecated
+  @mock_ec2
+  @mock_elb
   def test_wait_for_new_instances(self):
     instance_ids = self.setUpEC2()[1]
     self.assertEqual(self.rolling_deploy.wait_for_new_instances(instance_ids, 9), None)
 
-  @mock_ec2_deprecated
-  def test_wait_for_new_instances_failure(self):
-    conn = self.setUpEC2()[0]
+  @mock_ec2
+  @mock_elb
+  def test_get_ready_instance_ids(self):
+    conn, instance_ids = self.setUpEC2()
+    conn.stop_instances(InstanceIds=instance_ids[:1])
+    self.assertEqual(self.rolling_deploy.get_ready_instance_ids(instance_ids), set(instance_ids[1:]))
+
+  @mock_ec2
+  @mock_elb
+  def test_wait_for_new_instances_polls_all_instances_at_once(self):
     instance_ids = self.setUpEC2()[1]
-    reservations = conn.get_all_instances()
-    reservations[0].instances[0].stop()
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.wait_for_new_instances(instance_ids, 3, 1))
+    ec2 = self.rolling_deploy.ec2
+    with patch.object(ec2, 'describe_instance_status', wraps=ec2.describe_instance_status) as status:
+      self.rolling_deploy.wait_for_new_instances(instance_ids, 3, 1)
+    status.assert_called_once_with(InstanceIds=sorted(instance_ids))
+
+  @mock_ec2
+  @mock_elb
+  def test_wait_for_new_instances_failure(self):
+    conn, instance_ids = self.setUpEC2()
+    conn.stop_instances(InstanceIds=instance_ids[:1])
+    self.assertRaises(Exception, lambda: self.rolling_deploy.wait_for_new_instances(instance_ids, 3, 1))
 
+  @mock_autoscaling
   def test_set_autoscale_instance_desired_count_failure(self):
-    self.assertRaises(SystemExit, lambda: self.rolling_deploy.set_autoscale_instance_desired_count(4, self.GMS_AUTOSCALING_GROUP_STG))
+    self.assertRaises(Exception, lambda: self.rolling_deploy.set_autoscale_instance_desired_count(4, self.GMS_AUTOSCALING_GROUP_STG))
+
+  def test_replace_instances_in_batches(self):
+    self.rolling_deploy.original_instance_ids = ['i-1', 'i-2', 'i-3']
+    self.rolling_deploy.batch_size = 2
+    new_instance_counts = []
+    def launch_new_instances(group_name):
+      new_instance_counts.append(self.rolling_deploy.get_new_instances_count())
+      return ['n-{0}'.format(i) for i in range(new_instance_counts[-1])]
+    with patch.object(self.rolling_deploy, 'set_autoscale_instance_desired_count') as set_count, \
+         patch.object(self.rolling_deploy, 'launch_new_instances', side_effect=launch_new_instances), \
+         patch.object(self.rolling_deploy, 'terminate_instances') as terminate:
+      self.rolling_deploy.replace_instances_in_batches('group')
+    self.assertEqual([c[0][0] for c in set_count.call_args_list], [5, 4, 3])
+    self.assertEqual(new_instance_counts, [2, 3])
+    self.assertEqual([c[0][0] for c in terminate.call_args_list], [['i-1', 'i-2'], ['i-3']])
+    self.assertEqual(self.rolling_deploy.promoted_instance_ids, ['n-0', 'n-1', 'n-2'])
 
   def test_double_autoscale_instance_count(self):
     self.assertEqual(self.rolling_deploy.double_autoscale_instance_count(2), 4)
@@ -0,0 +1,77 @@
+import unittest
+
+from License2Deploy.AWSConn import AWSConn
+from License2Deploy.simulated_aws import SimulatedAWS, SimulatedThrottle
+from tests.simulation import SimulatedDeployTest
+
+
+class SimulatedAWSTest(unittest.TestCase):
+
+  def test_new_instances_lag_behind_launch(self):
+    aws = SimulatedAWS(2, consistency_delay=60)
+    aws.deploy_build = '2'
+    aws.set_desired_capacity(4)
+    self.assertEqual(len(aws.group_instances), 4)
+    self.assertEqual(len(aws.visible_instance_ids()), 2)
+
+  def test_throttling(self):
+    aws = SimulatedAWS(1, throttle_rate=1)
+    try:
+      aws.clients()['ec2'].describe_images()
+      self.fail('expected a throttling error')
+    except SimulatedThrottle as e:
+      self.assertTrue(AWSConn.is_throttling_error(e))
+    self.assertEqual(aws.calls, {'ec2.DescribeImages': 1, 'throttled': 1})
+
+  def test_alarms_are_paged(self):
+    aws = SimulatedAWS(1, alarm_count=3)
+    cloudwatch = aws.clients()['cloudwatch']
+    first = cloudwatch.describe_alarms(MaxRecords=2)
+    self.assertEqual((len(first['MetricAlarms']), first['NextToken']), (2, '2'))
+    self.assertEqual(len(cloudwatch.describe_alarms(MaxRecords=2, NextToken=first['NextToken'])['MetricAlarms']), 1)
+
+
+class SimulatedDeployRunTest(SimulatedDeployTest):
+
+  def test_deploy_replaces_fleet(self):
+    aws = self.simulated_aws(4, alarm_count=3)
+    deploy = self.build_deploy(aws)
+    deploy.deploy()
+    self.assertEqual(deploy.metrics.status, 'succeeded')
+    self.assertEqual(aws.calls['autoscaling.TerminateInstanceInAutoScalingGroup'], 4)
+    self.assertTrue('bring_up_new_instances' in [phase['name'] for phase in deploy.metrics.phases])
+
+  def test_batch_mode(self):
+    aws = self.simulated_aws(4)
+    self.build_deploy(aws, mode='batch', batch_size=2).deploy()
+    self.assertEqual(aws.calls['autoscaling.SetDesiredCapacity'], 3)
+
+  def test_every_target_group_is_checked(self):
+    aws = self.simulated_aws(2, target_group_count=3)
+    self.build_deploy(aws).deploy()
+    self.assertEqual(aws.calls['elbv2.DeregisterTargets'], 3)
+
+  def test_old_instances_drain_before_termination(self):
+    aws = self.simulated_aws(4, target_group_count=2, drain_delay=0.2)
+    deploy = self.build_deploy(aws)
+    deploy.deploy()
+    self.assertEqual(deploy.drain_timeout, 1)
+    self.assertEqual(aws.calls['elbv2.DescribeTargetGroupAttributes'], 2)
+    self.assertEqual(aws.terminated_draining, [])
+    self.assertTrue('drain' in deploy.wait_histogram.durations)
+
+  def test_zero_drain_timeout_terminates_right_away(self):
+    aws = self.simulated_aws(4, drain_delay=60)
+    self.build_deploy(aws, drain_timeout=0).deploy()
+    self.assertEqual(len(aws.terminated_draining), 4)
+    self.assertFalse('elbv2.DescribeTargetGroupAttributes' in aws.calls)
+
+  def test_partly_launched_pipeline_is_reverted(self):
+    aws = self.simulated_aws(4)
+    originals = list(aws.group_instances)
+    launch = aws.launch
+    aws.launch = lambda count, build, ready=False: launch(count - 1, build, ready)
+    deploy = self.build_deploy(aws, mode='pipeline')
+    deploy.pipeline_wait = [10, 0.01]
+    self.assertRaises(Exception, deploy.deploy)
+    self.assertEqual((aws.desired_capacity, aws.group_instances), (4, originals))
@@ -0,0 +1,24 @@
+import shutil
+import tempfile
+import unittest
+
+from License2Deploy.simulated_aws import SimulatedAWS, simulated_deploy
+
+
+class SimulatedDeployTest(unittest.TestCase):
+  """ Base of the tests deploying to a SimulatedAWS, every file they write kept in a temporary directory """
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def simulated_aws(self, fleet_size, **options):
+    """ SimulatedAWS whose new instances run build 2 """
+    aws = SimulatedAWS(fleet_size, **options)
+    aws.deploy_build = '2'
+    return aws
+
+  def build_deploy(self, aws, **settings):
+    return simulated_deploy(aws, self.directory, **settings)
@@ -0,0 +1,81 @@
+import unittest
+from mock import MagicMock, call, patch
+from botocore.exceptions import ClientError
+
+from License2Deploy.cancellation import CancellationToken
+from License2Deploy.terminator import InstanceTerminator
+
+
+class InstanceTerminatorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.asg = MagicMock()
+    self.elb = MagicMock()
+    self.elb2 = MagicMock()
+    self.terminator = InstanceTerminator(self.asg, self.elb, self.elb2, ['lb'], ['arn:tg'], max_workers=2, backoff=0)
+
+  def throttling_error(self):
+    return ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'TerminateInstanceInAutoScalingGroup')
+
+  def test_terminate_deregisters_in_bulk_first(self):
+    report = self.terminator.terminate(['i-1', 'i-2', 'i-3'])
+    self.elb.deregister_instances_from_load_balancer.assert_called_once_with(
+      LoadBalancerName='lb', Instances=[{'InstanceId': 'i-1'}, {'InstanceId': 'i-2'}, {'InstanceId': 'i-3'}])
+    self.elb2.deregister_targets.assert_called_once_with(TargetGroupArn='arn:tg', Targets=[{'Id': 'i-1'}, {'Id': 'i-2'}, {'Id': 'i-3'}])
+    self.asg.terminate_instance_in_auto_scaling_group.assert_has_calls(
+      [call(InstanceId=i, ShouldDecrementDesiredCapacity=True) for i in ['i-1', 'i-2', 'i-3']], any_order=True)
+    self.assertEqual(set(r['status'] for r in report.values()), set(['terminated']))
+
+  def test_terminate_retries_throttled_calls(self):
+    self.asg.terminate_instance_in_auto_scaling_group.side_effect = [self.throttling_error(), None]
+    self.assertEqual(self.terminator.terminate(['i-1']), {'i-1': {'status': 'terminated', 'attempts': 2}})
+
+  def test_terminate_reports_failures(self):
+    self.asg.terminate_instance_in_auto_scaling_group.side_effect = Exception('gone')
+    report = self.terminator.terminate(['i-1'])
+    self.assertEqual(report['i-1']['status'], 'failed')
+    self.assertEqual(report['i-1']['attempts'], 1)
+
+  def test_terminate_nothing(self):
+    self.assertEqual(self.terminator.terminate([]), {})
+    self.elb.deregister_instances_from_load_balancer.assert_not_called()
+
+  def test_deregisters_from_every_balancer(self):
+    terminator = InstanceTerminator(self.asg, self.elb, self.elb2, ['lb1', 'lb2'], ['arn:tg1', 'arn:tg2'], backoff=0)
+    terminator.terminate(['i-1'])
+    self.elb.deregister_instances_from_load_balancer.assert_has_calls(
+      [call(LoadBalancerName='lb1', Instances=[{'InstanceId': 'i-1'}]),
+       call(LoadBalancerName='lb2', Instances=[{'InstanceId': 'i-1'}])])
+    self.elb2.deregister_targets.assert_has_calls([call(TargetGroupArn='arn:tg1', Targets=[{'Id': 'i-1'}]),
+                                                   call(TargetGroupArn='arn:tg2', Targets=[{'Id': 'i-1'}])])
+
+  def draining_terminator(self, states, **kwargs):
+    self.elb2.describe_target_health.side_effect = [
+      {'TargetHealthDescriptions': [{'Target': {'Id': 'i-1'}, 'TargetHealth': {'State': state}}]} for state in states]
+    terminator = InstanceTerminator(self.asg, self.elb, self.elb2, [], ['arn:tg'], backoff=0, drain_timeout=60, **kwargs)
+    self.sleeps = []
+    return terminator
+
+  def test_terminates_once_drained(self):
+    terminator = self.draining_terminator(['draining', 'draining', 'unused'])
+    with patch('License2Deploy.poller.sleep', side_effect=self.sleeps.append):
+      terminator.terminate(['i-1'])
+    self.assertEqual(self.elb2.describe_target_health.call_count, 3)
+    self.assertEqual(len(self.sleeps), 2)
+    self.asg.terminate_instance_in_auto_scaling_group.assert_called_once_with(InstanceId='i-1', ShouldDecrementDesiredCapacity=True)
+
+  def test_unknown_targets_are_drained(self):
+    terminator = self.draining_terminator([])
+    self.elb2.describe_target_health.side_effect = ClientError(
+      {'Error': {'Code': 'InvalidTarget', 'Message': 'not registered'}}, 'DescribeTargetHealth')
+    terminator.terminate(['i-1'])
+    self.assertEqual(self.elb2.describe_target_health.call_count, 1)
+    self.assertEqual(self.asg.terminate_instance_in_auto_scaling_group.call_count, 1)
+
+  def test_cancelled_token_stops_draining(self):
+    token = CancellationToken()
+    token.cancel()
+    terminator = self.draining_terminator(['draining'], token=token)
+    terminator.terminate(['i-1'])
+    self.elb2.describe_target_health.assert_not_called()
+    self.assertEqual(self.asg.terminate_instance_in_auto_scaling_group.call_count, 1)